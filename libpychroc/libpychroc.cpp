@@ -19,6 +19,8 @@
 #include <sys/types.h>
 #include <sys/mman.h>
 #include <sys/stat.h>
+#include <stdlib.h>
+#include <string.h>
 
 extern "C"
 {
@@ -53,5 +55,108 @@ long long try_atomic_write_mmap(void *data, size_t offset, long long prev, long
   return __sync_val_compare_and_swap(valp, prev, val);
 }
 
+int advise_mmap(void *data, size_t size, int advice) {
+  return madvise(data, size, advice);
+}
+
+int lock_mmap(void *data, size_t size) {
+  return mlock(data, size);
+}
+
+// touches a byte of each page so later accesses do not fault, returns the number of pages
+long long prefault_mmap(void *data, size_t size) {
+  long page = sysconf(_SC_PAGESIZE);
+  volatile unsigned char *p = (volatile unsigned char*)data;
+  unsigned char sum = 0;
+  long long pages = 0;
+  for (size_t offset = 0; offset < size; offset += page, ++pages) {
+    sum += p[offset];
+  }
+  (void)sum;
+  return pages;
+}
+
+// number of pages of the mapping resident in memory, or -1
+long long resident_mmap(void *data, size_t size) {
+  long page = sysconf(_SC_PAGESIZE);
+  size_t pages = (size + page - 1) / page;
+  unsigned char *vec = (unsigned char*)malloc(pages);
+  if (!vec) {
+    return -1;
+  }
+  if (mincore(data, size, vec) != 0) {
+    free(vec);
+    return -1;
+  }
+  long long resident = 0;
+  for (size_t i = 0; i < pages; ++i) {
+    resident += vec[i] & 1;
+  }
+  free(vec);
+  return resident;
+}
+
+// field types of filter_index, as MessageFilter numbers them
+enum { FILTER_BYTE, FILTER_BOOLEAN, FILTER_SHORT, FILTER_INT, FILTER_LONG, FILTER_DOUBLE };
+
+static int filter_field_matches(const unsigned char *field, int type, const long long *values, long long count) {
+  long long ival = 0;
+  double dval = 0;
+  // fields need not be aligned
+  switch (type) {
+    case FILTER_BYTE: ival = *field; break;
+    case FILTER_BOOLEAN: ival = *field != 0; break;
+    case FILTER_SHORT: { short v; memcpy(&v, field, sizeof(v)); ival = v; break; }
+    case FILTER_INT: { int v; memcpy(&v, field, sizeof(v)); ival = v; break; }
+    case FILTER_LONG: memcpy(&ival, field, sizeof(ival)); break;
+    case FILTER_DOUBLE: memcpy(&dval, field, sizeof(dval)); break;
+  }
+  // values are sorted, doubles stored as their bits
+  long long lo = 0, hi = count;
+  while (lo < hi) {
+    long long mid = (lo + hi) / 2;
+    if (type == FILTER_DOUBLE) {
+      double v;
+      memcpy(&v, values + mid, sizeof(v));
+      if (v == dval) return 1;
+      if (v < dval) lo = mid + 1; else hi = mid;
+    } else {
+      if (values[mid] == ival) return 1;
+      if (values[mid] < ival) lo = mid + 1; else hi = mid;
+    }
+  }
+  return 0;
+}
+
+// Scans up to count index entries from index while they are written messages of one data file, those whose
+// bits other than the position (pos_mask) are key, for the first whose fields match. data is a mapping of
+// the data file of size bytes. Field i is at offsets[i] in the message, of types[i], and matches one of
+// value_counts[i] values, which follow those of the previous fields in values. The last field ends end bytes
+// into the message. Returns the number of entries passed over, and sets *matched if the entry after them
+// matched. Stops before an entry whose fields would extend beyond the data file.
+long long filter_index(const long long *index, long long count, long long key_mask, long long key, long long pos_mask,
+                       const unsigned char *data, long long size, int fields, const int *offsets, const int *types,
+                       const long long *value_counts, const long long *values, long long end, int *matched) {
+  *matched = 0;
+  for (long long i = 0; i < count; ++i) {
+    long long val = index[i];
+    long long pos = val & pos_mask;
+    if ((val & key_mask) != key || !pos || pos + end > size) {
+      return i;
+    }
+    const long long *field_values = values;
+    int match = 1;
+    for (int f = 0; f < fields && match; ++f) {
+      match = filter_field_matches(data + pos + offsets[f], types[f], field_values, value_counts[f]);
+      field_values += value_counts[f];
+    }
+    if (match) {
+      *matched = 1;
+      return i;
+    }
+  }
+  return count;
+}
+
 }
 
@@ -14,7 +14,7 @@
 # limitations under the License.
 #
 
-__all__ = ['vanilla_reader', 'vanilla_writer', '_pychro']
+__all__ = ['vanilla_reader', 'vanilla_writer', '_pychro', 'exporter', 'archive', 'compact', 'time_index', 'key_index', 'filters', 'checkpoint', 'warmup', 'replication', 'pool', 'durability', 'config', 'retention', 'consumer_group', 'pipeline', 'lag', 'replay', 'check']
 
 import platform
 
@@ -68,4 +68,22 @@ class NoChronicleForDate(PychroException):
 
 from pychro.vanilla_reader import *
 from pychro.vanilla_writer import *
-from pychro._pychro import *
\ No newline at end of file
+from pychro._pychro import *
+from pychro.exporter import *
+from pychro.archive import *
+from pychro.compact import *
+from pychro.time_index import *
+from pychro.key_index import *
+from pychro.filters import *
+from pychro.checkpoint import *
+from pychro.warmup import *
+from pychro.replication import *
+from pychro.pool import *
+from pychro.durability import *
+from pychro.config import *
+from pychro.retention import *
+from pychro.consumer_group import *
+from pychro.pipeline import *
+from pychro.lag import *
+from pychro.replay import *
+from pychro.check import *
\ No newline at end of file
@@ -46,6 +46,27 @@ cdll.close_mmap.restype = ctypes.c_int
 cdll.read_mmap.restype = ctypes.c_longlong
 cdll.try_atomic_write_mmap.restype = ctypes.c_longlong
 
+# Mapping control is only in libpychroc builds which include it, not the Windows library
+HAVE_MAPPING_CONTROL = hasattr(cdll, 'resident_mmap')
+if HAVE_MAPPING_CONTROL:
+    cdll.advise_mmap.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int]
+    cdll.advise_mmap.restype = ctypes.c_int
+    cdll.lock_mmap.argtypes = [ctypes.c_void_p, ctypes.c_size_t]
+    cdll.lock_mmap.restype = ctypes.c_int
+    cdll.prefault_mmap.argtypes = [ctypes.c_void_p, ctypes.c_size_t]
+    cdll.prefault_mmap.restype = ctypes.c_longlong
+    cdll.resident_mmap.argtypes = [ctypes.c_void_p, ctypes.c_size_t]
+    cdll.resident_mmap.restype = ctypes.c_longlong
+
+# As is the native scan used by MessageFilter
+HAVE_NATIVE_FILTER = hasattr(cdll, 'filter_index')
+if HAVE_NATIVE_FILTER:
+    cdll.filter_index.argtypes = [ctypes.c_void_p, ctypes.c_longlong, ctypes.c_longlong, ctypes.c_longlong,
+                                  ctypes.c_longlong, ctypes.c_void_p, ctypes.c_longlong, ctypes.c_int,
+                                  ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p,
+                                  ctypes.c_longlong, ctypes.POINTER(ctypes.c_int)]
+    cdll.filter_index.restype = ctypes.c_longlong
+
 
 def get_thread_id():
     return cdll.get_thread_id()
@@ -88,4 +109,36 @@ def try_atomic_write_mmap(mh, offset, prev, val):
 
 
 def unsafe_write_mmap(mh, offset, val):
-    cdll.try_atomic_write_mmap(mh, offset, cdll.read_mmap(mh, offset), val)
\ No newline at end of file
+    cdll.try_atomic_write_mmap(mh, offset, cdll.read_mmap(mh, offset), val)
+
+
+def advise_mmap(mh, size, advice):
+    if cdll.advise_mmap(mh, size, advice) == -1:
+        raise PychroCError
+
+
+def lock_mmap(mh, size):
+    if cdll.lock_mmap(mh, size) == -1:
+        raise PychroCError
+
+
+# Returns the number of pages touched
+def prefault_mmap(mh, size):
+    return cdll.prefault_mmap(mh, size)
+
+
+# Returns the number of pages resident in memory
+def resident_mmap(mh, size):
+    res = cdll.resident_mmap(mh, size)
+    if res == -1:
+        raise PychroCError
+    return res
+
+
+# Returns (entries passed over, whether the entry after them matched)
+def filter_index(address, count, key_mask, key, pos_mask, data, size, conditions):
+    matched = ctypes.c_int()
+    passed = cdll.filter_index(address, count, key_mask, key, pos_mask, data, size, conditions.fields,
+                               conditions.offsets, conditions.types, conditions.value_counts, conditions.values,
+                               conditions.end, ctypes.byref(matched))
+    return passed, bool(matched.value)
\ No newline at end of file
@@ -0,0 +1,212 @@
+#
+#  Copyright 2015 Jon Turner
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import collections
+import datetime
+import json
+import lzma
+import os
+import shutil
+import struct
+import zlib
+import pychro
+
+# Archive layout:
+#   magic | compressed blocks ... | toc | footer
+# The toc is zlib compressed json holding, for each file of the cycle, its original size, the
+# length before the trailing zero padding and the (offset, length) of each compressed block.
+# The footer holds the toc offset and length so the archive can be written in a single pass.
+
+ARCHIVE_SUFFIX = '.pca'
+ARCHIVE_MAGIC = b'PYCHROA1'
+ARCHIVE_FOOTER = struct.Struct('<QQ8s')
+DEFAULT_ARCHIVE_BLOCK_SIZE = 256*1024
+DEFAULT_ARCHIVE_CACHED_BLOCKS = 64
+
+CODECS = {
+    'zlib': (zlib.compress, zlib.decompress),
+    'lzma': (lzma.compress, lzma.decompress),
+}
+
+
+def _used_length(fh, size, block_size):
+    end = size
+    zeros = bytes(block_size)
+    while end > 0:
+        start = max(0, end - block_size)
+        fh.seek(start)
+        block = fh.read(end - start)
+        # comparing is much faster than stripping a block of zeros
+        if block != zeros[:len(block)]:
+            return start + len(block.rstrip(b'\x00'))
+        end = start
+    return 0
+
+
+def _check_closed(name, config, utcnow):
+    config = config or pychro.DEFAULT_CONFIG
+    cycle = config.parse_cycle_name(name)
+    if cycle is None:
+        raise pychro.InvalidArgumentError('%s is not a cycle' % name)
+    if cycle >= config.cycle_of(utcnow()):
+        raise pychro.InvalidArgumentError('Cycle %s is not closed' % name)
+
+
+def archive_cycle(cycle_dir, codec='zlib', block_size=DEFAULT_ARCHIVE_BLOCK_SIZE, remove=True,
+                  utcnow=datetime.datetime.utcnow, config=None):
+    # Packs a closed cycle directory into <cycle_dir>.pca and, if remove, deletes the directory.
+    # Returns the archive path. Readers prefer the directory while both exist.
+    cycle_dir = os.path.normpath(cycle_dir)
+    name = os.path.basename(cycle_dir)
+    _check_closed(name, config, utcnow)
+    if codec not in CODECS:
+        raise pychro.InvalidArgumentError('Unknown codec %s' % codec)
+    compress = CODECS[codec][0]
+
+    path = cycle_dir + ARCHIVE_SUFFIX
+    tmp_path = path + '.tmp'
+    toc = {'version': 1, 'codec': codec, 'block_size': block_size, 'files': dict()}
+    with open(tmp_path, 'wb') as out:
+        out.write(ARCHIVE_MAGIC)
+        for fn in sorted(os.listdir(cycle_dir)):
+            fp = os.path.join(cycle_dir, fn)
+            if not os.path.isfile(fp):
+                continue
+            with open(fp, 'rb') as fh:
+                size = os.fstat(fh.fileno()).st_size
+                length = _used_length(fh, size, block_size)
+                blocks = []
+                fh.seek(0)
+                pos = 0
+                while pos < length:
+                    data = compress(fh.read(min(block_size, length - pos)))
+                    blocks += [(out.tell(), len(data))]
+                    out.write(data)
+                    pos += block_size
+            toc['files'][fn] = {'size': size, 'length': length, 'blocks': blocks}
+        toc_data = zlib.compress(json.dumps(toc).encode())
+        toc_offset = out.tell()
+        out.write(toc_data)
+        out.write(ARCHIVE_FOOTER.pack(toc_offset, len(toc_data), ARCHIVE_MAGIC))
+        out.flush()
+        os.fsync(out.fileno())
+    os.rename(tmp_path, path)
+    if remove:
+        shutil.rmtree(cycle_dir)
+    return path
+
+
+class CycleArchive:
+    # Read access to an archived cycle. Blocks are decompressed on demand and the most
+    # recently used max_cached_blocks are kept.
+
+    def __init__(self, path, max_cached_blocks=DEFAULT_ARCHIVE_CACHED_BLOCKS):
+        self._path = path
+        self._fh = open(path, 'rb')
+        self._fh.seek(-ARCHIVE_FOOTER.size, os.SEEK_END)
+        toc_offset, toc_len, magic = ARCHIVE_FOOTER.unpack(self._fh.read(ARCHIVE_FOOTER.size))
+        if magic != ARCHIVE_MAGIC:
+            raise pychro.CorruptData('Not a cycle archive: %s' % path)
+        self._fh.seek(toc_offset)
+        toc = json.loads(zlib.decompress(self._fh.read(toc_len)).decode())
+        self._decompress = CODECS[toc['codec']][1]
+        self._block_size = toc['block_size']
+        self._files = toc['files']
+        self._max_cached_blocks = max_cached_blocks
+        self._blocks = collections.OrderedDict()
+
+    def __str__(self):
+        return '<CycleArchive %s>' % self._path
+
+    def files(self):
+        return sorted(self._files)
+
+    def _block(self, name, block_num):
+        key = (name, block_num)
+        block = self._blocks.get(key)
+        if block is not None:
+            self._blocks.move_to_end(key)
+            return block
+        offset, length = self._files[name]['blocks'][block_num]
+        self._fh.seek(offset)
+        block = self._decompress(self._fh.read(length))
+        self._blocks[key] = block
+        if len(self._blocks) > self._max_cached_blocks:
+            self._blocks.popitem(last=False)
+        return block
+
+    def read(self, name, start, stop):
+        info = self._files[name]
+        stop = min(stop, info['size'])
+        if start >= stop:
+            return b''
+        parts = []
+        pos = start
+        data_stop = min(stop, info['length'])
+        while pos < data_stop:
+            block_num, block_offset = divmod(pos, self._block_size)
+            block = self._block(name, block_num)
+            part = block[block_offset:block_offset + data_stop - pos]
+            parts += [part]
+            pos += len(part)
+        if pos < stop:
+            parts += [b'\x00'*(stop - pos)]
+        return b''.join(parts)
+
+    def read_index(self, index_filenum, index_offset):
+        name = 'index-%s' % index_filenum
+        if name not in self._files:
+            return 0
+        # a compacted index file ends after its last written entry, those after are unwritten
+        if index_offset + 8 > self._files[name]['size']:
+            return 0
+        return struct.unpack('q', self.read(name, index_offset, index_offset + 8))[0]
+
+    def open_data(self, name):
+        if name not in self._files:
+            raise KeyError(name)
+        return ArchivedFile(self, name, self._files[name]['size'])
+
+    def close(self):
+        self._blocks.clear()
+        self._fh.close()
+
+
+class ArchivedFile:
+    # Read only, bytes-like view of one file of a CycleArchive, as used by RawByteReader.
+
+    def __init__(self, archive, name, size):
+        self._archive = archive
+        self._name = name
+        self._size = size
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            start, stop, step = item.indices(self._size)
+            if step != 1:
+                raise pychro.InvalidArgumentError('Archived data does not support stepped slices')
+            return self._archive.read(self._name, start, stop)
+        if item < 0:
+            item += self._size
+        if not 0 <= item < self._size:
+            raise IndexError(item)
+        return self._archive.read(self._name, item, item + 1)[0]
+
+    def close(self):
+        pass
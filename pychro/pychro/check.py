@@ -0,0 +1,286 @@
+#
+#  Copyright 2015 Jon Turner
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import argparse
+import array
+import collections
+import multiprocessing
+import os
+import struct
+import time
+import pychro
+from .archive import ARCHIVE_SUFFIX, _used_length
+from .retention import lock_cycle_shared, release_cycle_lock
+from .vanilla_reader import default_thread_id_bits, data_file_has_lengths
+
+# Checks the index and data files of a chronicle, in chunks of index entries scanned by worker processes.
+# Each written index entry must point into an existing data file. In data files with message lengths
+# (see data_file_has_lengths) the message must be preceded by its length and end within the file, and
+# the length must lead to the next message of the file, at the following 4 byte boundary. Messages of
+# earlier data files without lengths are only checked to be within the file. Unwritten (zero) entries
+# before the last written entry of a cycle are reported as index gaps. Archived cycles are skipped.
+#
+# Run as a tool with: python -m pychro check <base_dir>
+
+DEFAULT_CHECK_CHUNK_ENTRIES = 1024*1024
+
+
+class CheckReport:
+    # anomalies are [(full index, kind, detail)] in full index order, threads {thread id: messages}
+
+    def __init__(self):
+        self.cycles = 0
+        self.messages = 0
+        self.threads = collections.Counter()
+        self.anomalies = []
+        self.skipped = []
+        self.elapsed = 0.0
+
+    def __str__(self):
+        return '<CheckReport cycles:%s msgs:%s threads:%s anomalies:%s skipped:%s elapsed:%.3fs>' % (
+            self.cycles, self.messages, len(self.threads), len(self.anomalies), len(self.skipped), self.elapsed)
+
+    def ok(self):
+        return not self.anomalies
+
+
+# The length of an index file up to its last written entry. Java Vanilla Chronicle creates index files
+# sparse, so the search for it starts from the end of the last extent holding data where the OS reports
+# them. pychro writes its index files out in full, leaving the search to start from the end of the file.
+def _index_length(path, size):
+    with open(path, 'rb') as fh:
+        end = size
+        if hasattr(os, 'SEEK_HOLE'):
+            try:
+                end = pos = 0
+                while pos < size:
+                    pos = os.lseek(fh.fileno(), os.lseek(fh.fileno(), pos, os.SEEK_DATA), os.SEEK_HOLE)
+                    end = min(pos, size)
+            except OSError:
+                # no data after pos
+                pass
+        return -(-_used_length(fh, end, 64*1024)//8)*8
+
+
+# Where the message after one at pos of length starts in a data file with message lengths
+def _next_start(pos, length):
+    return ((pos + length + 3) & ~3) + 4
+
+
+def _length_mismatch(key, full_index, pos, length, next_pos):
+    cycle_dir, thread, filenum = key
+    return (full_index, 'length mismatch',
+            'data-%s-%s at %s length %s, next message at %s' % (thread, filenum, pos, length, next_pos))
+
+
+def _check_chunk(cycle_dir, index_filenum, start, end, full_index_base, thread_id_bits, config):
+    # Returns (messages per thread, anomalies, zero runs, last written entry or -1, edges) of entries start
+    # to end. edges are ({data file: (full index, pos or None)} of the first message of each data file with
+    # lengths, {data file: (full index, pos, length or None)} of the last), for the lengths of messages
+    # either side of a chunk boundary to be checked. None is an offset or length which cannot be checked.
+    offset_bits = 64 - thread_id_bits
+    offset_mask = (1 << offset_bits) - 1
+    threads = collections.Counter()
+    anomalies = []
+    zero_runs = []
+    last_written = -1
+    data_files = dict()
+    firsts = dict()
+    lasts = dict()
+    last_zero = -1
+    with open(os.path.join(cycle_dir, 'index-%s' % index_filenum), 'rb') as fh:
+        fh.seek(start*8)
+        raw = fh.read((end - start)*8).rstrip(b'\x00')
+    entries = array.array('q', raw + b'\x00'*(-len(raw) % 8))
+    zero_start = None
+    try:
+        for i, val in enumerate(entries):
+            full_index = full_index_base + start + i
+            pos = val & offset_mask
+            if not pos:
+                if zero_start is None:
+                    zero_start = full_index
+                last_zero = full_index
+                continue
+            if zero_start is not None:
+                zero_runs += [(zero_start, full_index)]
+                zero_start = None
+            last_written = full_index
+            thread = (val >> offset_bits) & ((1 << thread_id_bits) - 1)
+            filenum = pos >> config.filenum_from_pos_shift
+            pos &= config.pos_mask
+            threads[thread] += 1
+            data, size, has_lengths = data_files.get((thread, filenum), (None, 0, False))
+            if data is None:
+                try:
+                    data = open(os.path.join(cycle_dir, 'data-%s-%s' % (thread, filenum)), 'rb')
+                    size = os.fstat(data.fileno()).st_size
+                    has_lengths = data_file_has_lengths(data.read(4))
+                except FileNotFoundError:
+                    data = False
+                data_files[(thread, filenum)] = (data, size, has_lengths)
+            if data is False:
+                anomalies += [(full_index, 'missing data file', 'data-%s-%s' % (thread, filenum))]
+                continue
+            key = (cycle_dir, thread, filenum)
+            if pos < 4 or pos > size:
+                anomalies += [(full_index, 'offset beyond file', 'data-%s-%s at %s of %s' % (thread, filenum, pos, size))]
+                # neither this offset nor the last length can be checked against the other
+                firsts.setdefault(key, (full_index, None))
+                lasts[key] = (full_index, pos, None)
+                continue
+            if not has_lengths:
+                continue
+            last = lasts.get(key)
+            if last is None:
+                firsts[key] = (full_index, pos)
+            elif last[2] is not None and last[0] > last_zero and _next_start(last[1], last[2]) != pos:
+                # messages of unwritten entries in between are reported as an index gap
+                anomalies += [_length_mismatch(key, last[0], last[1], last[2], pos)]
+            data.seek(pos - 4)
+            length = ~struct.unpack('i', data.read(4))[0]
+            lasts[key] = (full_index, pos, None)
+            if length < 0:
+                anomalies += [(full_index, 'no length', 'data-%s-%s at %s' % (thread, filenum, pos))]
+            elif pos + length > size:
+                anomalies += [(full_index, 'message beyond file',
+                               'data-%s-%s at %s length %s of %s' % (thread, filenum, pos, length, size))]
+            else:
+                lasts[key] = (full_index, pos, length)
+    finally:
+        [data.close() for data, _, _ in data_files.values() if data]
+    if len(entries) < end - start:
+        zero_runs += [(full_index_base + start + len(entries), full_index_base + end)]
+    return threads, anomalies, zero_runs, last_written, (firsts, lasts)
+
+
+def _check_chunk_args(args):
+    return _check_chunk(*args)
+
+
+def check_chronicle(base_dir, workers=None, chunk_entries=DEFAULT_CHECK_CHUNK_ENTRIES, thread_id_bits=None,
+                    config=None):
+    # Returns a CheckReport of the chronicle in base_dir, scanned by workers processes (the CPU count
+    # by default), or in this process if workers is 1.
+    config = config or pychro.DEFAULT_CONFIG
+    thread_id_bits = thread_id_bits or default_thread_id_bits()
+    report = CheckReport()
+    start_time = time.time()
+    entries_per_file = config.index_block_size//8
+    chunks = []
+    # held while the workers check the cycles, so a RetentionManager leaves them alone
+    cycle_locks = []
+    try:
+        for f in sorted(os.listdir(base_dir)):
+            name = f[:-len(ARCHIVE_SUFFIX)] if f.endswith(ARCHIVE_SUFFIX) else f
+            cycle = config.parse_cycle_name(name)
+            if cycle is None:
+                continue
+            cycle_dir = os.path.join(base_dir, f)
+            if f.endswith(ARCHIVE_SUFFIX) or not os.path.isdir(cycle_dir):
+                report.skipped += [cycle_dir]
+                continue
+            cycle_lock = lock_cycle_shared(cycle_dir)
+            if cycle_lock is None and not os.path.isdir(cycle_dir):
+                # removed meanwhile
+                report.skipped += [cycle_dir]
+                continue
+            cycle_locks += [cycle_lock]
+            report.cycles += 1
+            index_filenum = 0
+            while os.path.isfile(os.path.join(cycle_dir, 'index-%s' % index_filenum)):
+                path = os.path.join(cycle_dir, 'index-%s' % index_filenum)
+                size = _index_length(path, min(os.path.getsize(path), config.index_block_size))
+                base = (cycle << config.cycle_index_pos) + index_filenum*entries_per_file
+                for start in range(0, size//8, chunk_entries):
+                    chunks += [(cycle_dir, index_filenum, start, min(start + chunk_entries, size//8), base,
+                                thread_id_bits, config)]
+                index_filenum += 1
+        if workers == 1:
+            results = [_check_chunk(*chunk) for chunk in chunks]
+        else:
+            with multiprocessing.Pool(workers) as pool:
+                results = pool.map(_check_chunk_args, chunks)
+    finally:
+        [release_cycle_lock(cycle_lock) for cycle_lock in cycle_locks]
+
+    zero_runs = []
+    last_written = dict()
+    lasts = dict()
+    mismatches = []
+    # chunks are in index order, so the last message of a data file in one chunk is followed by the first
+    # of it in a later chunk
+    for threads, anomalies, runs, last, (chunk_firsts, chunk_lasts) in results:
+        report.threads.update(threads)
+        report.anomalies += anomalies
+        zero_runs += runs
+        if last >= 0:
+            cycle = last >> config.cycle_index_pos
+            last_written[cycle] = max(last_written.get(cycle, last), last)
+        for key, (full_index, pos) in chunk_firsts.items():
+            prev = lasts.get(key)
+            if prev is not None and prev[2] is not None and pos is not None and _next_start(prev[1], prev[2]) != pos:
+                mismatches += [(prev[0], full_index, _length_mismatch(key, prev[0], prev[1], prev[2], pos))]
+        lasts.update(chunk_lasts)
+    report.messages = sum(report.threads.values())
+    # runs ending at a chunk boundary are merged with the next, and the unwritten end of each cycle dropped
+    merged = []
+    for start, end in sorted(zero_runs):
+        if merged and merged[-1][1] == start:
+            merged[-1] = (merged[-1][0], end)
+        else:
+            merged += [(start, end)]
+    for start, end in merged:
+        if start < last_written.get(start >> config.cycle_index_pos, -1):
+            report.anomalies += [(start, 'index gap', '%s unwritten entries' % (end - start))]
+    # as within a chunk, lengths are not checked across an index gap
+    for prev, full_index, anomaly in mismatches:
+        if not any(start < full_index and end > prev + 1 for start, end in merged):
+            report.anomalies += [anomaly]
+    report.anomalies.sort()
+    report.elapsed = time.time() - start_time
+    return report
+
+
+def check_main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m pychro check', description='Checks a chronicle')
+    parser.add_argument('base_dir')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes, the CPU count by default')
+    parser.add_argument('--thread-id-bits', type=int, default=None)
+    # the VanillaChronicleConfig of chronicles not written with the defaults
+    parser.add_argument('--cycle-length', type=int, default=pychro.DEFAULT_CONFIG.cycle_length, help='seconds')
+    parser.add_argument('--cycle-format', default=None, help='the format of the cycle length by default')
+    parser.add_argument('--entries-per-cycle', type=int, default=None)
+    parser.add_argument('--data-block-size', type=int, default=None)
+    parser.add_argument('--index-block-size', type=int, default=None)
+    args = parser.parse_args(argv)
+    if not os.path.isdir(args.base_dir):
+        parser.error('%s is not a directory' % args.base_dir)
+    try:
+        config = pychro.VanillaChronicleConfig(cycle_length=args.cycle_length, cycle_format=args.cycle_format,
+                                               entries_per_cycle=args.entries_per_cycle,
+                                               data_block_size=args.data_block_size,
+                                               index_block_size=args.index_block_size)
+    except pychro.ConfigError as e:
+        parser.error(str(e))
+    report = check_chronicle(args.base_dir, workers=args.workers, thread_id_bits=args.thread_id_bits,
+                             config=config)
+    print(report)
+    for thread, messages in sorted(report.threads.items()):
+        print('thread %s: %s messages' % (thread, messages))
+    for full_index, kind, detail in report.anomalies:
+        print('%s %s: %s' % (full_index, kind, detail))
+    return 0 if report.ok() else 1
@@ -0,0 +1,164 @@
+#
+#  Copyright 2015 Jon Turner
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import hashlib
+import os
+import struct
+import tempfile
+import time
+import pychro
+from ._pychro import *
+
+# Consumer positions are kept in <base_dir>/checkpoints, shared by all processes:
+#
+#   header | magic, number of slots
+#   slots  | (name hash, full index, name) of 64 bytes each
+#
+# A consumer claims a slot by a CAS of its name hash into an empty slot, after which committing is a
+# single atomic 8 byte write of the full index of the next message to be read.
+#
+# Other positions in the same format, which are not consumers of the chronicle, are kept in files of their own
+# (filename), so that retention and lag monitoring do not see them.
+
+CHECKPOINT_FILE = 'checkpoints'
+CHECKPOINT_MAGIC = b'PYCHROC1'
+CHECKPOINT_HEADER_SIZE = 64
+CHECKPOINT_SLOT_SIZE = 64
+CHECKPOINT_NAME_SIZE = 48
+DEFAULT_CHECKPOINT_SLOTS = 1024
+
+
+def _name_hash(name):
+    h = struct.unpack('<q', hashlib.blake2b(name.encode(), digest_size=8).digest())[0]
+    return h or 1
+
+
+class CheckpointStore:
+    def __init__(self, base_dir, slots=DEFAULT_CHECKPOINT_SLOTS, filename=CHECKPOINT_FILE):
+        self._path = os.path.join(base_dir, filename)
+        if not os.path.isfile(self._path):
+            self._create(base_dir, slots)
+        self._fh = open(self._path, 'r+b')
+        header = self._fh.read(16)
+        if header[:8] != CHECKPOINT_MAGIC:
+            raise pychro.CorruptData('Not a checkpoint file: %s' % self._path)
+        self._slots = struct.unpack('<Q', header[8:16])[0]
+        self._size = CHECKPOINT_HEADER_SIZE + self._slots*CHECKPOINT_SLOT_SIZE
+        self._mm = open_write_mmap(self._fh, self._size)
+
+    def _create(self, base_dir, slots):
+        fd, tmp_path = tempfile.mkstemp(dir=base_dir)
+        with os.fdopen(fd, 'wb') as fh:
+            fh.write((CHECKPOINT_MAGIC + struct.pack('<Q', slots)).ljust(CHECKPOINT_HEADER_SIZE, b'\x00'))
+            fh.write(b'\x00'*slots*CHECKPOINT_SLOT_SIZE)
+        try:
+            os.link(tmp_path, self._path)
+        except FileExistsError:
+            pass
+        os.remove(tmp_path)
+
+    def _slot_offset(self, slot):
+        return CHECKPOINT_HEADER_SIZE + slot*CHECKPOINT_SLOT_SIZE
+
+    def _find(self, h):
+        for slot in range(self._slots):
+            val = read_mmap(self._mm, self._slot_offset(slot))
+            if val == h or val == 0:
+                return slot, val
+        return None, None
+
+    def _claim(self, name):
+        encoded = name.encode()
+        if len(encoded) > CHECKPOINT_NAME_SIZE:
+            raise pychro.InvalidArgumentError('Consumer name longer than %s bytes' % CHECKPOINT_NAME_SIZE)
+        h = _name_hash(name)
+        while True:
+            slot, val = self._find(h)
+            if slot is None:
+                raise pychro.NoSpace('No free checkpoint slots')
+            offset = self._slot_offset(slot)
+            if val == h:
+                return offset
+            if try_atomic_write_mmap(self._mm, offset, 0, h) == 0:
+                encoded = encoded.ljust(CHECKPOINT_NAME_SIZE, b'\x00')
+                for i in range(0, CHECKPOINT_NAME_SIZE, 8):
+                    unsafe_write_mmap(self._mm, offset + 16 + i, struct.unpack('<q', encoded[i:i+8])[0])
+                return offset
+
+    # flush_every commits and/or flush_interval seconds since the last flush, the position is forced
+    # to disk. With neither, durability is left to the OS.
+    def consumer(self, name, flush_every=None, flush_interval=None):
+        return ConsumerCheckpoint(self, name, self._claim(name), flush_every, flush_interval)
+
+    def _read_name(self, offset):
+        raw = b''.join(struct.pack('<q', read_mmap(self._mm, offset + 16 + i))
+                       for i in range(0, CHECKPOINT_NAME_SIZE, 8))
+        return raw.rstrip(b'\x00').decode()
+
+    # {name: full index} of every consumer which has committed
+    def positions(self):
+        ret = dict()
+        for slot in range(self._slots):
+            offset = self._slot_offset(slot)
+            if not read_mmap(self._mm, offset):
+                break
+            position = read_mmap(self._mm, offset + 8)
+            if position:
+                ret[self._read_name(offset)] = position
+        return ret
+
+    def flush(self):
+        os.fsync(self._fh.fileno())
+
+    def close(self):
+        if self._mm:
+            close_mmap(self._mm, self._size)
+            self._mm = None
+            self._fh.close()
+
+
+class ConsumerCheckpoint:
+    def __init__(self, store, name, offset, flush_every, flush_interval):
+        self._store = store
+        self._name = name
+        self._offset = offset + 8
+        self._flush_every = flush_every
+        self._flush_interval = flush_interval
+        self._unflushed = 0
+        self._last_flush = time.time()
+
+    def __str__(self):
+        return '<ConsumerCheckpoint %s:%s>' % (self._name, self.get())
+
+    # Full index of the next message to read, or 0 if nothing has been committed.
+    # VanillaChronicleReader(base_dir, full_index=checkpoint.get()) resumes from it.
+    def get(self):
+        return read_mmap(self._store._mm, self._offset)
+
+    def commit(self, full_index):
+        unsafe_write_mmap(self._store._mm, self._offset, full_index)
+        if self._flush_every is None and self._flush_interval is None:
+            return
+        self._unflushed += 1
+        if self._flush_every is not None and self._unflushed >= self._flush_every:
+            self.flush()
+        elif self._flush_interval is not None and time.time() - self._last_flush >= self._flush_interval:
+            self.flush()
+
+    def flush(self):
+        self._store.flush()
+        self._unflushed = 0
+        self._last_flush = time.time()
@@ -0,0 +1,95 @@
+#
+#  Copyright 2015 Jon Turner
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import array
+import datetime
+import mmap
+import os
+import struct
+import pychro
+from .archive import _check_closed, _used_length
+
+# Data files with message lengths are truncated at the end of their last message, found from the index.
+# Data files of earlier pychro appenders have no lengths, and a message may end in zero bytes, so those
+# keep tail_margin bytes after their last non-zero byte. The default matches the Appender's max_msg_size.
+DEFAULT_COMPACT_TAIL_MARGIN = 64*1024
+
+
+def _round_up(n, multiple):
+    return (n + multiple - 1)//multiple*multiple
+
+
+# {data file name: position of its last message} from the index files of cycle_dir
+def _last_messages(cycle_dir, data_files, thread_id_bits, config):
+    offset_bits = 64 - thread_id_bits
+    offset_mask = (1 << offset_bits) - 1
+    last = dict()
+    index_files = sorted((int(fn[len('index-'):]), fn) for fn in os.listdir(cycle_dir) if fn.startswith('index-'))
+    for _, fn in reversed(index_files):
+        with open(os.path.join(cycle_dir, fn), 'rb') as fh:
+            length = _used_length(fh, os.fstat(fh.fileno()).st_size, 1024*1024)
+            fh.seek(0)
+            entries = array.array('q', fh.read(-(-length//8)*8))
+        # the last entry of each data file is the first found from the end
+        for val in reversed(entries):
+            pos = val & offset_mask
+            if not pos:
+                continue
+            thread = (val >> offset_bits) & ((1 << thread_id_bits) - 1)
+            name = 'data-%s-%s' % (thread, pos >> config.filenum_from_pos_shift)
+            if name not in last:
+                last[name] = pos & config.pos_mask
+                if len(last) == len(data_files):
+                    return last
+    return last
+
+
+def _data_end(fh, size, last, tail_margin):
+    if last is not None and pychro.data_file_has_lengths(fh.read(4)):
+        fh.seek(last - 4)
+        length = ~struct.unpack('i', fh.read(4))[0]
+        if length >= 0:
+            return last + length
+    return _used_length(fh, size, 1024*1024) + tail_margin
+
+
+def compact_cycle(cycle_dir, tail_margin=DEFAULT_COMPACT_TAIL_MARGIN, thread_id_bits=None,
+                  utcnow=datetime.datetime.utcnow, config=None):
+    # Truncates the trailing zero padding of the index and data files of a closed cycle.
+    # Files are never truncated below one page, as empty files cannot be mapped. Index files are left shorter
+    # than an index block, so whatever reads them, directly or once archived, takes entries beyond their end
+    # as unwritten.
+    # Returns the number of bytes reclaimed.
+    cycle_dir = os.path.normpath(cycle_dir)
+    config = config or pychro.DEFAULT_CONFIG
+    _check_closed(os.path.basename(cycle_dir), config, utcnow)
+    data_files = [fn for fn in os.listdir(cycle_dir) if fn.startswith('data-')]
+    last_messages = _last_messages(cycle_dir, data_files, thread_id_bits or pychro.default_thread_id_bits(), config)
+    reclaimed = 0
+    for fn in sorted(os.listdir(cycle_dir)):
+        if not fn.startswith(('index-', 'data-')):
+            continue
+        with open(os.path.join(cycle_dir, fn), 'r+b') as fh:
+            size = os.fstat(fh.fileno()).st_size
+            if fn.startswith('index-'):
+                new_size = _used_length(fh, size, 1024*1024)
+            else:
+                new_size = _data_end(fh, size, last_messages.get(fn), tail_margin)
+            new_size = min(size, max(mmap.PAGESIZE, _round_up(new_size, mmap.PAGESIZE)))
+            if new_size < size:
+                fh.truncate(new_size)
+                reclaimed += size - new_size
+    return reclaimed
@@ -0,0 +1,129 @@
+#
+#  Copyright 2015 Jon Turner
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import calendar
+import datetime
+import pychro
+
+# Default directory names of cycles by cycle length, as Java's yyyyMMdd, yyyyMMddHH and yyyyMMddHHmm
+CYCLE_FORMATS = {
+    86400: '%Y%m%d',
+    3600: '%Y%m%d%H',
+    60: '%Y%m%d%H%M',
+}
+
+_JAVA_CYCLE_FORMAT = [('yyyy', '%Y'), ('MM', '%m'), ('dd', '%d'), ('HH', '%H'), ('mm', '%M'), ('ss', '%S')]
+
+
+def _log2(n, name):
+    if n <= 0 or n & (n - 1):
+        raise pychro.ConfigError('%s must be a power of 2' % name)
+    return n.bit_length() - 1
+
+
+class VanillaChronicleConfig:
+    # File sizes and index layout of a chronicle, as the settings of the same names of Java's
+    # VanillaChronicleConfig. Every reader and writer of a chronicle must use the same settings.
+    #
+    # data_block_size   - size of each data file, a power of 2 of at least 128KB
+    # index_block_size  - size of each index file, a power of 2 of at least 4KB
+    # entries_per_cycle - the limit on messages per cycle, a power of 2, full indexes being the cycle
+    #                     number times entries_per_cycle plus the index within the cycle
+    # cycle_length      - seconds per cycle, e.g. 3600 for hourly cycles, the cycle number being the
+    #                     seconds since the epoch divided by it. Java's cycleLength is in milliseconds.
+    # cycle_format      - strftime format, or Java date pattern such as yyyyMMddHH, of the cycle
+    #                     directory names, by default from CYCLE_FORMATS
+    #
+    # The defaults are Java's, as the module constants DATA_FILE_SIZE, INDEX_FILE_SIZE and CYCLE_INDEX_POS.
+    #
+    # The date of a cycle, as returned by get_date() and taken by to_full_index(), is a datetime.date
+    # for daily cycles and the naive UTC datetime of the start of the cycle otherwise.
+    #
+
+    def __init__(self, data_block_size=None, index_block_size=None, entries_per_cycle=None, cycle_length=86400,
+                 cycle_format=None):
+        self.data_block_size = data_block_size or pychro.DATA_FILE_SIZE
+        self.index_block_size = index_block_size or pychro.INDEX_FILE_SIZE
+        self.entries_per_cycle = entries_per_cycle or 1 << pychro.CYCLE_INDEX_POS
+        if self.data_block_size < 128*1024:
+            raise pychro.ConfigError('data_block_size must be >= 128KB')
+        if self.index_block_size < 4*1024:
+            raise pychro.ConfigError('index_block_size must be >= 4KB')
+        self.filenum_from_pos_shift = _log2(self.data_block_size, 'data_block_size')
+        self.pos_mask = self.data_block_size - 1
+        self.filenum_from_index_shift = _log2(self.index_block_size, 'index_block_size')
+        self.index_offset_mask = self.index_block_size - 1
+        self.cycle_index_pos = _log2(self.entries_per_cycle, 'entries_per_cycle')
+        self.cycle_index_mask = self.entries_per_cycle - 1
+
+        if cycle_length <= 0 or 86400 % cycle_length:
+            raise pychro.ConfigError('cycle_length must divide a day')
+        self.cycle_length = cycle_length
+        if cycle_format is None:
+            if cycle_length not in CYCLE_FORMATS:
+                raise pychro.ConfigError('cycle_format required for cycle_length %s' % cycle_length)
+            cycle_format = CYCLE_FORMATS[cycle_length]
+        elif '%' not in cycle_format:
+            for java, fmt in _JAVA_CYCLE_FORMAT:
+                cycle_format = cycle_format.replace(java, fmt)
+        self.cycle_format = cycle_format
+        # full indexes are signed 64 bit longs in Java
+        if self.cycle_of(datetime.date(2100, 1, 1)) << self.cycle_index_pos >= 1 << 63:
+            raise pychro.ConfigError('entries_per_cycle too large for cycle_length %s' % cycle_length)
+        cycle = self.cycle_of(datetime.datetime(2015, 2, 21, 23, 59, 59))
+        if self.parse_cycle_name(self.cycle_name(cycle)) != cycle or \
+                self.parse_cycle_name(self.cycle_name(cycle - 1)) != cycle - 1:
+            raise pychro.ConfigError('cycle_format %s does not identify cycles of %ss' % (cycle_format, cycle_length))
+
+    def __str__(self):
+        return '<VanillaChronicleConfig data:%s index:%s entries:%s cycle:%ss %s>' % (
+            self.data_block_size, self.index_block_size, self.entries_per_cycle, self.cycle_length, self.cycle_format)
+
+    # The cycle number of a date, or of a naive UTC or aware datetime
+    def cycle_of(self, when):
+        if isinstance(when, datetime.datetime):
+            if when.tzinfo is not None:
+                when = when.astimezone(datetime.timezone.utc)
+            seconds = calendar.timegm(when.timetuple())
+        else:
+            seconds = calendar.timegm(when.timetuple()[:3] + (0, 0, 0))
+        return seconds//self.cycle_length
+
+    # The cycle number of the last cycle starting on or before when. For a date, that is the last cycle of the day.
+    def last_cycle_of(self, when):
+        if isinstance(when, datetime.datetime):
+            return self.cycle_of(when)
+        return self.cycle_of(when + datetime.timedelta(days=1)) - 1
+
+    def cycle_date(self, cycle):
+        start = datetime.datetime(1970, 1, 1) + datetime.timedelta(seconds=cycle*self.cycle_length)
+        return start.date() if self.cycle_length == 86400 else start
+
+    def cycle_name(self, cycle):
+        return (datetime.datetime(1970, 1, 1) + datetime.timedelta(seconds=cycle*self.cycle_length)).strftime(
+            self.cycle_format)
+
+    # The cycle number of a cycle directory name, or None
+    def parse_cycle_name(self, name):
+        try:
+            start = datetime.datetime.strptime(name, self.cycle_format)
+        except ValueError:
+            return None
+        cycle = self.cycle_of(start)
+        return cycle if self.cycle_name(cycle) == name else None
+
+
+DEFAULT_CONFIG = VanillaChronicleConfig()
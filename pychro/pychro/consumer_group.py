@@ -0,0 +1,327 @@
+#
+#  Copyright 2015 Jon Turner
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import datetime
+import os
+import struct
+import tempfile
+import time
+import pychro
+from ._pychro import *
+
+# Workers of a consumer group share the messages of a chronicle through <base_dir>/<name>.claims:
+#
+#   header | magic, number of slots, claim size, full index of the next message to be claimed, claim lock
+#   slots  | (owner, pid, heartbeat, claim start, progress) of 64 bytes each
+#
+# A worker owns a slot, taken by a CAS of its token into an empty one. To claim the next claim size
+# messages from start it takes the claim lock, by a CAS of its token into it, writes start into its
+# slot then moves the next full index from start past them, so each message is claimed once. progress
+# is the full index of the message last handed out.
+#
+# A slot whose pid has exited, or whose heartbeat is older than the group's claim_timeout, is taken
+# over by a CAS of its owner and its claim is worked from progress, so the message in hand when a
+# worker crashed is delivered again. Workers look for such slots every claim_timeout/4 seconds, holding
+# the claim lock, so a claim start in a slot is a claim made once the next full index is past it. The
+# lock of such a worker is taken over in the same way, clearing the start of a claim it had not made.
+
+CLAIMS_SUFFIX = '.claims'
+CLAIMS_MAGIC = b'PYCHROW1'
+CLAIMS_HEADER_SIZE = 64
+CLAIMS_SLOT_SIZE = 64
+DEFAULT_CLAIM_SIZE = 64
+DEFAULT_GROUP_SLOTS = 256
+
+_NEXT, _CLAIM_LOCK = 24, 32
+_OWNER, _PID, _HEARTBEAT, _START, _PROGRESS = 0, 8, 16, 24, 32
+
+
+def _pid_alive(pid):
+    if not pid:
+        return False
+    if pychro.PLATFORM_WINDOWS or pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class ConsumerGroup:
+    # The claim file of the group called name. claim_size and slots only apply when creating it.
+    # Workers must call next_reader() at least every claim_timeout seconds or their claims are taken over.
+
+    def __init__(self, base_dir, name, claim_size=DEFAULT_CLAIM_SIZE, slots=DEFAULT_GROUP_SLOTS,
+                 claim_timeout=60.0, thread_id_bits=None, utcnow=datetime.datetime.utcnow, config=None):
+        self._base_dir = base_dir
+        self._name = name
+        self._claim_timeout = claim_timeout
+        self._thread_id_bits = thread_id_bits
+        self._utcnow = utcnow
+        self._config = config or pychro.DEFAULT_CONFIG
+        self._path = os.path.join(base_dir, name + CLAIMS_SUFFIX)
+        if not os.path.isfile(self._path):
+            self._create(claim_size, slots)
+        self._fh = open(self._path, 'r+b')
+        header = self._fh.read(24)
+        if header[:8] != CLAIMS_MAGIC:
+            raise pychro.CorruptData('Not a claim file: %s' % self._path)
+        self._slots, self.claim_size = struct.unpack('<QQ', header[8:24])
+        self._size = CLAIMS_HEADER_SIZE + self._slots*CLAIMS_SLOT_SIZE
+        self._mm = open_write_mmap(self._fh, self._size)
+
+    def __str__(self):
+        return '<ConsumerGroup %s next:%s>' % (self._name, self._read(_NEXT))
+
+    def _create(self, claim_size, slots):
+        if claim_size < 1:
+            raise pychro.InvalidArgumentError('claim_size must be at least 1')
+        fd, tmp_path = tempfile.mkstemp(dir=self._base_dir)
+        with os.fdopen(fd, 'wb') as fh:
+            fh.write((CLAIMS_MAGIC + struct.pack('<QQ', slots, claim_size)).ljust(CLAIMS_HEADER_SIZE, b'\x00'))
+            fh.write(b'\x00'*slots*CLAIMS_SLOT_SIZE)
+        try:
+            os.link(tmp_path, self._path)
+        except FileExistsError:
+            pass
+        os.remove(tmp_path)
+
+    def _read(self, offset):
+        return read_mmap(self._mm, offset)
+
+    def _write(self, offset, val):
+        unsafe_write_mmap(self._mm, offset, val)
+
+    def _cas(self, offset, prev, val):
+        return try_atomic_write_mmap(self._mm, offset, prev, val) == prev
+
+    def _slot_offsets(self):
+        return range(CLAIMS_HEADER_SIZE, self._size, CLAIMS_SLOT_SIZE)
+
+    def _dead(self, offset):
+        heartbeat = self._read(offset + _HEARTBEAT)/1000.0
+        return not _pid_alive(self._read(offset + _PID)) or time.time() - heartbeat > self._claim_timeout
+
+    # Takes the claim lock for the worker with token
+    def _lock(self, token):
+        while True:
+            holder = self._read(_CLAIM_LOCK)
+            if not holder:
+                if self._cas(_CLAIM_LOCK, 0, token):
+                    return
+                continue
+            slots = [offset for offset in self._slot_offsets() if self._read(offset + _OWNER) == holder]
+            if all(self._dead(offset) for offset in slots):
+                if self._cas(_CLAIM_LOCK, holder, token):
+                    next_index = self._read(_NEXT)
+                    for offset in slots:
+                        start = self._read(offset + _START)
+                        if start and next_index <= start:
+                            self._write(offset + _START, 0)
+                    return
+                continue
+            time.sleep(0.0001)
+
+    def _unlock(self, token):
+        # not if taken over while stalled
+        self._cas(_CLAIM_LOCK, token, 0)
+
+    def _take_slot(self, token):
+        for offset in self._slot_offsets():
+            if self._cas(offset + _OWNER, 0, token):
+                self._write(offset + _START, 0)
+                self._write(offset + _PID, os.getpid())
+                self._write(offset + _HEARTBEAT, int(time.time()*1000))
+                return offset
+        raise pychro.NoSpace('No free consumer group slots')
+
+    # Sorted cycles from cycle
+    def _cycles(self, cycle):
+        cycles = set()
+        for f in os.listdir(self._base_dir):
+            c = self._config.parse_cycle_name(f[:-len(pychro.ARCHIVE_SUFFIX)] if f.endswith(pychro.ARCHIVE_SUFFIX) else f)
+            if c is not None and c >= cycle:
+                cycles.add(c)
+        return sorted(cycles)
+
+    # True if no more messages will be written to cycle, as the reader decides
+    def _cycle_over(self, cycle):
+        return cycle != self._config.cycle_of(self._utcnow()) and len(self._cycles(cycle + 1)) > 0
+
+    def worker(self, polling_interval=None):
+        return GroupWorker(self, polling_interval)
+
+    # [(pid, claim start, progress)] of the claims being worked
+    def claims(self):
+        ret = []
+        for offset in self._slot_offsets():
+            if self._read(offset + _OWNER) and self._read(offset + _START):
+                ret += [(self._read(offset + _PID), self._read(offset + _START), self._read(offset + _PROGRESS))]
+        return ret
+
+    def close(self):
+        if self._mm:
+            close_mmap(self._mm, self._size)
+            self._mm = None
+            self._fh.close()
+
+
+class GroupWorker:
+    # Hands out the messages of the chronicle claimed by this worker, so each message goes to one worker
+    # of the group. next_reader() polls for new messages as VanillaChronicleReader does.
+
+    def __init__(self, group, polling_interval):
+        self._group = group
+        self._polling_interval = polling_interval
+        self._reader = pychro.VanillaChronicleReader(group._base_dir, thread_id_bits=group._thread_id_bits,
+                                                     utcnow=group._utcnow, config=group._config)
+        self._token = struct.unpack('<q', os.urandom(8))[0] & 0x7fffffffffffffff or 1
+        self._slot = group._take_slot(self._token)
+        self._claim = None
+        self._end = 0
+        self._written_end = 0
+        self._last_beat = 0.0
+        self._last_recover = 0.0
+        self.recovered = 0
+
+    def __str__(self):
+        return '<GroupWorker idx:%s end:%s>' % (self._reader.get_index(), self._end)
+
+    def _beat(self):
+        now = time.time()
+        if now - self._last_beat < self._group._claim_timeout/4:
+            return
+        group = self._group
+        # taken over while stalled
+        if self._claim is not None and group._read(self._claim + _OWNER) != self._token:
+            self._claim = None
+        if group._read(self._slot + _OWNER) != self._token:
+            self._slot = group._take_slot(self._token)
+        for offset in {self._slot, self._claim} - {None}:
+            group._write(offset + _HEARTBEAT, int(now*1000))
+        self._last_beat = now
+
+    def _set_claim(self, offset, start, progress):
+        pos = self._group._config.cycle_index_pos
+        self._claim = offset
+        self._end = min(start + self._group.claim_size, ((start >> pos) + 1) << pos)
+        self._reader.set_index(progress)
+        self._written_end = 0
+
+    def _recover(self):
+        group = self._group
+        for offset in group._slot_offsets():
+            owner = group._read(offset + _OWNER)
+            if not owner or offset == self._slot or not group._dead(offset):
+                continue
+            if not group._cas(offset + _OWNER, owner, self._token):
+                continue
+            group._write(offset + _PID, os.getpid())
+            group._write(offset + _HEARTBEAT, int(time.time()*1000))
+            start = group._read(offset + _START)
+            if start and group._read(_NEXT) > start:
+                self._set_claim(offset, start, group._read(offset + _PROGRESS))
+                self.recovered += 1
+                return True
+            group._write(offset + _START, 0)
+            group._write(offset + _OWNER, 0)
+        return False
+
+    def _claim_next(self):
+        group = self._group
+        group._lock(self._token)
+        try:
+            # dead workers are looked for as often as heartbeats are written
+            now = time.time()
+            if now - self._last_recover >= group._claim_timeout/4:
+                self._last_recover = now
+                if self._recover():
+                    return True
+            pos = group._config.cycle_index_pos
+            while True:
+                start = group._read(_NEXT)
+                cycles = group._cycles(start >> pos)
+                if not cycles:
+                    return False
+                if cycles[0] != start >> pos:
+                    # the first message, or the next after a gap in the cycles
+                    group._cas(_NEXT, start, cycles[0] << pos)
+                    continue
+                self._reader.set_index(start)
+                written_end = self._reader.get_end_index_today()
+                if start >= written_end:
+                    if group._cycle_over(cycles[0]):
+                        group._cas(_NEXT, start, cycles[1] << pos)
+                        continue
+                    return False
+                group._write(self._slot + _PROGRESS, start)
+                group._write(self._slot + _START, start)
+                self._set_claim(self._slot, start, start)
+                if group._cas(_NEXT, start, self._end):
+                    self._written_end = written_end
+                    return True
+                # the lock was taken over while stalled
+                group._write(self._slot + _START, 0)
+                self._claim = None
+                return False
+        finally:
+            group._unlock(self._token)
+
+    def _release_claim(self):
+        self._group._write(self._claim + _START, 0)
+        if self._claim != self._slot:
+            self._group._write(self._claim + _OWNER, 0)
+        self._claim = None
+
+    def next_reader(self):
+        group = self._group
+        reader = self._reader
+        while True:
+            self._beat()
+            if self._claim is not None or self._claim_next():
+                index = reader.get_index()
+                if index < self._end:
+                    if index >= self._written_end:
+                        self._written_end = reader.get_end_index_today()
+                    if index < self._written_end:
+                        group._write(self._claim + _PROGRESS, index)
+                        return reader.next_reader()
+                if index >= self._end or group._cycle_over(index >> group._config.cycle_index_pos):
+                    self._release_claim()
+                    continue
+            if self._polling_interval is None:
+                raise pychro.NoData
+            if self._polling_interval != 0:
+                time.sleep(self._polling_interval)
+
+    # Full index after the message last handed out
+    def get_index(self):
+        return self._reader.get_index()
+
+    # The rest of an unfinished claim is left to be taken over at once by another worker
+    def close(self):
+        group = self._group
+        if self._claim is not None:
+            group._write(self._claim + _PROGRESS, self._reader.get_index())
+            group._write(self._claim + _PID, 0)
+        if self._claim != self._slot:
+            group._write(self._slot + _START, 0)
+            group._write(self._slot + _OWNER, 0)
+        self._claim = None
+        self._reader.close()
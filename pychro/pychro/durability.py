@@ -0,0 +1,131 @@
+#
+#  Copyright 2015 Jon Turner
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import threading
+import time
+import pychro
+
+# Durability policies for VanillaChronicleWriter(durability=...). Without one, committed messages reach
+# disk whenever the kernel writes them back. The writer tracks the ranges of the data and index files
+# written since the last VanillaChronicleWriter.sync(), and the policy decides when to call it. A policy
+# with a background thread serves one writer at a time.
+
+
+class SyncPerMessage:
+    # Every message is on disk when Appender.finish() returns
+
+    def start(self, writer):
+        pass
+
+    def committed(self, writer, pending, oldest):
+        writer.sync()
+
+    def stop(self):
+        pass
+
+
+class _SyncTimer(threading.Thread):
+    # Syncs each group of messages committed to writer once the oldest of them was committed interval
+    # seconds ago, if nothing has synced it before then. notify() is called as a group starts.
+
+    def __init__(self, writer, interval):
+        super().__init__(daemon=True)
+        self._writer = writer
+        self._interval = interval
+        self._group = threading.Event()
+        self._stop_event = threading.Event()
+
+    def notify(self):
+        self._group.set()
+
+    def run(self):
+        writer = self._writer
+        while not self._stop_event.is_set():
+            self._group.wait()
+            self._group.clear()
+            while not self._stop_event.is_set():
+                with writer._sync_lock:
+                    if not writer._pending:
+                        break
+                    due = writer._oldest_pending + self._interval
+                    if time.time() >= due:
+                        writer.sync()
+                        break
+                self._stop_event.wait(due - time.time())
+
+    def stop(self):
+        self._stop_event.set()
+        self._group.set()
+        if self.is_alive():
+            self.join()
+
+
+def _check_unused(policy):
+    if policy._timer is not None and policy._timer.is_alive():
+        raise pychro.InvalidArgumentError('%s is already in use by another writer' % type(policy).__name__)
+
+
+class GroupCommit:
+    # Messages are synced together once messages have been committed since the last sync, or the
+    # oldest of them was committed interval seconds ago. messages is checked as messages are committed,
+    # so without an interval the last group is synced by a later message, sync() or close(). interval
+    # is also checked by a background thread, so no group waits longer than that.
+
+    def __init__(self, messages=None, interval=None):
+        if messages is None and interval is None:
+            raise pychro.InvalidArgumentError('GroupCommit requires messages and/or interval')
+        self.messages = messages
+        self.interval = interval
+        self._timer = None
+
+    def start(self, writer):
+        _check_unused(self)
+        if self.interval is not None:
+            self._timer = _SyncTimer(writer, self.interval)
+            self._timer.start()
+
+    def committed(self, writer, pending, oldest):
+        if self.messages is not None and pending >= self.messages:
+            writer.sync()
+        elif self.interval is not None and time.time() - oldest >= self.interval:
+            writer.sync()
+        elif pending == 1 and self._timer is not None:
+            self._timer.notify()
+
+    def stop(self):
+        if self._timer is not None:
+            self._timer.stop()
+
+
+class PeriodicSync:
+    # A background thread syncs the messages committed within interval seconds of the first of them
+
+    def __init__(self, interval=0.1):
+        self.interval = interval
+        self._timer = None
+
+    def start(self, writer):
+        _check_unused(self)
+        self._timer = _SyncTimer(writer, self.interval)
+        self._timer.start()
+
+    def committed(self, writer, pending, oldest):
+        if pending == 1:
+            self._timer.notify()
+
+    def stop(self):
+        if self._timer is not None:
+            self._timer.stop()
@@ -0,0 +1,240 @@
+#
+#  Copyright 2015 Jon Turner
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import csv
+import os
+import queue
+import shutil
+import struct
+import tempfile
+import threading
+import time
+import zipfile
+import pychro
+from .vanilla_reader import VanillaChronicleReader, RawByteReader
+
+
+# Column type -> (numpy descr, struct code). Strings are fixed width unicode in .npy files.
+NPY_TYPES = {
+    'byte': ('|u1', 'B'),
+    'boolean': ('|b1', '?'),
+    'short': ('<i2', 'h'),
+    'int': ('<i4', 'i'),
+    'long': ('<i8', 'q'),
+    'double': ('<f8', 'd'),
+    'stopbit': ('<i8', 'q'),
+    'string': (None, None),
+}
+
+
+class ExportStats:
+    def __init__(self, messages, chunks, seconds, bytes_written):
+        self.messages = messages
+        self.chunks = chunks
+        self.seconds = seconds
+        self.bytes_written = bytes_written
+
+    def messages_per_second(self):
+        return self.messages/self.seconds if self.seconds else 0.0
+
+    def __str__(self):
+        return '<ExportStats msgs:%s chunks:%s bytes:%s %.2fs %.2f msgs/s>' % (
+            self.messages, self.chunks, self.bytes_written, self.seconds, self.messages_per_second())
+
+
+class _NpyColumnWriter:
+    # Writes a 1-d .npy file without holding the column in memory. The header is padded to a
+    # fixed length so the final shape can be rewritten in place once the row count is known.
+    HEADER_LEN = 128
+
+    def __init__(self, path, descr, code, width=None):
+        self._descr = descr
+        self._code = code
+        self._width = width
+        self._count = 0
+        self._fh = open(path, 'wb')
+        self._fh.write(self._header())
+
+    def _header(self):
+        d = "{'descr': '%s', 'fortran_order': False, 'shape': (%d,), }" % (self._descr, self._count)
+        d = d.ljust(self.HEADER_LEN - 11) + '\n'
+        return b'\x93NUMPY\x01\x00' + struct.pack('<H', len(d)) + d.encode('latin1')
+
+    def write(self, values):
+        if self._width is not None:
+            w = self._width
+            data = b''.join(v[:w].encode('utf-32-le').ljust(4*w, b'\x00') for v in values)
+        else:
+            data = struct.pack('<%d%s' % (len(values), self._code), *values)
+        self._fh.write(data)
+        self._count += len(values)
+        return len(data)
+
+    def close(self):
+        self._fh.seek(0)
+        self._fh.write(self._header())
+        self._fh.close()
+
+
+class Exporter:
+    # Exports the messages in [start_index, end_index) of a chronicle to column files.
+    #
+    # schema is a list of (name, type) or (name, 'string', width) tuples where type is the name
+    # of a RawByteReader read method ('int', 'string', 'double', ...). Each message is decoded
+    # field by field in schema order, so the schema must describe a prefix of every message.
+    #
+    # A decode thread reads chunk_size messages at a time into column lists and hands them to
+    # the write stage through a queue of at most queue_chunks chunks, so memory is bounded by
+    # chunk_size*queue_chunks messages regardless of the size of the range.
+    #
+    # start_index of None starts from the earliest message, end_index of None exports until
+    # pychro.NoData. include_index adds a leading 'index' column holding each full index.
+    #
+
+    def __init__(self, base_dir, schema, start_index=None, end_index=None, chunk_size=64*1024,
+                 queue_chunks=4, include_index=True, thread_id_bits=None, config=None):
+        self._base_dir = base_dir
+        self._start_index = start_index
+        self._end_index = end_index
+        self._chunk_size = chunk_size
+        self._queue_chunks = queue_chunks
+        self._include_index = include_index
+        self._thread_id_bits = thread_id_bits
+        self._config = config
+        self._columns = []
+        self._decoders = []
+        for field in schema:
+            name, _type = field[0], field[1]
+            if _type not in NPY_TYPES:
+                raise pychro.InvalidArgumentError('Unknown field type %s for %s' % (_type, name))
+            width = field[2] if len(field) > 2 else None
+            self._columns += [(name, _type, width)]
+            self._decoders += [getattr(RawByteReader, 'read_' + _type)]
+        if include_index:
+            self._columns.insert(0, ('index', 'long', None))
+
+    def column_names(self):
+        return [c[0] for c in self._columns]
+
+    def _decode(self, chunks, stop):
+        try:
+            reader = VanillaChronicleReader(self._base_dir, full_index=self._start_index,
+                                            thread_id_bits=self._thread_id_bits, config=self._config)
+            try:
+                decoders = self._decoders
+                include_index = self._include_index
+                end = self._end_index
+                done = reader.get_date() is None
+                while not done and not stop.is_set():
+                    cols = [[] for _ in self._columns]
+                    rows = 0
+                    while rows < self._chunk_size:
+                        try:
+                            r = reader.next_reader()
+                        except pychro.NoData:
+                            done = True
+                            break
+                        index = reader.get_index() - 1
+                        if end is not None and index >= end:
+                            done = True
+                            break
+                        if include_index:
+                            cols[0].append(index)
+                            for col, decoder in zip(cols[1:], decoders):
+                                col.append(decoder(r))
+                        else:
+                            for col, decoder in zip(cols, decoders):
+                                col.append(decoder(r))
+                        rows += 1
+                    if rows:
+                        chunks.put((rows, cols))
+            finally:
+                reader.close()
+            chunks.put(None)
+        except Exception as e:
+            chunks.put(e)
+
+    def _run(self, sink):
+        chunks = queue.Queue(maxsize=self._queue_chunks)
+        stop = threading.Event()
+        decoder = threading.Thread(target=self._decode, args=(chunks, stop), daemon=True)
+        t = time.time()
+        decoder.start()
+        messages = num_chunks = bytes_written = 0
+        try:
+            while True:
+                chunk = chunks.get()
+                if chunk is None:
+                    break
+                if isinstance(chunk, Exception):
+                    raise chunk
+                rows, cols = chunk
+                bytes_written += sink(cols)
+                messages += rows
+                num_chunks += 1
+        finally:
+            stop.set()
+            # unblock the decoder if it is waiting on a full queue
+            while decoder.is_alive():
+                try:
+                    chunks.get(timeout=0.01)
+                except queue.Empty:
+                    pass
+        return ExportStats(messages, num_chunks, time.time() - t, bytes_written)
+
+    def to_csv(self, path, delimiter=',', header=True):
+        with open(path, 'w', newline='') as fh:
+            writer = csv.writer(fh, delimiter=delimiter)
+            if header:
+                writer.writerow(self.column_names())
+
+            def sink(cols):
+                start = fh.tell()
+                writer.writerows(zip(*cols))
+                return fh.tell() - start
+
+            return self._run(sink)
+
+    def _npy_writers(self, directory):
+        writers = []
+        for name, _type, width in self._columns:
+            descr, code = NPY_TYPES[_type]
+            if _type == 'string':
+                if width is None:
+                    raise pychro.InvalidArgumentError('String column %s needs a width for .npy export' % name)
+                descr = '<U%d' % width
+            writers += [_NpyColumnWriter(os.path.join(directory, name + '.npy'), descr, code, width)]
+        return writers
+
+    def to_npy(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        writers = self._npy_writers(directory)
+        try:
+            return self._run(lambda cols: sum(w.write(c) for w, c in zip(writers, cols)))
+        finally:
+            [w.close() for w in writers]
+
+    def to_npz(self, path):
+        tmpdir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(path)))
+        try:
+            stats = self.to_npy(tmpdir)
+            with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_STORED, allowZip64=True) as zf:
+                for name in self.column_names():
+                    zf.write(os.path.join(tmpdir, name + '.npy'), name + '.npy')
+            stats.bytes_written = os.path.getsize(path)
+            return stats
+        finally:
+            shutil.rmtree(tmpdir)
@@ -0,0 +1,109 @@
+#
+#  Copyright 2015 Jon Turner
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import ctypes
+import numbers
+import struct
+import pychro
+from ._pychro import HAVE_NATIVE_FILTER
+
+# struct codes of the fixed size fields, as read by RawByteReader
+FILTER_FIELD_FORMATS = {
+    'byte': 'B',
+    'boolean': '?',
+    'short': 'h',
+    'int': 'i',
+    'long': 'q',
+    'double': 'd',
+}
+
+# field types as numbered by the native scan in libpychroc
+_NATIVE_FIELD_TYPES = ['byte', 'boolean', 'short', 'int', 'long', 'double']
+
+
+# The values of a field of _type a native scan can match, as it compares 64 bit integers or doubles,
+# or None if some value can only be compared in Python
+def _native_values(_type, values):
+    ret = set()
+    for value in values:
+        if not isinstance(value, numbers.Real):
+            return None
+        if value != value:
+            # NaN is never equal to a field
+            continue
+        if _type == 'double':
+            if float(value) == value:
+                ret.add(float(value))
+        elif value in (float('inf'), float('-inf')):
+            continue
+        elif value == int(value) and -2**63 <= int(value) < 2**63:
+            ret.add(int(value))
+    return sorted(ret)
+
+
+class _NativeConditions:
+    # The conditions as the arguments of _pychro.filter_index
+
+    def __init__(self, fields, end):
+        self.fields = len(fields)
+        self.offsets = (ctypes.c_int*len(fields))(*[offset for offset, _, _ in fields])
+        self.types = (ctypes.c_int*len(fields))(*[_NATIVE_FIELD_TYPES.index(_type) for _, _type, _ in fields])
+        self.value_counts = (ctypes.c_longlong*len(fields))(*[len(values) for _, _, values in fields])
+        self.values = ctypes.create_string_buffer(b''.join(struct.pack('=d' if _type == 'double' else '=q', value)
+                                                           for _, _type, values in fields for value in values))
+        self.end = end
+
+
+class MessageFilter:
+    # Matches messages on fields at fixed offsets from the start of the message, directly on the
+    # mapped bytes. conditions is a list of (offset, type, values) which must all match,
+    # e.g. [(0, 'int', {3, 7})] for messages starting with the int 3 or 7.
+    #
+    # The fields are unpacked with a single struct, so they must not overlap. Where libpychroc has
+    # the native scan, runs of index entries are tested in it, for values which are real numbers.
+
+    def __init__(self, conditions):
+        fmt = '='
+        end = 0
+        self._values = []
+        native_fields = []
+        for offset, _type, values in sorted(conditions, key=lambda c: c[0]):
+            if _type not in FILTER_FIELD_FORMATS:
+                raise pychro.InvalidArgumentError('Unknown field type %s' % _type)
+            if offset < end:
+                raise pychro.InvalidArgumentError('Field at offset %s overlaps previous field' % offset)
+            code = FILTER_FIELD_FORMATS[_type]
+            fmt += 'x'*(offset - end) + code
+            end = offset + struct.calcsize('=' + code)
+            self._values += [frozenset(values)]
+            native_fields += [(offset, _type, _native_values(_type, values))]
+        if not self._values:
+            raise pychro.InvalidArgumentError('No conditions')
+        self._struct = struct.Struct(fmt)
+        self.native = None
+        if HAVE_NATIVE_FILTER and all(values is not None for _, _, values in native_fields):
+            self.native = _NativeConditions(native_fields, end)
+        if len(self._values) == 1:
+            self.matches = self._matches_one
+
+    def _matches_one(self, data, pos):
+        return self._struct.unpack_from(data, pos)[0] in self._values[0]
+
+    def matches(self, data, pos):
+        for value, values in zip(self._struct.unpack_from(data, pos), self._values):
+            if value not in values:
+                return False
+        return True
@@ -0,0 +1,244 @@
+#
+#  Copyright 2015 Jon Turner
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import pychro
+
+# A key index is a sidecar file per cycle, <base_dir>/<yyyymmdd>.<name>.kidx, holding a chained hash
+# table from the 64 bit hash of a key to the full indexes of the messages with that key.
+#
+#   header  | magic, bucket count, entry count, next full index to be indexed
+#   buckets | bucket count u64s, each 1 + the entry number of the head of the chain or 0
+#   entries | (key hash, full index, 1 + entry number of the next in the chain or 0)
+#
+# Entries are written before the bucket or count referring to them, so readers can map the file
+# while the indexer appends to it. The file is grown by doubling the entry capacity.
+
+KEY_INDEX_SUFFIX = '.kidx'
+KEY_INDEX_MAGIC = b'PYCHROK1'
+KEY_INDEX_HEADER = struct.Struct('<8sQQQ')
+KEY_INDEX_HEADER_SIZE = 64
+KEY_INDEX_ENTRY = struct.Struct('<QQQ')
+DEFAULT_KEY_INDEX_BUCKETS = 64*1024
+DEFAULT_KEY_INDEX_ENTRIES = 64*1024
+
+
+def key_hash(key):
+    if isinstance(key, str):
+        data = b's' + key.encode()
+    elif isinstance(key, int):
+        data = b'i' + struct.pack('<q', key)
+    else:
+        data = b'b' + bytes(key)
+    return struct.unpack('<Q', hashlib.blake2b(data, digest_size=8).digest())[0]
+
+
+def key_index_path(base_dir, name, date, config=None):
+    config = config or pychro.DEFAULT_CONFIG
+    return os.path.join(base_dir, '%s.%s%s' % (config.cycle_name(config.cycle_of(date)), name, KEY_INDEX_SUFFIX))
+
+
+def key_index_paths(base_dir, name, config=None):
+    config = config or pychro.DEFAULT_CONFIG
+    suffix = '.%s%s' % (name, KEY_INDEX_SUFFIX)
+    cycles = [(config.parse_cycle_name(f[:-len(suffix)]), f) for f in os.listdir(base_dir) if f.endswith(suffix)]
+    return [os.path.join(base_dir, f) for cycle, f in sorted(c for c in cycles if c[0] is not None)]
+
+
+class KeyIndexFile:
+    def __init__(self, path, writable=False, bucket_count=DEFAULT_KEY_INDEX_BUCKETS):
+        self._path = path
+        self._writable = writable
+        if writable and not os.path.isfile(path):
+            self._create(path, bucket_count)
+        self._fh = open(path, 'r+b' if writable else 'rb')
+        self._mm = None
+        self._map()
+        magic, self._bucket_count, _, _ = KEY_INDEX_HEADER.unpack_from(self._mm, 0)
+        if magic != KEY_INDEX_MAGIC:
+            raise pychro.CorruptData('Not a key index: %s' % path)
+        self._entries_offset = KEY_INDEX_HEADER_SIZE + self._bucket_count*8
+
+    # Created under a temporary name so readers never see a file without its header
+    @staticmethod
+    def _create(path, bucket_count):
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as fh:
+            fh.write(KEY_INDEX_HEADER.pack(KEY_INDEX_MAGIC, bucket_count, 0, 0).ljust(KEY_INDEX_HEADER_SIZE, b'\x00'))
+            fh.truncate(KEY_INDEX_HEADER_SIZE + bucket_count*8 + DEFAULT_KEY_INDEX_ENTRIES*KEY_INDEX_ENTRY.size)
+        try:
+            os.link(tmp_path, path)
+        except FileExistsError:
+            pass
+        os.remove(tmp_path)
+
+    def _map(self):
+        if self._mm is not None:
+            self._mm.close()
+        if pychro.PLATFORM_WINDOWS:
+            access = mmap.ACCESS_WRITE if self._writable else mmap.ACCESS_READ
+            self._mm = mmap.mmap(self._fh.fileno(), 0, access=access)
+        else:
+            prot = mmap.PROT_READ | mmap.PROT_WRITE if self._writable else mmap.PROT_READ
+            self._mm = mmap.mmap(self._fh.fileno(), 0, prot=prot)
+
+    def _capacity(self):
+        return (len(self._mm) - self._entries_offset)//KEY_INDEX_ENTRY.size
+
+    def entry_count(self):
+        return KEY_INDEX_HEADER.unpack_from(self._mm, 0)[2]
+
+    def next_full_index(self):
+        return KEY_INDEX_HEADER.unpack_from(self._mm, 0)[3]
+
+    def add(self, key, full_index):
+        h = key_hash(key)
+        count = self.entry_count()
+        if count >= self._capacity():
+            self._mm.flush()
+            self._fh.truncate(self._entries_offset + 2*self._capacity()*KEY_INDEX_ENTRY.size)
+            self._map()
+        bucket_offset = KEY_INDEX_HEADER_SIZE + (h % self._bucket_count)*8
+        head = struct.unpack_from('<Q', self._mm, bucket_offset)[0]
+        KEY_INDEX_ENTRY.pack_into(self._mm, self._entries_offset + count*KEY_INDEX_ENTRY.size, h, full_index, head)
+        struct.pack_into('<Q', self._mm, bucket_offset, count + 1)
+        struct.pack_into('<Q', self._mm, 16, count + 1)
+
+    def set_next_full_index(self, full_index):
+        struct.pack_into('<Q', self._mm, 24, full_index)
+
+    def lookup(self, key):
+        h = key_hash(key)
+        if len(self._mm) < os.fstat(self._fh.fileno()).st_size:
+            self._map()
+        entry = struct.unpack_from('<Q', self._mm, KEY_INDEX_HEADER_SIZE + (h % self._bucket_count)*8)[0]
+        found = []
+        while entry:
+            eh, full_index, entry = KEY_INDEX_ENTRY.unpack_from(self._mm, self._entries_offset +
+                                                               (entry-1)*KEY_INDEX_ENTRY.size)
+            if eh == h:
+                found += [full_index]
+        found.reverse()
+        return found
+
+    def close(self):
+        self._mm.close()
+        self._fh.close()
+
+
+class KeyIndex:
+    # Lookups in the key index called name, over all cycles or the cycle of date.
+
+    def __init__(self, base_dir, name, config=None):
+        self._base_dir = base_dir
+        self._name = name
+        self._config = config
+
+    def lookup(self, key, date=None):
+        if date is not None:
+            paths = [key_index_path(self._base_dir, self._name, date, self._config)]
+            paths = [p for p in paths if os.path.isfile(p)]
+        else:
+            paths = key_index_paths(self._base_dir, self._name, self._config)
+        found = []
+        for path in paths:
+            kif = KeyIndexFile(path)
+            found += kif.lookup(key)
+            kif.close()
+        return found
+
+
+class KeyIndexer(threading.Thread):
+    # Maintains the key index called name by tailing the chronicle, indexing each message under
+    # extractor(reader), unless it returns None. update() indexes the messages written since the
+    # last update, or since the progress recorded in the latest sidecar. Started as a thread it
+    # calls update() every polling_interval seconds until stop().
+    #
+
+    def __init__(self, base_dir, name, extractor, thread_id_bits=None, polling_interval=1.0,
+                 bucket_count=DEFAULT_KEY_INDEX_BUCKETS, config=None):
+        super().__init__(daemon=True)
+        self._base_dir = base_dir
+        self._name = name
+        self._extractor = extractor
+        self._thread_id_bits = thread_id_bits
+        self._config = config
+        self._polling_interval = polling_interval
+        self._bucket_count = bucket_count
+        self._stop_event = threading.Event()
+        self._reader = None
+        self._file = None
+        self._file_date = None
+
+    def _resume_index(self):
+        paths = key_index_paths(self._base_dir, self._name, self._config)
+        if paths:
+            kif = KeyIndexFile(paths[-1])
+            full_index = kif.next_full_index()
+            kif.close()
+            if full_index:
+                return full_index
+        return None
+
+    def _index_file(self, date):
+        if self._file_date != date:
+            if self._file:
+                self._file.close()
+            self._file = KeyIndexFile(key_index_path(self._base_dir, self._name, date, self._config), writable=True,
+                                      bucket_count=self._bucket_count)
+            self._file_date = date
+        return self._file
+
+    def update(self):
+        if self._reader is None:
+            self._reader = pychro.VanillaChronicleReader(self._base_dir, full_index=self._resume_index(),
+                                                         thread_id_bits=self._thread_id_bits, config=self._config)
+        reader = self._reader
+        added = 0
+        while True:
+            try:
+                r = reader.next_reader()
+            except pychro.NoData:
+                break
+            key = self._extractor(r)
+            kif = self._index_file(reader.get_date())
+            if key is not None:
+                kif.add(key, reader.get_index() - 1)
+                added += 1
+            kif.set_next_full_index(reader.get_index())
+        return added
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self.update()
+            self._stop_event.wait(self._polling_interval)
+
+    def stop(self):
+        self._stop_event.set()
+
+    def close(self):
+        if self._reader:
+            self._reader.close()
+            self._reader = None
+        if self._file:
+            self._file.close()
+            self._file = None
+            self._file_date = None
@@ -0,0 +1,120 @@
+#
+#  Copyright 2015 Jon Turner
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import datetime
+import os
+import threading
+import pychro
+from .checkpoint import CHECKPOINT_FILE
+
+
+class Lag:
+    # How far a position is behind the end of a chronicle. bytes is exact if exact is True, otherwise
+    # partly estimated from the mean length of the messages measured.
+
+    def __init__(self, messages=0, bytes=0, exact=True):
+        self.messages = messages
+        self.bytes = bytes
+        self.exact = exact
+
+    def __str__(self):
+        return '<Lag msgs:%s bytes:%s%s>' % (self.messages, self.bytes, '' if self.exact else '~')
+
+    def __eq__(self, other):
+        return (self.messages, self.bytes, self.exact) == (other.messages, other.bytes, other.exact)
+
+    def add(self, messages, bytes, exact):
+        self.messages += messages
+        self.bytes += bytes
+        self.exact = self.exact and exact
+
+
+class LagMonitor(threading.Thread):
+    # Samples the Lag of every consumer committing to the CheckpointStore of base_dir. The positions are
+    # read from the checkpoint file, and the lag measured with the monitor's own reader, so consumers
+    # are not touched.
+    #
+    # update() takes a sample, {consumer name: Lag}, kept in samples and passed to callback if given.
+    # Started as a thread it calls update() every interval seconds until stop().
+    #
+    # A consumer whose lag cannot be measured, e.g. as its position is in a cycle being or already removed
+    # or its messages are corrupt, has the Lag None in that sample, which metrics() reports as NaN.
+    #
+
+    def __init__(self, base_dir, interval=1.0, callback=None, max_scan=4096, thread_id_bits=None,
+                 utcnow=datetime.datetime.utcnow, config=None):
+        super().__init__(daemon=True)
+        self._base_dir = base_dir
+        self._interval = interval
+        self._callback = callback
+        self._max_scan = max_scan
+        self._thread_id_bits = thread_id_bits
+        self._utcnow = utcnow
+        self._config = config
+        self._stop_event = threading.Event()
+        self._store = None
+        self._reader = None
+        self.samples = dict()
+        self.sample_time = None
+
+    def update(self):
+        if self._store is None:
+            if not os.path.isfile(os.path.join(self._base_dir, CHECKPOINT_FILE)):
+                return self.samples
+            self._store = pychro.CheckpointStore(self._base_dir)
+            self._reader = pychro.VanillaChronicleReader(self._base_dir, thread_id_bits=self._thread_id_bits,
+                                                         utcnow=self._utcnow, config=self._config)
+        samples = dict()
+        for name, full_index in sorted(self._store.positions().items()):
+            try:
+                self._reader.set_index(full_index)
+                # without the cycle of the position, the reader has moved on to a later one
+                if self._reader.get_index() != full_index:
+                    samples[name] = None
+                    continue
+                samples[name] = self._reader.get_lag(self._max_scan)
+            except (pychro.NoData, pychro.NoChronicleForDate, pychro.CorruptData):
+                samples[name] = None
+        self.samples = samples
+        self.sample_time = self._utcnow()
+        if self._callback:
+            self._callback(samples)
+        return samples
+
+    # The last sample in the Prometheus text format
+    def metrics(self):
+        lines = ['# TYPE pychro_consumer_lag_messages gauge', '# TYPE pychro_consumer_lag_bytes gauge']
+        for name, lag in sorted(self.samples.items()):
+            messages, size = ('NaN', 'NaN') if lag is None else (lag.messages, lag.bytes)
+            lines += ['pychro_consumer_lag_messages{consumer="%s"} %s' % (name, messages),
+                      'pychro_consumer_lag_bytes{consumer="%s"} %s' % (name, size)]
+        return '\n'.join(lines) + '\n'
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self.update()
+            self._stop_event.wait(self._interval)
+
+    def stop(self):
+        self._stop_event.set()
+
+    def close(self):
+        if self._reader:
+            self._reader.close()
+            self._reader = None
+        if self._store:
+            self._store.close()
+            self._store = None
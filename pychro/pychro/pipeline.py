@@ -0,0 +1,177 @@
+#
+#  Copyright 2015 Jon Turner
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import datetime
+import multiprocessing
+import queue
+import threading
+import pychro
+from .retention import lock_cycle_shared, release_cycle_lock
+from .vanilla_reader import RawByteReader
+
+# A DecodePipeline tails a chronicle with one walker thread, which reads only the index and sends the
+# (cycle, data file, offset) of batches of messages to decode workers. Each worker maps the data files
+# itself and returns decoder(reader) for each message. Batches are numbered, and results are handed
+# back in order from a reorder buffer holding up to window batches, which also bounds how far the
+# walker gets ahead of the consumer. The walker holds a lock of each cycle of the batches in flight,
+# taken while its reader has the cycle open, so the cycle is not removed before the workers read it.
+
+
+def _decode_batch(base_dir, decoder, readers, descriptors, reader_kwargs):
+    results = []
+    for date, full_index, filenum, pos, thread in descriptors:
+        reader = readers.get(date)
+        if reader is None:
+            # a batch spans at most two cycles
+            while len(readers) > 1:
+                readers.pop(min(readers)).close()
+            reader = readers[date] = pychro.VanillaChronicleReader(base_dir, date=date, **reader_kwargs)
+        results += [(full_index, decoder(RawByteReader(*reader.get_raw_bytes(filenum, pos, thread))))]
+    return results
+
+
+def _decode_worker(base_dir, decoder, tasks, results, reader_kwargs):
+    readers = dict()
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        seq, descriptors = task
+        try:
+            results.put((seq, _decode_batch(base_dir, decoder, readers, descriptors, reader_kwargs), None))
+        except Exception as e:
+            results.put((seq, None, e))
+    while readers:
+        readers.popitem()[1].close()
+    if hasattr(results, 'cancel_join_thread'):
+        # results not yet consumed are discarded on close
+        results.cancel_join_thread()
+
+
+class DecodePipeline:
+    # Results of decoder(reader) for each message from full_index (or the start), decoded by workers
+    # threads, or processes if processes is True, in which case decoder must be picklable under the
+    # default multiprocessing start method. Threads only decode in parallel where decoder releases the GIL.
+    # An exception raised by decoder is raised by next_result() in the place of its batch.
+    #
+
+    def __init__(self, base_dir, decoder, workers=4, processes=True, batch_size=64, window=16, full_index=None,
+                 polling_interval=0.001, thread_id_bits=None, utcnow=datetime.datetime.utcnow, config=None):
+        if workers < 1 or batch_size < 1 or window < 1:
+            raise pychro.InvalidArgumentError('workers, batch_size and window must be at least 1')
+        self._batch_size = batch_size
+        self._polling_interval = polling_interval
+        reader_kwargs = dict(thread_id_bits=thread_id_bits, utcnow=utcnow, config=config)
+        self._reader = pychro.VanillaChronicleReader(base_dir, full_index=full_index, **reader_kwargs)
+        if processes:
+            self._tasks, self._results = multiprocessing.Queue(), multiprocessing.Queue()
+            worker_class = multiprocessing.Process
+        else:
+            self._tasks, self._results = queue.Queue(), queue.Queue()
+            worker_class = threading.Thread
+        self._workers = [worker_class(target=_decode_worker, daemon=True,
+                                      args=(base_dir, decoder, self._tasks, self._results, reader_kwargs))
+                         for _ in range(workers)]
+        self._window = threading.Semaphore(window)
+        self._stop_event = threading.Event()
+        self._walker = threading.Thread(target=self._walk, daemon=True)
+        self._reorder = dict()
+        # [[date, cycle lock, last batch of the cycle or None]] in order, guarded by _cycle_locks_lock
+        self._cycle_locks = []
+        self._cycle_locks_lock = threading.Lock()
+        self._next_seq = 0
+        self._batch = []
+        self._batch_pos = 0
+        self.batches = 0
+        [w.start() for w in self._workers]
+        self._walker.start()
+
+    def __iter__(self):
+        while True:
+            yield self.next_result()
+
+    def _walk(self):
+        reader = self._reader
+        seq = 0
+        held = None
+        while not self._stop_event.is_set():
+            self._window.acquire()
+            descriptors = []
+            while len(descriptors) < self._batch_size and not self._stop_event.is_set():
+                try:
+                    filenum, pos, thread = reader._next_position()
+                except pychro.NoData:
+                    if descriptors:
+                        break
+                    self._stop_event.wait(self._polling_interval)
+                    continue
+                if reader.get_date() != held:
+                    held = reader.get_date()
+                    self._hold_cycle(reader)
+                descriptors += [(reader.get_date(), reader.get_index() - 1, filenum, pos, thread)]
+            if descriptors:
+                self._held_until(seq, {descriptor[0] for descriptor in descriptors})
+                self._tasks.put((seq, descriptors))
+                seq += 1
+
+    # Holds the cycle the walker's reader has just opened
+    def _hold_cycle(self, reader):
+        with self._cycle_locks_lock:
+            self._cycle_locks += [[reader.get_date(), lock_cycle_shared(reader._cycle_dir), None]]
+
+    # Holds the cycles of dates until batch seq is handed back
+    def _held_until(self, seq, dates):
+        with self._cycle_locks_lock:
+            for held in self._cycle_locks:
+                if held[0] in dates:
+                    held[2] = seq
+
+    # Releases the cycles with no batches after seq, but the walker's latest
+    def _release_cycles(self, seq):
+        with self._cycle_locks_lock:
+            while len(self._cycle_locks) > 1 and (self._cycle_locks[0][2] is None or self._cycle_locks[0][2] <= seq):
+                release_cycle_lock(self._cycle_locks.pop(0)[1])
+
+    # (full index, result) of the next message, waiting up to timeout seconds before raising NoData
+    def next_result(self, timeout=None):
+        if self._batch_pos == len(self._batch):
+            while self._next_seq not in self._reorder:
+                try:
+                    seq, results, error = self._results.get(timeout=timeout)
+                except queue.Empty:
+                    raise pychro.NoData
+                self._reorder[seq] = (results, error)
+            results, error = self._reorder.pop(self._next_seq)
+            self._release_cycles(self._next_seq)
+            self._next_seq += 1
+            self._window.release()
+            self.batches += 1
+            if error is not None:
+                raise error
+            self._batch, self._batch_pos = results, 0
+        self._batch_pos += 1
+        return self._batch[self._batch_pos - 1]
+
+    def close(self):
+        self._stop_event.set()
+        self._window.release()
+        self._walker.join()
+        for _ in self._workers:
+            self._tasks.put(None)
+        [w.join() for w in self._workers]
+        self._reader.close()
+        while self._cycle_locks:
+            release_cycle_lock(self._cycle_locks.pop()[1])
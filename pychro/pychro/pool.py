@@ -0,0 +1,200 @@
+#
+#  Copyright 2015 Jon Turner
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import collections
+import datetime
+import os
+import threading
+from ._pychro import *
+from .archive import ARCHIVE_SUFFIX
+from .retention import lock_cycle_shared, release_cycle_lock
+from .vanilla_reader import VanillaChronicleReader, default_thread_id_bits
+
+
+class _PooledCycle:
+    # The index and data files of a cycle directory mapped once for all the cursors reading it.
+    # Index mappings replaced when a file grows are kept until the cycle is closed, as cursors may
+    # be reading from them. The pool holds the cycle's lock against a RetentionManager for its cursors.
+
+    def __init__(self, cycle_dir):
+        self.cycle_dir = cycle_dir
+        self.cycle_lock = lock_cycle_shared(cycle_dir)
+        self.refs = 0
+        self.lock = threading.RLock()
+        self.index_fh = []
+        self.index_mm = []
+        self.index_sizes = []
+        self.data_fhs = dict()
+        self.data_mms = collections.OrderedDict()
+        self.data_pins = dict()
+        self.retired = []
+
+    def close(self):
+        for mm in self.data_mms.values():
+            try:
+                mm.close()
+            except (ReferenceError, BufferError):
+                pass
+        self.data_mms.clear()
+        [close_mmap(*pin) for pin in self.data_pins.values()]
+        self.data_pins.clear()
+        [fh.close() for fh in self.data_fhs.values()]
+        self.data_fhs.clear()
+        [close_mmap(mm, size) for mm, size in zip(self.index_mm, self.index_sizes) if mm]
+        [close_mmap(mm, size) for mm, size in self.retired]
+        [fh.close() for fh in self.index_fh]
+        del self.index_mm[:], self.index_sizes[:], self.index_fh[:], self.retired[:]
+        release_cycle_lock(self.cycle_lock)
+        self.cycle_lock = None
+
+
+class ChroniclePool:
+    # One set of mappings of a chronicle shared by any number of cursors, e.g. one per subscriber of a
+    # fan-out service. Cursors are VanillaChronicleReaders with their own position which map each
+    # index and data file through the pool, so adding one opens no files. A cycle is mapped while any
+    # cursor is reading it. Archived cycles are not pooled.
+    #
+    # The pool's settings apply to all its cursors. max_mapped_memory is not applied, as data files
+    # stay mapped while any cursor is in their cycle.
+    #
+
+    def __init__(self, base_dir, thread_id_bits=None, utcnow=datetime.datetime.utcnow, mapping_options=None,
+                 config=None):
+        self._base_dir = base_dir
+        self._thread_id_bits = thread_id_bits
+        self._utcnow = utcnow
+        self._mapping_options = mapping_options
+        self._config = config
+        self._lock = threading.Lock()
+        self._cycles = dict()
+        if self._thread_id_bits is None:
+            self._thread_id_bits = default_thread_id_bits()
+
+    def __str__(self):
+        return '<ChroniclePool dir:%s cycles:%s>' % (self._base_dir, len(self._cycles))
+
+    def cursor(self, polling_interval=None, date=None, full_index=None, string_cache=None,
+               max_random_access_cycles=4):
+        return PooledChronicleReader(self, polling_interval=polling_interval, date=date, full_index=full_index,
+                                     string_cache=string_cache, max_random_access_cycles=max_random_access_cycles)
+
+    # {cycle directory: number of cursors}
+    def open_cycles(self):
+        with self._lock:
+            return {cycle_dir: cycle.refs for cycle_dir, cycle in self._cycles.items()}
+
+    def _acquire(self, cycle_dir):
+        with self._lock:
+            cycle = self._cycles.get(cycle_dir)
+            if cycle is None:
+                cycle = self._cycles[cycle_dir] = _PooledCycle(cycle_dir)
+            cycle.refs += 1
+            return cycle
+
+    def _release(self, cycle):
+        with self._lock:
+            cycle.refs -= 1
+            if cycle.refs:
+                return
+            del self._cycles[cycle.cycle_dir]
+        with cycle.lock:
+            cycle.close()
+
+
+class PooledChronicleReader(VanillaChronicleReader):
+    # A cursor of a ChroniclePool. close() releases its cycle to the pool.
+
+    def __init__(self, pool, **kwargs):
+        self._pool = pool
+        self._cycle = None
+        super().__init__(pool._base_dir, thread_id_bits=pool._thread_id_bits, utcnow=pool._utcnow,
+                         mapping_options=pool._mapping_options, config=pool._config, **kwargs)
+
+    def __str__(self):
+        return '<PooledChronicleReader dir:%s idx:%s>' % (self._cycle_dir, self._index)
+
+    def _update_cycle_dir(self, fp):
+        if fp.endswith(ARCHIVE_SUFFIX):
+            return super()._update_cycle_dir(fp)
+        self._close_cycle()
+        cycle = self._cycle = self._pool._acquire(fp)
+        self._index_fh, self._index_mm, self._index_sizes = cycle.index_fh, cycle.index_mm, cycle.index_sizes
+        self._data_fhs, self._data_mms, self._data_pins = cycle.data_fhs, cycle.data_mms, cycle.data_pins
+        self._cycle_dir = fp
+        self._update_date_and_index_base(self._config.cycle_date(self._cycle_of_path(fp)))
+
+    def _close_cycle(self):
+        if self._cycle is None:
+            return super()._close_cycle()
+        self._pool._release(self._cycle)
+        self._cycle = None
+        self._index_fh, self._index_mm, self._index_sizes = [], [], []
+        self._data_fhs, self._data_mms, self._data_pins = dict(), collections.OrderedDict(), dict()
+        self._reset_cursor()
+
+    def _open_next_index(self):
+        if self._cycle is None:
+            return super()._open_next_index()
+        file_num = len(self._index_mm)
+        with self._cycle.lock:
+            # another cursor may have opened it while waiting
+            if len(self._index_mm) != file_num:
+                return
+            fh, mm, size = self._open_index_file(file_num)
+            # cursors read the lists without the lock, taking an index file as open once it is in
+            # index_mm, so it is added to that last
+            self._index_fh.append(fh)
+            self._index_sizes.append(size)
+            self._index_mm.append(mm)
+
+    def _remap_index(self, index_filenum):
+        if self._cycle is None:
+            return super()._remap_index(index_filenum)
+        with self._cycle.lock:
+            size = min(os.fstat(self._index_fh[index_filenum].fileno()).st_size, self._index_file_size)
+            if size <= self._index_sizes[index_filenum]:
+                # True if another cursor has remapped it
+                return size > 0
+            mm = open_read_mmap(self._index_fh[index_filenum], size)
+            if self._mapping_options:
+                self._mapping_options.apply(mm, size)
+            if self._index_mm[index_filenum]:
+                self._cycle.retired += [(self._index_mm[index_filenum], self._index_sizes[index_filenum])]
+            self._index_mm[index_filenum] = mm
+            self._index_sizes[index_filenum] = size
+            return True
+
+    def _get_data_memory_map(self, filenum, thread):
+        mm = self._data_mms.get((filenum, thread))
+        if mm is not None or self._cycle is None:
+            return mm if mm is not None else super()._get_data_memory_map(filenum, thread)
+        with self._cycle.lock:
+            mm = self._data_mms.get((filenum, thread))
+            if mm is None:
+                mm = self._data_mms[(filenum, thread)] = self._open_data_memory_map(filenum, thread)
+            return mm
+
+    def _random_access_reader(self, date):
+        if date == self._date:
+            return self
+        chron = self._random_access.get(date)
+        if chron is not None:
+            self._random_access.move_to_end(date)
+            return chron
+        chron = self._random_access[date] = self._pool.cursor(date=date, max_random_access_cycles=0)
+        while len(self._random_access) > self._max_random_access_cycles:
+            self._random_access.popitem(last=False)[1].close()
+        return chron
@@ -0,0 +1,122 @@
+#
+#  Copyright 2015 Jon Turner
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import datetime
+import threading
+import time
+import pychro
+from ._pychro import HAVE_MAPPING_CONTROL
+
+
+class ReplayStats:
+    # errors are how late messages were handed over, in seconds, against their paced time
+
+    def __init__(self):
+        self.messages = 0
+        self.elapsed = 0.0
+        self.paced = 0
+        self.total_error = 0.0
+        self.max_error = 0.0
+
+    def __str__(self):
+        return '<ReplayStats msgs:%s rate:%.0f/s mean_error:%.6fs max_error:%.6fs>' % (
+            self.messages, self.rate(), self.mean_error(), self.max_error)
+
+    def rate(self):
+        return self.messages/self.elapsed if self.elapsed else 0.0
+
+    def mean_error(self):
+        return self.total_error/self.paced if self.paced else 0.0
+
+
+class Replayer(threading.Thread):
+    # Replays the messages from full_index (or the start) up to end_index (or the end of the chronicle)
+    # to handler(reader), returning ReplayStats from replay(). Started as a thread, replay() runs until
+    # done or stop().
+    #
+    # With speed None messages are replayed as fast as possible, the data files being read ahead if
+    # prefetch. Otherwise each message is handed over at the time of timestamp(reader), an integer of
+    # ticks_per_second, relative to the first message and divided by speed. Times are deadlines from
+    # the start of the replay rather than delays from the last message, so errors do not accumulate.
+    # The last spin seconds before each deadline are waited by spinning, as sleep() may oversleep.
+    #
+
+    def __init__(self, base_dir, handler, timestamp=None, speed=None, ticks_per_second=1, full_index=None,
+                 end_index=None, prefetch=True, spin=0.0005, thread_id_bits=None, utcnow=datetime.datetime.utcnow,
+                 config=None):
+        super().__init__(daemon=True)
+        if speed is not None and (timestamp is None or speed <= 0):
+            raise pychro.InvalidArgumentError('Paced replay requires timestamp and a positive speed')
+        self._base_dir = base_dir
+        self._handler = handler
+        self._timestamp = timestamp
+        self._speed = speed
+        self._ticks_per_second = ticks_per_second
+        self._full_index = full_index
+        self._end_index = end_index
+        self._spin = spin
+        self._reader_kwargs = dict(thread_id_bits=thread_id_bits, utcnow=utcnow, config=config)
+        if prefetch and speed is None and HAVE_MAPPING_CONTROL:
+            self._reader_kwargs['mapping_options'] = pychro.MappingOptions(advice='sequential', prefault_next=True)
+        self._stop_event = threading.Event()
+        self.stats = ReplayStats()
+
+    def _wait_until(self, deadline):
+        remaining = deadline - time.perf_counter()
+        if remaining > self._spin:
+            time.sleep(remaining - self._spin)
+        while time.perf_counter() < deadline:
+            pass
+
+    def replay(self):
+        stats = self.stats = ReplayStats()
+        reader = pychro.VanillaChronicleReader(self._base_dir, full_index=self._full_index, **self._reader_kwargs)
+        scale = None if self._speed is None else 1.0/(self._ticks_per_second*self._speed)
+        start = time.perf_counter()
+        first_timestamp = None
+        try:
+            while not self._stop_event.is_set():
+                if self._end_index is not None and reader.get_index() >= self._end_index:
+                    break
+                try:
+                    r = reader.next_reader()
+                except pychro.NoData:
+                    break
+                if scale is not None:
+                    offset = r.get_offset()
+                    timestamp = self._timestamp(r)
+                    r.set_offset(offset)
+                    if first_timestamp is None:
+                        first_timestamp = timestamp
+                        start = time.perf_counter()
+                    deadline = start + (timestamp - first_timestamp)*scale
+                    self._wait_until(deadline)
+                    error = time.perf_counter() - deadline
+                    stats.paced += 1
+                    stats.total_error += error
+                    stats.max_error = max(stats.max_error, error)
+                self._handler(r)
+                stats.messages += 1
+        finally:
+            stats.elapsed = time.perf_counter() - start
+            reader.close()
+        return stats
+
+    def run(self):
+        self.replay()
+
+    def stop(self):
+        self._stop_event.set()
@@ -0,0 +1,352 @@
+#
+#  Copyright 2015 Jon Turner
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import datetime
+import os
+import queue
+import socket
+import struct
+import threading
+import time
+import pychro
+
+# Frames exchanged between a Replicator on the source and a ReplicationSink on the destination:
+#
+#   'H'                                          source -> sink, asks for the position to resume from
+#   'A' | next full index                        sink -> source, the source messages before it are replicated
+#   'B' | next full index, count, (length, bytes)*count    source -> sink, a batch of messages
+#
+# The sink appends each batch and then commits the source position to a checkpoint in the destination's
+# REPLICATION_CHECKPOINT_FILE, so replication is at least once: a crash between the two repeats the batch.
+# The source positions are not positions in the destination, so are kept apart from its consumers'
+# CheckpointStore, which retention and lag monitoring read.
+
+FRAME_LENGTH = struct.Struct('<I')
+MESSAGE_LENGTH = struct.Struct('<I')
+BATCH_HEADER = struct.Struct('<cQI')
+ACK = struct.Struct('<cQ')
+DEFAULT_REPLICATION_NAME = 'replication'
+REPLICATION_CHECKPOINT_FILE = 'replication-checkpoints'
+
+
+class InProcessTransport:
+    # One end of a pair of queues created by InProcessTransport.pair().
+    # recv() returns the next frame, None after timeout seconds, or b'' once the other end has closed.
+
+    def __init__(self, send_queue, recv_queue):
+        self._send_queue = send_queue
+        self._recv_queue = recv_queue
+
+    @staticmethod
+    def pair():
+        a, b = queue.Queue(), queue.Queue()
+        return InProcessTransport(a, b), InProcessTransport(b, a)
+
+    def send(self, frame):
+        self._send_queue.put(frame)
+
+    def recv(self, timeout=None):
+        try:
+            return self._recv_queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self._send_queue.put(b'')
+
+
+def _socket(address):
+    # a str is the path of a Unix socket, otherwise (host, port)
+    if isinstance(address, str):
+        return socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    return socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+
+
+class SocketTransport:
+    # As InProcessTransport over a connected stream socket, each frame preceded by its length.
+
+    def __init__(self, sock):
+        self._sock = sock
+        self._buf = bytearray()
+        if sock.family == socket.AF_INET:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    @staticmethod
+    def connect(address):
+        sock = _socket(address)
+        sock.connect(address)
+        return SocketTransport(sock)
+
+    def send(self, frame):
+        self._sock.settimeout(None)
+        self._sock.sendall(FRAME_LENGTH.pack(len(frame)) + frame)
+
+    def recv(self, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            if len(self._buf) >= FRAME_LENGTH.size:
+                end = FRAME_LENGTH.size + FRAME_LENGTH.unpack_from(self._buf)[0]
+                if len(self._buf) >= end:
+                    frame = bytes(self._buf[FRAME_LENGTH.size:end])
+                    del self._buf[:end]
+                    return frame
+            self._sock.settimeout(None if deadline is None else max(0.0, deadline - time.time()))
+            try:
+                chunk = self._sock.recv(1024*1024)
+            except (socket.timeout, BlockingIOError):
+                return None
+            if not chunk:
+                return b''
+            self._buf += chunk
+
+    def close(self):
+        self._sock.close()
+
+
+class SocketListener:
+    # Accepts SocketTransports on a Unix socket path or (host, port), port 0 choosing a free port
+
+    def __init__(self, address):
+        self._sock = _socket(address)
+        if isinstance(address, str) and os.path.exists(address):
+            os.remove(address)
+        self._sock.bind(address)
+        self._sock.listen(1)
+        self.address = self._sock.getsockname()
+
+    def accept(self, timeout=None):
+        self._sock.settimeout(timeout)
+        try:
+            return SocketTransport(self._sock.accept()[0])
+        except socket.timeout:
+            return None
+
+    def close(self):
+        self._sock.close()
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.remove(self.address)
+
+
+class ReplicationStats:
+    def __init__(self):
+        self.start_time = time.time()
+        self.messages = 0
+        self.bytes = 0
+        self.batches = 0
+        self.acked_messages = 0
+        self.acked_index = 0
+        self.last_ack_latency = None
+        self.max_ack_latency = 0.0
+
+    def __str__(self):
+        return '<ReplicationStats msgs:%s acked:%s bytes:%s batches:%s rate:%.0f/s max_ack_latency:%.6fs>' % (
+            self.messages, self.acked_messages, self.bytes, self.batches, self.rate(), self.max_ack_latency)
+
+    # Messages sent but not yet acknowledged
+    def lag(self):
+        return self.messages - self.acked_messages
+
+    # Messages acknowledged per second
+    def rate(self):
+        elapsed = time.time() - self.start_time
+        return self.acked_messages/elapsed if elapsed else 0.0
+
+
+class Replicator(threading.Thread):
+    # Tails the chronicle in source_dir and sends the bytes of each message over transport, in batches of up
+    # to batch_size messages or batch_bytes bytes, with up to window batches not yet acknowledged.
+    # Replication resumes from the position acknowledged by the sink.
+    #
+    # update() sends the messages written since the last update. Started as a thread it calls update()
+    # until stop(), waiting polling_interval seconds whenever there is nothing to send.
+    #
+
+    def __init__(self, source_dir, transport, batch_size=1024, batch_bytes=1024*1024, window=4,
+                 thread_id_bits=None, polling_interval=0.01, ack_timeout=10.0, config=None):
+        super().__init__(daemon=True)
+        self._source_dir = source_dir
+        self._transport = transport
+        self._batch_size = batch_size
+        self._batch_bytes = batch_bytes
+        self._window = window
+        self._thread_id_bits = thread_id_bits
+        self._config = config
+        self._polling_interval = polling_interval
+        self._ack_timeout = ack_timeout
+        self._stop_event = threading.Event()
+        self._reader = None
+        self._in_flight = []
+        self.stats = ReplicationStats()
+
+    def _recv_ack(self, timeout):
+        frame = self._transport.recv(timeout)
+        if frame is None:
+            return None
+        if not frame:
+            raise ConnectionError('Replication sink closed')
+        kind, full_index = ACK.unpack(frame)
+        if kind != b'A':
+            raise pychro.CorruptData('Unexpected replication frame %s' % kind)
+        return full_index
+
+    def _start(self):
+        self._transport.send(b'H')
+        full_index = self._recv_ack(self._ack_timeout)
+        if full_index is None:
+            raise TimeoutError('No response from replication sink')
+        self.stats.acked_index = full_index
+        self._reader = pychro.VanillaChronicleReader(self._source_dir, full_index=full_index or None,
+                                                     thread_id_bits=self._thread_id_bits, config=self._config)
+
+    # Processes acknowledgements, waiting up to timeout for the first
+    def _process_acks(self, timeout):
+        while self._in_flight:
+            full_index = self._recv_ack(timeout)
+            if full_index is None:
+                return
+            now = time.time()
+            while self._in_flight and self._in_flight[0][0] <= full_index:
+                _, sent_time, count = self._in_flight.pop(0)
+                self.stats.acked_messages += count
+                self.stats.last_ack_latency = now - sent_time
+                self.stats.max_ack_latency = max(self.stats.max_ack_latency, self.stats.last_ack_latency)
+            self.stats.acked_index = full_index
+            timeout = 0
+
+    def _next_batch(self):
+        reader = self._reader
+        parts = [None]
+        count = size = 0
+        while count < self._batch_size and size < self._batch_bytes:
+            try:
+                # joined into the batch straight from the mapped data files
+                data = reader.next_message_view()
+            except pychro.NoData:
+                break
+            parts += [MESSAGE_LENGTH.pack(len(data)), data]
+            count += 1
+            size += len(data)
+        if not count:
+            return None, 0, 0
+        parts[0] = BATCH_HEADER.pack(b'B', reader.get_index(), count)
+        return b''.join(parts), count, size
+
+    def update(self):
+        if self._reader is None:
+            self._start()
+        sent = 0
+        while True:
+            if len(self._in_flight) >= self._window:
+                self._process_acks(self._ack_timeout)
+                if len(self._in_flight) >= self._window:
+                    raise TimeoutError('No acknowledgement from replication sink')
+            else:
+                self._process_acks(0)
+            frame, count, size = self._next_batch()
+            if not count:
+                return sent
+            self._transport.send(frame)
+            self._in_flight += [(self._reader.get_index(), time.time(), count)]
+            self.stats.messages += count
+            self.stats.bytes += size
+            self.stats.batches += 1
+            sent += count
+
+    # Waits until every batch sent has been acknowledged
+    def sync(self):
+        while self._in_flight:
+            before = len(self._in_flight)
+            self._process_acks(self._ack_timeout)
+            if len(self._in_flight) == before:
+                raise TimeoutError('No acknowledgement from replication sink')
+
+    def run(self):
+        while not self._stop_event.is_set():
+            if not self.update():
+                self._stop_event.wait(self._polling_interval)
+        self.sync()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def close(self):
+        if self._reader:
+            self._reader.close()
+            self._reader = None
+        self._transport.close()
+
+
+class ReplicationSink(threading.Thread):
+    # Receives from a Replicator over transport and appends the messages to the chronicle in dest_dir,
+    # in the destination's current cycle. The source position is kept in the destination's replication
+    # checkpoint called name, so one destination can replicate several sources under different names.
+    # Runs until stop() or the transport is closed by the Replicator.
+    #
+
+    def __init__(self, dest_dir, transport, name=DEFAULT_REPLICATION_NAME, thread_id_bits=None,
+                 flush_every=None, utcnow=datetime.datetime.utcnow, config=None):
+        super().__init__(daemon=True)
+        self._dest_dir = dest_dir
+        self._transport = transport
+        self._name = name
+        self._thread_id_bits = thread_id_bits
+        self._config = config
+        self._flush_every = flush_every
+        self._utcnow = utcnow
+        self._stop_event = threading.Event()
+        self.messages = 0
+
+    def _append_batch(self, frame, appender):
+        _, full_index, count = BATCH_HEADER.unpack_from(frame)
+        data = memoryview(frame)
+        offset = BATCH_HEADER.size
+        for _ in range(count):
+            length = MESSAGE_LENGTH.unpack_from(frame, offset)[0]
+            offset += MESSAGE_LENGTH.size
+            appender.write_raw_bytes(data[offset:offset+length])
+            appender.finish()
+            offset += length
+        self.messages += count
+        return full_index
+
+    def run(self):
+        # the writer is created here as appenders belong to the thread creating them
+        writer = pychro.VanillaChronicleWriter(self._dest_dir, thread_id_bits=self._thread_id_bits,
+                                               utcnow=self._utcnow, config=self._config)
+        store = pychro.CheckpointStore(self._dest_dir, filename=REPLICATION_CHECKPOINT_FILE)
+        try:
+            checkpoint = store.consumer(self._name, flush_every=self._flush_every)
+            appender = writer.get_appender()
+            while not self._stop_event.is_set():
+                frame = self._transport.recv(0.1)
+                if frame is None:
+                    continue
+                if not frame:
+                    break
+                if frame[:1] == b'H':
+                    self._transport.send(ACK.pack(b'A', checkpoint.get()))
+                elif frame[:1] == b'B':
+                    full_index = self._append_batch(frame, appender)
+                    checkpoint.commit(full_index)
+                    self._transport.send(ACK.pack(b'A', full_index))
+                else:
+                    raise pychro.CorruptData('Unexpected replication frame %s' % frame[:1])
+        finally:
+            store.close()
+            writer.close()
+
+    def stop(self):
+        self._stop_event.set()
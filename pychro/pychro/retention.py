@@ -0,0 +1,223 @@
+#
+#  Copyright 2015 Jon Turner
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import datetime
+import os
+import shutil
+import threading
+import pychro
+from .archive import ARCHIVE_SUFFIX, archive_cycle
+from .checkpoint import CHECKPOINT_FILE
+from .compact import compact_cycle
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Readers hold a shared flock on the directory or archive of the cycle they have open, which a
+# RetentionManager must take exclusively before deleting, archiving or compacting the cycle, or deleting
+# the archive. Everything else reading the files of a cycle holds one too: warm_up_cycle() while it reads
+# the cycle, check_chronicle() for the cycles its workers check, and a DecodePipeline for the cycles of
+# the batches it has sent to its workers until their results are handed back. On Windows, where there
+# is no flock, files which are open cannot be deleted or truncated anyway.
+
+RETENTION_ACTIONS = ('delete', 'archive', 'compact')
+
+
+# Returns a descriptor holding a shared lock of cycle_dir, or of an archive, or None if it no longer exists
+def lock_cycle_shared(cycle_dir):
+    if fcntl is None:
+        return None
+    try:
+        fd = os.open(cycle_dir, os.O_RDONLY)
+    except FileNotFoundError:
+        return None
+    fcntl.flock(fd, fcntl.LOCK_SH)
+    if not os.path.exists(cycle_dir):
+        # removed while waiting for the lock
+        os.close(fd)
+        return None
+    return fd
+
+
+# Returns a descriptor holding an exclusive lock of cycle_dir, or None if it is in use
+def try_lock_cycle_exclusive(cycle_dir):
+    fd = os.open(cycle_dir, os.O_RDONLY)
+    if fcntl is None:
+        return fd
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return None
+    return fd
+
+
+def release_cycle_lock(fd):
+    if fd is not None:
+        os.close(fd)
+
+
+# Bytes of the files of a cycle directory or of an archive, as reclaimed is counted by compact_cycle
+def _size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files)
+
+
+class RetentionReport:
+    def __init__(self):
+        self.reclaimed = 0
+        self.deleted = []
+        self.archived = []
+        self.compacted = []
+        self.in_use = []
+        self.unconsumed = []
+
+    def __str__(self):
+        return '<RetentionReport reclaimed:%s deleted:%s archived:%s compacted:%s in_use:%s unconsumed:%s>' % (
+            self.reclaimed, len(self.deleted), len(self.archived), len(self.compacted), len(self.in_use),
+            len(self.unconsumed))
+
+
+class RetentionManager(threading.Thread):
+    # Applies action ('delete', 'archive' or 'compact') to the closed cycles of a chronicle older than
+    # max_age (a timedelta, measured from the end of the cycle) and/or beyond the newest keep_cycles.
+    # Cycles which a reader has open are skipped until a later pass, as are those holding messages not
+    # yet consumed by a consumer of the CheckpointStore, unless respect_checkpoints is False.
+    # thread_id_bits is that of the writers, as compaction finds the data files from the index.
+    # Deleting a cycle also deletes its archive and its time and key index sidecars.
+    #
+    # update() makes one pass and returns a RetentionReport. Started as a thread it calls update() every
+    # interval seconds until stop(), adding up the bytes reclaimed in reclaimed.
+    #
+
+    def __init__(self, base_dir, max_age=None, keep_cycles=None, action='delete', codec='zlib',
+                 respect_checkpoints=True, interval=60.0, thread_id_bits=None, utcnow=datetime.datetime.utcnow,
+                 config=None):
+        super().__init__(daemon=True)
+        if action not in RETENTION_ACTIONS:
+            raise pychro.InvalidArgumentError('Unknown retention action %s' % action)
+        if max_age is None and keep_cycles is None:
+            raise pychro.InvalidArgumentError('Retention requires max_age and/or keep_cycles')
+        self._base_dir = base_dir
+        self._max_age = max_age
+        self._keep_cycles = keep_cycles
+        self._action = action
+        self._codec = codec
+        self._respect_checkpoints = respect_checkpoints
+        self._interval = interval
+        self._thread_id_bits = thread_id_bits
+        self._utcnow = utcnow
+        self._config = config or pychro.DEFAULT_CONFIG
+        self._stop_event = threading.Event()
+        self.reclaimed = 0
+
+    # Sorted [(cycle, [paths])] of the cycle directories and archives
+    def _list_cycles(self):
+        cycles = dict()
+        for f in os.listdir(self._base_dir):
+            name = f[:-len(ARCHIVE_SUFFIX)] if f.endswith(ARCHIVE_SUFFIX) else f
+            cycle = self._config.parse_cycle_name(name)
+            if cycle is not None:
+                cycles.setdefault(cycle, []).append(os.path.join(self._base_dir, f))
+        return sorted(cycles.items())
+
+    # The first cycle with messages not yet consumed, or None
+    def _first_unconsumed_cycle(self):
+        if not self._respect_checkpoints or not os.path.isfile(os.path.join(self._base_dir, CHECKPOINT_FILE)):
+            return None
+        store = pychro.CheckpointStore(self._base_dir)
+        positions = store.positions()
+        store.close()
+        if not positions:
+            return None
+        return min(positions.values()) >> self._config.cycle_index_pos
+
+    def _remove_sidecars(self, cycle):
+        prefix = self._config.cycle_name(cycle)
+        for f in os.listdir(self._base_dir):
+            if f.startswith(prefix + '.') and f.endswith((pychro.TIME_INDEX_SUFFIX, pychro.KEY_INDEX_SUFFIX)):
+                os.remove(os.path.join(self._base_dir, f))
+
+    def _apply(self, path, report):
+        before = _size(path)
+        archived = path.endswith(ARCHIVE_SUFFIX)
+        if archived and self._action != 'delete':
+            return
+        fd = try_lock_cycle_exclusive(path)
+        if fd is None:
+            report.in_use += [path]
+            return
+        try:
+            if archived:
+                if fcntl is None:
+                    # Windows removes no file which is open, here or by a reader
+                    release_cycle_lock(fd)
+                    fd = None
+                os.remove(path)
+                report.deleted += [path]
+                after = 0
+            elif self._action == 'delete':
+                shutil.rmtree(path)
+                report.deleted += [path]
+                after = 0
+            elif self._action == 'archive':
+                archive_path = archive_cycle(path, codec=self._codec, utcnow=self._utcnow, config=self._config)
+                report.archived += [path]
+                after = _size(archive_path)
+            else:
+                reclaimed = compact_cycle(path, thread_id_bits=self._thread_id_bits, utcnow=self._utcnow,
+                                          config=self._config)
+                if reclaimed:
+                    report.compacted += [path]
+                after = before - reclaimed
+        finally:
+            release_cycle_lock(fd)
+        report.reclaimed += max(0, before - after)
+
+    def update(self):
+        report = RetentionReport()
+        current = self._config.cycle_of(self._utcnow())
+        cycles = self._list_cycles()
+        if self._keep_cycles:
+            cycles = cycles[:-self._keep_cycles]
+        unconsumed = self._first_unconsumed_cycle()
+        for cycle, paths in cycles:
+            if cycle >= current:
+                break
+            if self._max_age is not None:
+                end = datetime.datetime(1970, 1, 1) + datetime.timedelta(seconds=(cycle + 1)*self._config.cycle_length)
+                if end + self._max_age > self._utcnow():
+                    break
+            if unconsumed is not None and cycle >= unconsumed:
+                report.unconsumed += paths
+                continue
+            for path in paths:
+                self._apply(path, report)
+            if self._action == 'delete' and not any(os.path.exists(p) for p in paths):
+                self._remove_sidecars(cycle)
+        self.reclaimed += report.reclaimed
+        return report
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self.update()
+            self._stop_event.wait(self._interval)
+
+    def stop(self):
+        self._stop_event.set()
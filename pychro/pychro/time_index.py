@@ -0,0 +1,166 @@
+#
+#  Copyright 2015 Jon Turner
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import math
+import os
+import struct
+import threading
+import pychro
+
+# A time index is a sidecar file per cycle, <base_dir>/<yyyymmdd>.tidx, of (timestamp, full index)
+# records for every message whose index within the cycle is a multiple of the stride.
+# Timestamps are in whatever unit the extractor returns, and are assumed to be non-decreasing in
+# index order. They are stored as 64 bit integers, so non-integer timestamps, e.g. seconds read with
+# read_double, are rounded up: a checkpoint is then never later than the time searched for, though
+# seek_time() may scan from an earlier one. Use a finer unit to keep checkpoints precise.
+
+TIME_INDEX_SUFFIX = '.tidx'
+TIME_INDEX_RECORD = struct.Struct('<qQ')
+DEFAULT_TIME_INDEX_STRIDE = 1024
+
+
+def time_index_path(base_dir, date, config=None):
+    config = config or pychro.DEFAULT_CONFIG
+    return os.path.join(base_dir, config.cycle_name(config.cycle_of(date)) + TIME_INDEX_SUFFIX)
+
+
+def time_index_paths(base_dir, config=None):
+    config = config or pychro.DEFAULT_CONFIG
+    cycles = [(config.parse_cycle_name(f[:-len(TIME_INDEX_SUFFIX)]), f) for f in os.listdir(base_dir)
+              if f.endswith(TIME_INDEX_SUFFIX)]
+    return [os.path.join(base_dir, f) for cycle, f in sorted(c for c in cycles if c[0] is not None)]
+
+
+class TimeIndex:
+    # The checkpoints of one cycle, as of when it was opened.
+
+    def __init__(self, path):
+        with open(path, 'rb') as fh:
+            self._data = fh.read()
+        self._len = len(self._data)//TIME_INDEX_RECORD.size
+
+    def __len__(self):
+        return self._len
+
+    def __getitem__(self, i):
+        if not 0 <= i < self._len:
+            raise IndexError(i)
+        return TIME_INDEX_RECORD.unpack_from(self._data, i*TIME_INDEX_RECORD.size)
+
+    # Position of the last checkpoint with a timestamp <= timestamp, or -1
+    def floor(self, timestamp):
+        lo, hi = 0, self._len
+        while lo < hi:
+            mid = (lo + hi)//2
+            if self[mid][0] <= timestamp:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo - 1
+
+
+# The full index of the last checkpoint at or before timestamp over all cycles, or None
+def find_time_checkpoint(base_dir, timestamp, config=None):
+    found = None
+    for path in time_index_paths(base_dir, config):
+        index = TimeIndex(path)
+        if not len(index) or index[0][0] > timestamp:
+            break
+        found = index[index.floor(timestamp)][1]
+    return found
+
+
+class TimeIndexer(threading.Thread):
+    # Maintains the time index of a chronicle.
+    #
+    # Either call add() with the full index returned by Appender.finish() and the message's
+    # timestamp while writing, or tail the chronicle with update(), which indexes the messages
+    # written since the last checkpoint using extractor(reader) -> timestamp. Started as a thread
+    # it calls update() every polling_interval seconds until stop().
+    #
+
+    def __init__(self, base_dir, extractor=None, stride=DEFAULT_TIME_INDEX_STRIDE, thread_id_bits=None,
+                 polling_interval=1.0, config=None):
+        super().__init__(daemon=True)
+        self._base_dir = base_dir
+        self._extractor = extractor
+        self._stride = stride
+        self._thread_id_bits = thread_id_bits
+        self._config = config
+        self._polling_interval = polling_interval
+        self._stop_event = threading.Event()
+        self._reader = None
+        self._fh = None
+        self._fh_date = None
+
+    def _append(self, date, full_index, timestamp):
+        if self._fh_date != date:
+            if self._fh:
+                self._fh.close()
+            self._fh = open(time_index_path(self._base_dir, date, self._config), 'ab')
+            self._fh_date = date
+        self._fh.write(TIME_INDEX_RECORD.pack(math.ceil(timestamp), full_index))
+
+    def add(self, full_index, timestamp):
+        date, index = pychro.VanillaChronicleReader.from_full_index(full_index, self._config)
+        if index % self._stride == 0:
+            self._append(date, full_index, timestamp)
+            self._fh.flush()
+
+    def _resume_index(self):
+        paths = time_index_paths(self._base_dir, self._config)
+        if paths:
+            index = TimeIndex(paths[-1])
+            if len(index):
+                return index[len(index)-1][1] + 1
+        return None
+
+    def update(self):
+        if self._reader is None:
+            self._reader = pychro.VanillaChronicleReader(self._base_dir, full_index=self._resume_index(),
+                                                         thread_id_bits=self._thread_id_bits, config=self._config)
+        reader = self._reader
+        added = 0
+        while True:
+            try:
+                position = reader._next_position()
+            except pychro.NoData:
+                break
+            full_index = reader.get_index() - 1
+            if pychro.VanillaChronicleReader.from_full_index(full_index, self._config)[1] % self._stride == 0:
+                timestamp = self._extractor(pychro.RawByteReader(*reader.get_raw_bytes(*position)))
+                self._append(reader.get_date(), full_index, timestamp)
+                added += 1
+        if self._fh:
+            self._fh.flush()
+        return added
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self.update()
+            self._stop_event.wait(self._polling_interval)
+
+    def stop(self):
+        self._stop_event.set()
+
+    def close(self):
+        if self._reader:
+            self._reader.close()
+            self._reader = None
+        if self._fh:
+            self._fh.close()
+            self._fh = None
+            self._fh_date = None
@@ -14,66 +14,109 @@
 # limitations under the License.
 #
 
+import io
 import time
 import datetime
 import collections
 import mmap
 import struct
-import re
+import sys
+import ctypes
 from ._pychro import *
+from .archive import CycleArchive, ARCHIVE_SUFFIX, _used_length
+from .time_index import find_time_checkpoint
+from .warmup import WarmUpReport, warm_up_cycle
+from .config import DEFAULT_CONFIG
+from .retention import lock_cycle_shared, release_cycle_lock
+from .lag import Lag
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Data files of Java Vanilla Chronicle, and of pychro since it writes message lengths, start with the
+# complement of the first message's length, which is never zero. Earlier pychro data files start with zeros.
+def data_file_has_lengths(head):
+    return head[:4] != b'\x00\x00\x00\x00'
+
+
+def default_thread_id_bits():
+    if pychro.PLATFORM_WINDOWS:
+        return 16
+    with open('/proc/sys/kernel/pid_max') as fh:
+        binstr = str(bin(int(fh.read().strip())))
+        return len(binstr) - binstr.find('1') - 1
 
 
 class VanillaChronicleReader:
     # polling_interval of None means non-blocking and an exception of NoData will be raised
     # polling_interval of 0 means blocking spin (cpu intensive)
     #
-    # provide date (for start of day) or index (which includes date)
+    # provide date (for start of day, or the cycle) or index (which includes date)
     #
     # max mapped memory only relevant on windows due to the way memory mapped files are handled
     #
+    # string_cache, a StringCache, is used by the readers returned to decode strings.
+    #
+    # read_at()/read_many() read by full index without moving the cursor, keeping the mappings of up to
+    # max_random_access_cycles cycles other than the cursor's open.
+    #
+    # config, a VanillaChronicleConfig, gives the file sizes and cycles of the chronicle if not Java's defaults.
+    #
+    # mapping_options, a MappingOptions, controls pre-faulting, madvise hints and locking of the mappings.
+    #
     # close() resets to chronicle, releasing all resources. Reading will begin again from the start.
     #
 
     def __init__(self, base_dir, polling_interval=None, date=None, full_index=None,
                  max_mapped_memory=pychro.DEFAULT_MAX_MAPPED_MEMORY_PER_READER,
-                 thread_id_bits=None, utcnow=datetime.datetime.utcnow):
-        self._index_file_size = pychro.INDEX_FILE_SIZE
+                 thread_id_bits=None, utcnow=datetime.datetime.utcnow, max_random_access_cycles=4,
+                 string_cache=None, mapping_options=None, config=None):
+        self._config = config or DEFAULT_CONFIG
+        self._mapping_options = mapping_options
+        self._data_pins = dict()
+        self._index_file_size = self._config.index_block_size
+        self._string_cache = string_cache
         self._utcnow = utcnow
         self._thread_id_bits = thread_id_bits
         if self._thread_id_bits is None:
-            if pychro.PLATFORM_WINDOWS:
-                self._thread_id_bits = 16
-            else:
-                with open('/proc/sys/kernel/pid_max') as fh:
-                    binstr = str(bin(int(fh.read().strip())))
-                    self._thread_id_bits = len(binstr) - binstr.find('1') - 1
+            self._thread_id_bits = default_thread_id_bits()
 
         self._base_dir = base_dir
         self._index_data_offset_bits = 64 - self._thread_id_bits
         self._thread_id_idx_mask = eval('0b'+'1'*self._thread_id_bits+'0'*self._index_data_offset_bits)
         self._thread_id_mask = eval('0b'+'1'*self._thread_id_bits)
         self._index_data_offset_mask = eval('0b'+'0'*self._thread_id_bits+'1'*self._index_data_offset_bits)
-        self._max_maps = (max_mapped_memory//(pychro.DATA_FILE_SIZE)) if max_mapped_memory else None
+        self._max_mapped_memory = max_mapped_memory
+        self._max_maps = (max_mapped_memory//self._config.data_block_size) if max_mapped_memory else None
         if self._max_maps is not None and self._max_maps < 1:
-            raise pychro.ConfigError('max_mapped_memory must be >= 64MB')
+            raise pychro.ConfigError('max_mapped_memory must be >= %s' % self._config.data_block_size)
+        self._max_random_access_cycles = max_random_access_cycles
+        self._random_access = collections.OrderedDict()
         self._polling_interval = polling_interval
         self._base_dir = base_dir
 
         self._max_index = 0
         self._index = 0
         self._date = None
+        self._cycle_num = None
         self._cycle_dir = None
         self._full_index_base = None
         self._index_fh = []
         self._index_mm = []
+        self._index_sizes = []
         self._data_fhs = dict()
         self._data_mms = collections.OrderedDict()
+        self._archive = None
+        self._cycle_lock = None
         index = None
 
         if full_index:
             if date:
                 raise pychro.InvalidArgumentError('Providing index and date are mutually exclusive')
-            date, index = VanillaChronicleReader.from_full_index(full_index)
+            date, index = VanillaChronicleReader.from_full_index(full_index, self._config)
 
         if date is None:
             try:
@@ -81,7 +124,7 @@ class VanillaChronicleReader:
             except pychro.NoData:
                 return
         else:
-            self._update_cycle_dir(os.path.join(base_dir, '%4d%02d%02d' % (date.year, date.month, date.day)))
+            self._update_cycle_dir(self._cycle_path(date))
         if index:
             self._index = index
 
@@ -91,37 +134,79 @@ class VanillaChronicleReader:
     def __exit__(self):
         self.close()
 
+    # config is needed if the chronicle's entries_per_cycle or cycle_length is not the default
     @staticmethod
-    def to_full_index(date, index):
-        return index + ((int(datetime.datetime(date.year, date.month, date.day,
-                                      tzinfo=datetime.timezone.utc).timestamp())//86400) << pychro.CYCLE_INDEX_POS)
+    def to_full_index(date, index, config=None):
+        config = config or DEFAULT_CONFIG
+        return index + (config.cycle_of(date) << config.cycle_index_pos)
 
     @staticmethod
-    def from_full_index(full_index):
-        index = full_index & pychro.INDEX_OFFSET_MASK
-        date = datetime.datetime.fromtimestamp((full_index >> pychro.CYCLE_INDEX_POS)*86400,
-                                               tz=datetime.timezone.utc).date()
-        return date, index
+    def from_full_index(full_index, config=None):
+        config = config or DEFAULT_CONFIG
+        index = full_index & config.cycle_index_mask
+        return config.cycle_date(full_index >> config.cycle_index_pos), index
+
+    def _cycle_of_path(self, fp):
+        name = os.path.split(fp)[1]
+        if name.endswith(ARCHIVE_SUFFIX):
+            name = name[:-len(ARCHIVE_SUFFIX)]
+        return self._config.parse_cycle_name(name)
 
     def _update_cycle_dir(self, fp):
-        self.close()
+        self._close_cycle()
+        # held while the cycle is open, so a RetentionManager leaves it alone
+        self._cycle_lock = lock_cycle_shared(fp)
+        if self._cycle_lock is None and not os.path.isdir(fp) and os.path.isfile(fp + ARCHIVE_SUFFIX):
+            fp += ARCHIVE_SUFFIX
+            self._cycle_lock = lock_cycle_shared(fp)
         self._cycle_dir = fp
-        dstr = os.path.split(self._cycle_dir)[1]
-        self._update_date_and_index_base(datetime.date(int(dstr[:4]), int(dstr[4:6]), int(dstr[6:8])))
+        if fp.endswith(ARCHIVE_SUFFIX):
+            self._archive = CycleArchive(fp)
+        self._update_date_and_index_base(self._config.cycle_date(self._cycle_of_path(fp)))
 
+    # date is a date or datetime in the cycle
     def _update_date_and_index_base(self, date):
-        self._date = date
-        self._full_index_base = VanillaChronicleReader.to_full_index(date, 0)
+        self._cycle_num = self._config.cycle_of(date)
+        self._date = self._config.cycle_date(self._cycle_num)
+        self._full_index_base = self._cycle_num << self._config.cycle_index_pos
 
     def _open_next_index(self):
         file_num = len(self._index_fh)
         if not self._cycle_dir:
             self._try_set_cycle_dir()
+        fh, mm, size = self._open_index_file(file_num)
+        self._index_fh += [fh]
+        self._index_sizes += [size]
+        self._index_mm += [mm]
+
+    # The file, mapping (None while the file is empty) and mapped size of index file file_num
+    def _open_index_file(self, file_num):
         try:
-            self._index_fh += [open(os.path.join(self._cycle_dir, 'index-%s' % file_num), 'rb')]
+            fh = open(os.path.join(self._cycle_dir, 'index-%s' % file_num), 'rb')
         except FileNotFoundError:
             raise pychro.NoChronicleForDate
-        self._index_mm += [open_read_mmap(self._index_fh[-1], pychro.INDEX_FILE_SIZE)]
+        size = min(os.fstat(fh.fileno()).st_size, self._index_file_size)
+        if not size:
+            return fh, None, 0
+        mm = open_read_mmap(fh, size)
+        if self._mapping_options:
+            self._mapping_options.apply(mm, size)
+        return fh, mm, size
+
+    # Index files of compacted cycles may be shorter than index_block_size, and one still being
+    # created by a writer may be growing, so only the current length of the file is mapped.
+    # Returns False if the file has not grown since it was last mapped.
+    def _remap_index(self, index_filenum):
+        size = min(os.fstat(self._index_fh[index_filenum].fileno()).st_size, self._index_file_size)
+        if size <= self._index_sizes[index_filenum]:
+            return False
+        if self._index_mm[index_filenum]:
+            close_mmap(self._index_mm[index_filenum], self._index_sizes[index_filenum])
+        self._index_mm[index_filenum] = open_read_mmap(self._index_fh[index_filenum], size)
+        self._index_sizes[index_filenum] = size
+        if self._mapping_options:
+            self._mapping_options.apply(self._index_mm[index_filenum], size)
+        return True
 
     def _open_data_file(self, filenum, thread):
         if self._cycle_dir is None:
@@ -133,49 +218,99 @@ class VanillaChronicleReader:
             raise pychro.CorruptData
 
     def _open_data_memory_map(self, filenum, thread):
+        if self._archive is not None:
+            try:
+                return self._archive.open_data('data-%s-%s' % (thread, filenum))
+            except KeyError:
+                raise pychro.CorruptData
         fh = self._data_fhs.get((filenum, thread))
         if not fh:
             fh = self._open_data_file(filenum, thread)
             self._data_fhs[(filenum, thread)] = fh
         if pychro.PLATFORM_WINDOWS:
             return mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mapping_options:
+            mm = mmap.mmap(fh.fileno(), 0, flags=self._mapping_options.mmap_flags(), prot=mmap.PROT_READ)
+            self._apply_data_mapping_options(mm, fh, filenum, thread)
+            return mm
         return mmap.mmap(fh.fileno(), 0, prot=mmap.PROT_READ)
 
-    def _try_set_cycle_dir(self, date=None):
-        date_str = '%4d%02d%02d' % (date.year, date.month, date.day) if date else None
-        for f in sorted(os.listdir(self._base_dir)):
-            if date_str and date_str > f:
-                continue
+    def _apply_data_mapping_options(self, mm, fh, filenum, thread):
+        pin = self._mapping_options.apply_to_mmap(mm, fh)
+        if pin:
+            self._data_pins[(filenum, thread)] = (pin, len(mm))
+        if self._mapping_options.prefault_next:
+            self._mapping_options.prefetch(os.path.join(self._cycle_dir, 'data-%s-%s' % (thread, filenum+1)))
+
+    def _release_data_pin(self, key):
+        pin = self._data_pins.pop(key, None)
+        if pin:
+            close_mmap(*pin)
+
+    # Sorted (cycle number, path) of the cycles, either directories or archives.
+    # A directory is preferred to an archive of the same cycle, which may still be being written.
+    def _list_cycles(self):
+        cycles = dict()
+        for f in os.listdir(self._base_dir):
             fp = os.path.join(self._base_dir, f)
-            if not re.match('^[0-9]{8}$', f):
+            cycle = self._cycle_of_path(fp)
+            if cycle is None:
                 continue
-            if not os.path.isdir(fp):
+            if f.endswith(ARCHIVE_SUFFIX):
+                cycles.setdefault(cycle, fp)
+            elif os.path.isdir(fp):
+                cycles[cycle] = fp
+        return sorted(cycles.items())
+
+    # The directory of the cycle for date, or its archive if only that exists
+    def _cycle_path(self, date):
+        fp = os.path.join(self._base_dir, self._config.cycle_name(self._config.cycle_of(date)))
+        if not os.path.isdir(fp) and os.path.isfile(fp + ARCHIVE_SUFFIX):
+            return fp + ARCHIVE_SUFFIX
+        return fp
+
+    def _try_set_cycle_dir(self, date=None):
+        start = self._config.cycle_of(date) if date else None
+        for cycle, fp in self._list_cycles():
+            if start is not None and start > cycle:
                 continue
             self._update_cycle_dir(fp)
             return
         raise pychro.NoData
 
     def _try_next_date(self):
-        _next = False
         if not self._cycle_dir:
             self._try_set_cycle_dir()
-        cur_date = os.path.split(self._cycle_dir)[1]
-        for f in sorted(os.listdir(self._base_dir)):
-            if f == cur_date:
-                _next = True
-            elif _next:
-                self._update_cycle_dir(os.path.join(self._base_dir, f))
+        for cycle, fp in self._list_cycles():
+            if cycle > self._cycle_num:
+                self._update_cycle_dir(fp)
                 return True
         return False
 
     def _get_index_value(self, index_offset):
         index_offset *= 8
-        index_filenum = index_offset >> pychro.FILENUM_FROM_INDEX_SHIFT
-        index_offset &= pychro.INDEX_OFFSET_MASK
+        index_filenum = index_offset >> self._config.filenum_from_index_shift
+        index_offset &= self._config.index_offset_mask
+        if self._archive is not None:
+            return self._archive.read_index(index_filenum, index_offset)
         if index_filenum >= len(self._index_mm):
             self._open_next_index()
+        if index_offset >= self._index_sizes[index_filenum]:
+            if not self._remap_index(index_filenum) or index_offset >= self._index_sizes[index_filenum]:
+                return 0
         return read_mmap(self._index_mm[index_filenum], index_offset)
 
+    # Up to max_count index values from the cursor, read in place from a single index file, or None if
+    # the next value is not yet written or the cycle is archived.
+    def _get_index_values(self, max_count):
+        if self._archive is not None or not self._get_index_value(self._index):
+            return None
+        index_offset = self._index*8
+        index_filenum = index_offset >> self._config.filenum_from_index_shift
+        index_offset &= self._config.index_offset_mask
+        count = min(max_count, (self._index_sizes[index_filenum] - index_offset)//8)
+        return (ctypes.c_longlong*count).from_address(self._index_mm[index_filenum] + index_offset)
+
     def _get_data_memory_map(self, filenum, thread):
         if (filenum, thread) in self._data_mms:
             return self._data_mms[(filenum, thread)]
@@ -184,9 +319,11 @@ class VanillaChronicleReader:
         self._data_mms[(filenum, thread)] = fm
 
         if self._max_maps and len(self._data_mms) > self._max_maps:
+            key, evicted = self._data_mms.popitem(last=False)
+            self._release_data_pin(key)
             try:
-                self._data_mms.popitem(last=False)[1].close()
-            except ReferenceError:
+                evicted.close()
+            except (ReferenceError, BufferError):
                 pass
         return fm
 
@@ -196,7 +333,7 @@ class VanillaChronicleReader:
             pos = val & self._index_data_offset_mask
 
             if not pos:
-                if self._date != self._utcnow().date() and self._try_next_date():
+                if self._cycle_num != self._config.cycle_of(self._utcnow()) and self._try_next_date():
                     continue
                 if self._polling_interval is None:
                     raise pychro.NoData
@@ -205,22 +342,86 @@ class VanillaChronicleReader:
                 continue
             break
 
-        filenum = (pos >> pychro.FILENUM_FROM_POS_SHIFT)
-        pos = pos & pychro.POS_MASK
-
         self._index += 1
-        thread = (val & self._thread_id_idx_mask) >> self._index_data_offset_bits
+        return self._decode_index_value(val)
 
+    def _decode_index_value(self, val):
+        pos = val & self._index_data_offset_mask
+        filenum = (pos >> self._config.filenum_from_pos_shift)
+        pos = pos & self._config.pos_mask
+        thread = (val & self._thread_id_idx_mask) >> self._index_data_offset_bits
         return filenum, pos, thread
 
+    # A reader for the cycle of date whose mappings are used for random access.
+    # The cursor's own cycle is served by this reader, which does not move its cursor.
+    def _random_access_reader(self, date):
+        if date == self._date:
+            return self
+        chron = self._random_access.get(date)
+        if chron is not None:
+            self._random_access.move_to_end(date)
+            return chron
+        chron = self._random_access[date] = self._cycle_reader(date)
+        while len(self._random_access) > self._max_random_access_cycles:
+            self._random_access.popitem(last=False)[1].close()
+        return chron
+
+    def _cycle_reader(self, date):
+        return VanillaChronicleReader(self._base_dir, date=date, max_mapped_memory=self._max_mapped_memory,
+                                      thread_id_bits=self._thread_id_bits, utcnow=self._utcnow,
+                                      max_random_access_cycles=0, config=self._config)
+
+    def get_raw_bytes_at(self, full_index):
+        date, index = VanillaChronicleReader.from_full_index(full_index, self._config)
+        chron = self._random_access_reader(date)
+        val = chron._get_index_value(index)
+        if not val & self._index_data_offset_mask:
+            raise pychro.NoData
+        return chron.get_raw_bytes(*self._decode_index_value(val))
+
+    def read_at(self, full_index):
+        return RawByteReader(*self.get_raw_bytes_at(full_index), string_cache=self._string_cache)
+
+    # Readers for each of full_indexes, in the same order. Lookups are made in index order so each
+    # cycle is visited once. Raises NoData if any index has no message.
+    def read_many(self, full_indexes):
+        raw = dict()
+        for full_index in sorted(set(full_indexes)):
+            raw[full_index] = self.get_raw_bytes_at(full_index)
+        return [RawByteReader(*raw[full_index], string_cache=self._string_cache) for full_index in full_indexes]
+
+    # Reads the index and data files of the cycles from start_date to end_date inclusive into the page
+    # cache, e.g. before the market opens, and returns a WarmUpReport of their residency.
+    # Archived cycles are skipped.
+    def warm_up(self, start_date=None, end_date=None):
+        report = WarmUpReport()
+        start = self._config.cycle_of(start_date) if start_date else 0
+        end = self._config.last_cycle_of(end_date) if end_date else float('inf')
+        for cycle, fp in self._list_cycles():
+            if not start <= cycle <= end:
+                continue
+            if fp.endswith(ARCHIVE_SUFFIX):
+                report.skipped += [fp]
+            else:
+                warm_up_cycle(fp, report)
+        return report
+
     def close(self):
+        while self._random_access:
+            self._random_access.popitem()[1].close()
+        self._close_cycle()
+
+    def _close_cycle(self):
         while True:
+            # a mapping with memoryviews from read_bytes() still alive is unmapped once they are released
             try:
                 self._data_mms.popitem()[1].close()
-            except ReferenceError:
+            except (ReferenceError, BufferError):
                 pass
             except KeyError:
                 break
+        while self._data_pins:
+            self._release_data_pin(next(iter(self._data_pins)))
 
         while True:
             try:
@@ -230,15 +431,27 @@ class VanillaChronicleReader:
             except KeyError:
                 break
 
-        [close_mmap(mm, self._index_file_size) for mm in self._index_mm if mm]
+        [close_mmap(mm, size) for mm, size in zip(self._index_mm, self._index_sizes) if mm]
         self._index_mm = []
+        self._index_sizes = []
 
         [fh.close() for fh in self._index_fh if fh]
         self._index_fh = []
 
+        if self._archive is not None:
+            self._archive.close()
+            self._archive = None
+
+        release_cycle_lock(self._cycle_lock)
+        self._cycle_lock = None
+
+        self._reset_cursor()
+
+    def _reset_cursor(self):
         self._max_index = 0
         self._index = 0
         self._date = None
+        self._cycle_num = None
         self._cycle_dir = None
         self._full_index_base = None
 
@@ -259,8 +472,71 @@ class VanillaChronicleReader:
     def next_raw_bytes(self):
         return self.get_raw_bytes(*self._next_position())
 
+    # Length of the message at pos of mm, the data file filenum of thread. Where the data file has message
+    # lengths it is the complement of the length written before the message. Otherwise the message ends
+    # where the next message of the data file starts, found in the index after index, the message's index
+    # in the cycle. The last message of such a file ends at the last non-zero byte written to it, so any
+    # zero bytes it ends with are lost.
+    def _message_length(self, mm, pos, filenum, thread, index=None):
+        if data_file_has_lengths(mm[:4]):
+            length = ~struct.unpack('i', mm[pos-4:pos])[0]
+            if length < 0:
+                raise pychro.CorruptData('No length before message at %s' % pos)
+            return length
+        if index is None:
+            raise pychro.InvalidArgumentError('index is required for data files without message lengths')
+        end = self._next_message_start(index, filenum, thread)
+        if end is None:
+            end = _used_length(mm if isinstance(mm, mmap.mmap) else io.BytesIO(mm), len(mm), 64*1024)
+        if end < pos:
+            raise pychro.CorruptData('Message at %s beyond the data written' % pos)
+        return end - pos
+
+    # Position of the message after index in the data file filenum of thread, or None if it was the last
+    def _next_message_start(self, index, filenum, thread):
+        index += 1
+        while True:
+            val = self._get_index_value(index)
+            if not val & self._index_data_offset_mask:
+                return None
+            next_filenum, next_pos, next_thread = self._decode_index_value(val)
+            if next_thread == thread:
+                return next_pos if next_filenum == filenum else None
+            index += 1
+
+    # The bytes of exactly the message, e.g. to copy it without knowing its fields. index is the index
+    # of the message in the cycle, needed only for data files without message lengths.
+    def get_message_bytes(self, filenum, pos, thread, index=None):
+        mm = self._get_data_memory_map(filenum, thread)
+        return mm[pos:pos+self._message_length(mm, pos, filenum, thread, index)]
+
+    def next_message_bytes(self):
+        return self.get_message_bytes(*self._next_position(), index=self._index - 1)
+
+    # As get_message_bytes(), as a memoryview of the mapped data file rather than a copy, so messages
+    # can be forwarded, hashed or archived without knowing their fields or copying them
+    def get_message_view(self, filenum, pos, thread, index=None):
+        mm = self._get_data_memory_map(filenum, thread)
+        length = self._message_length(mm, pos, filenum, thread, index)
+        try:
+            return memoryview(mm)[pos:pos+length]
+        except TypeError:
+            # data files of archived cycles are read into bytes
+            return memoryview(mm[pos:pos+length])
+
+    def next_message_view(self):
+        return self.get_message_view(*self._next_position(), index=self._index - 1)
+
+    def message_view_at(self, full_index):
+        date, index = VanillaChronicleReader.from_full_index(full_index, self._config)
+        chron = self._random_access_reader(date)
+        val = chron._get_index_value(index)
+        if not val & self._index_data_offset_mask:
+            raise pychro.NoData
+        return chron.get_message_view(*self._decode_index_value(val), index=index)
+
     def set_index(self, full_index):
-        date, index = VanillaChronicleReader.from_full_index(full_index)
+        date, index = VanillaChronicleReader.from_full_index(full_index, self._config)
         if self._date != date:
             self._try_set_cycle_dir(date)
         self._index = index
@@ -268,6 +544,59 @@ class VanillaChronicleReader:
     def set_date(self, date):
         self._try_set_cycle_dir(date)
 
+    # Positions the reader at the first message with extractor(reader) >= timestamp using the
+    # time index built by TimeIndexer, scanning forward from the last checkpoint before it.
+    # Returns the full index, or None if there is no such message yet, leaving the reader at the end.
+    def seek_time(self, timestamp, extractor):
+        full_index = find_time_checkpoint(self._base_dir, timestamp, self._config)
+        if full_index is None:
+            self._try_set_cycle_dir()
+        else:
+            self.set_index(full_index)
+        while True:
+            try:
+                reader = self.next_reader()
+            except pychro.NoData:
+                return None
+            if extractor(reader) >= timestamp:
+                self.set_index(self.get_index() - 1)
+                return self.get_index()
+
+    # Total length of the messages from start to end of the cycle, from the first max_scan of them
+    # and estimated from their mean beyond that
+    def _message_bytes(self, start, end, max_scan):
+        count = min(end - start, max_scan)
+        total = 0
+        for index in range(start, start + count):
+            filenum, pos, thread = self._decode_index_value(self._get_index_value(index))
+            total += self._message_length(self._get_data_memory_map(filenum, thread), pos, filenum, thread, index)
+        return total if count == end - start else total*(end - start)//count
+
+    # The Lag of the cursor behind the end of the chronicle, across cycles. Only the end of each
+    # cycle is searched for, and up to max_scan messages per cycle are measured.
+    def get_lag(self, max_scan=4096):
+        lag = Lag()
+        if not self._cycle_dir:
+            try:
+                self._try_set_cycle_dir()
+            except pychro.NoData:
+                return lag
+        for cycle, fp in self._list_cycles():
+            if cycle < self._cycle_num:
+                continue
+            date = self._config.cycle_date(cycle)
+            temporary = date != self._date and not self._max_random_access_cycles
+            chron = self._cycle_reader(date) if temporary else self._random_access_reader(date)
+            try:
+                start = self._index if chron is self else 0
+                end = chron.get_end_index_today() - chron._full_index_base
+                if end > start:
+                    lag.add(end - start, chron._message_bytes(start, end, max_scan), end - start <= max_scan)
+            finally:
+                if temporary:
+                    chron.close()
+        return lag
+
     def set_end(self):
         while self._try_next_date():
             pass
@@ -279,20 +608,199 @@ class VanillaChronicleReader:
     def set_end_index_today(self):
         self.set_index(self.get_end_index_today())
 
+    # As _get_index_value(), but 0 rather than opening or creating index files which do not exist
+    def _probe_index_value(self, index):
+        if self._archive is None and self._cycle_dir:
+            index_filenum = (index*8) >> self._config.filenum_from_index_shift
+            while index_filenum >= len(self._index_mm):
+                if not os.path.isfile(os.path.join(self._cycle_dir, 'index-%s' % len(self._index_mm))):
+                    return 0
+                self._open_next_index()
+        return self._get_index_value(index) & self._index_data_offset_mask
+
+    # Index entries are claimed in order, so the written entries are a prefix of the index and the
+    # end can be found by galloping forward from the last known end then bisecting.
     def get_end_index_today(self):
-        index = max(self._max_index, self._index)
-        while True:
-            if not self._get_index_value(index) & self._index_data_offset_mask:
-                self._max_index = index
-                return self._max_index + self._full_index_base
-            index += 1
+        lo = max(self._max_index, self._index)
+        if self._probe_index_value(lo):
+            step = 1
+            hi = lo + step
+            while self._probe_index_value(hi):
+                lo = hi
+                step *= 2
+                hi = lo + step
+            while hi - lo > 1:
+                mid = (lo + hi)//2
+                if self._probe_index_value(mid):
+                    lo = mid
+                else:
+                    hi = mid
+            lo = hi
+        self._max_index = lo
+        return self._max_index + self._full_index_base
 
     def next_reader(self):
-        return RawByteReader(*self.next_raw_bytes())
+        return RawByteReader(*self.next_raw_bytes(), string_cache=self._string_cache)
+
+    # Re-points reader at the next message instead of allocating a new RawByteReader
+    def next_into(self, reader):
+        reader._offset, reader._bytes = self.next_raw_bytes()
+        return reader
+
+    # Yields a reader per message until NoData. With reuse one RawByteReader is re-pointed at
+    # each message, so it is only valid until the next iteration.
+    def iter_readers(self, reuse=True):
+        reader = RawByteReader(0, None, self._string_cache) if reuse else None
+        while True:
+            try:
+                if reuse:
+                    self.next_into(reader)
+                else:
+                    reader = self.next_reader()
+            except pychro.NoData:
+                return
+            yield reader
+
+    # A second mapping of the data file, as (address, size), for native code. It is kept with any
+    # mapping pinning the file, so is closed with them.
+    def _data_address(self, filenum, thread):
+        pin = self._data_pins.get((filenum, thread))
+        if pin is None:
+            size = len(self._get_data_memory_map(filenum, thread))
+            pin = (open_read_mmap(self._data_fhs[(filenum, thread)], size), size)
+            # a pooled cycle's pins are shared by its cursors
+            kept = self._data_pins.setdefault((filenum, thread), pin)
+            if kept is not pin:
+                close_mmap(*pin)
+            pin = kept
+        return pin
+
+    # As next_matching_raw_bytes(), testing runs of index values of one data file in native code
+    def _next_matching_native(self, message_filter, batch_size):
+        matches = message_filter.matches
+        offset_mask = self._index_data_offset_mask
+        thread_mask = self._thread_id_idx_mask
+        offset_bits = self._index_data_offset_bits
+        filenum_shift = self._config.filenum_from_pos_shift
+        pos_mask = self._config.pos_mask
+        key_mask = ~pos_mask
+        while True:
+            values = self._get_index_values(batch_size)
+            if values is None:
+                filenum, pos, thread = self._next_position()
+                mm = self._get_data_memory_map(filenum, thread)
+                if matches(mm, pos):
+                    return pos, mm
+                continue
+            address = ctypes.addressof(values)
+            count = len(values)
+            i = 0
+            while i < count:
+                val = values[i]
+                pos = val & offset_mask
+                if not pos:
+                    break
+                filenum = pos >> filenum_shift
+                thread = (val & thread_mask) >> offset_bits
+                mm = self._get_data_memory_map(filenum, thread)
+                data, size = self._data_address(filenum, thread)
+                passed, matched = filter_index(address + i*8, count - i, key_mask, val & key_mask, pos_mask, data, size,
+                                               message_filter.native)
+                self._index += passed
+                i += passed
+                if matched:
+                    self._index += 1
+                    return values[i] & pos_mask, mm
+                if not passed:
+                    # the fields would extend beyond the data file, which struct reports
+                    self._index += 1
+                    i += 1
+                    if matches(mm, pos & pos_mask):
+                        return pos & pos_mask, mm
+
+    # As next_raw_bytes(), skipping messages not matching message_filter (a MessageFilter).
+    # Index values are scanned in batches and the filter is applied to the mapped data, so
+    # skipped messages cost no reader construction.
+    def next_matching_raw_bytes(self, message_filter, batch_size=4096):
+        if message_filter.native is not None:
+            return self._next_matching_native(message_filter, batch_size)
+        matches = message_filter.matches
+        data_mms = self._data_mms
+        offset_mask = self._index_data_offset_mask
+        thread_mask = self._thread_id_idx_mask
+        offset_bits = self._index_data_offset_bits
+        filenum_shift = self._config.filenum_from_pos_shift
+        pos_mask = self._config.pos_mask
+        while True:
+            values = self._get_index_values(batch_size)
+            if values is None:
+                # let _next_position() wait, poll or move to the next cycle
+                filenum, pos, thread = self._next_position()
+                mm = self._get_data_memory_map(filenum, thread)
+                if matches(mm, pos):
+                    return pos, mm
+                continue
+            for val in values:
+                pos = val & offset_mask
+                if not pos:
+                    break
+                self._index += 1
+                filenum = pos >> filenum_shift
+                pos &= pos_mask
+                thread = (val & thread_mask) >> offset_bits
+                mm = data_mms.get((filenum, thread))
+                if mm is None:
+                    mm = self._get_data_memory_map(filenum, thread)
+                if matches(mm, pos):
+                    return pos, mm
+
+    def next_matching_reader(self, message_filter):
+        return RawByteReader(*self.next_matching_raw_bytes(message_filter), string_cache=self._string_cache)
+
+
+class StringCache:
+    # Bounded LRU of decoded strings keyed by their encoded bytes, so repeated strings are decoded
+    # once and share one interned str. Strings longer than max_length bytes are not cached.
+
+    def __init__(self, max_size=4096, max_length=64):
+        self._max_size = max_size
+        self._max_length = max_length
+        self._strings = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __str__(self):
+        return '<StringCache size:%s hits:%s misses:%s>' % (len(self._strings), self.hits, self.misses)
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits/total if total else 0.0
+
+    def decode(self, encoded):
+        ret = self._strings.get(encoded)
+        if ret is not None:
+            self.hits += 1
+            self._strings.move_to_end(encoded)
+            return ret
+        self.misses += 1
+        ret = encoded.decode()
+        if len(encoded) <= self._max_length:
+            ret = sys.intern(ret)
+            self._strings[encoded] = ret
+            if len(self._strings) > self._max_size:
+                self._strings.popitem(last=False)
+        return ret
 
 
 class RawByteReader():
-    def __init__(self, offset, bytes):
+    __slots__ = ('_offset', '_bytes', '_string_cache')
+
+    def __init__(self, offset, bytes, string_cache=None):
+        self._offset = offset
+        self._bytes = bytes
+        self._string_cache = string_cache
+
+    def reset(self, offset, bytes):
         self._offset = offset
         self._bytes = bytes
 
@@ -341,6 +849,35 @@ class RawByteReader():
         self._offset += 1
         return ret != 0
 
+    def _view(self, length):
+        try:
+            return memoryview(self._bytes)[self._offset:self._offset+length]
+        except TypeError:
+            # data files of archived cycles are read into bytes
+            return memoryview(self._bytes[self._offset:self._offset+length])
+
+    # The bytes written by write_bytes(), as a memoryview of the mapped data file rather than a copy
+    def read_bytes(self):
+        ret = self._view(self.read_stopbit())
+        self._offset += len(ret)
+        return ret
+
+    # The elements written by write_array() as a memoryview of typecode, e.g. 'd', without copying
+    def read_array(self, typecode):
+        count = self.read_stopbit()
+        ret = self._view(count*struct.calcsize(typecode)).cast(typecode)
+        self._offset += ret.nbytes
+        return ret
+
+    # As read_array(), as a read only NumPy array of dtype
+    def read_ndarray(self, dtype):
+        if numpy is None:
+            raise pychro.ConfigError('read_ndarray requires NumPy')
+        count = self.read_stopbit()
+        ret = numpy.frombuffer(self._view(count*numpy.dtype(dtype).itemsize), dtype)
+        self._offset += ret.nbytes
+        return ret
+
     def read_stopbit(self):
         shift = 0
         value = 0
@@ -351,9 +888,15 @@ class RawByteReader():
             if (b & 0x80) == 0:
                 return value
 
+    def _decode(self, l):
+        encoded = self._bytes[self._offset: self._offset + l]
+        if self._string_cache is None:
+            return encoded.decode()
+        return self._string_cache.decode(encoded)
+
     def read_string(self):
         l = self.read_stopbit()
-        ret = self._bytes[self._offset: self._offset + l].decode()
+        ret = self._decode(l)
         self._offset += l
         # potentially there is some packing which we do not advance through
         # the reader must use the get_offset/set_offset/advance methods in this case,
@@ -384,7 +927,7 @@ class RawByteReader():
     def peek_string(self):
         o = self.get_offset()
         l = self.read_stopbit()
-        ret = self._bytes[self._offset: self._offset + l].decode()
+        ret = self._decode(l)
         self.set_offset(o)
         return ret
 
@@ -394,7 +937,7 @@ class RawByteReader():
     # This is the most efficient way to read a string.
     def peek_string_undef_offset(self):
         l = self.read_stopbit()
-        return self._bytes[self._offset: self._offset + l].decode()
+        return self._decode(l)
 
 
 
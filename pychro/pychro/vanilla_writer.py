@@ -17,9 +17,13 @@
 
 from .vanilla_reader import *
 from ._pychro import *
+import array
 import struct
 import os
 import mmap
+import re
+import threading
+import time
 
 
 class Appender:
@@ -31,12 +35,13 @@ class Appender:
         self._pos = pos
         self._start_pos = pos
         self._max_msg_size = max_msg_size
-        self._start_date = None
+        self._data_file_size = chronicle._config.data_block_size
+        self._start_cycle = None
 
     def write_byte(self, val):
         assert val < 256
         self._start()
-        if self._pos + 1 >= pychro.DATA_FILE_SIZE:
+        if self._pos + 1 >= self._data_file_size:
             raise pychro.NoSpace
         mm = self._chronicle._get_data_memory_map(self._filenum, self._tid)
         mm[self._pos] = val
@@ -44,7 +49,7 @@ class Appender:
 
     def write_double(self, val):
         self._start()
-        if self._pos + 8 >= pychro.DATA_FILE_SIZE:
+        if self._pos + 8 >= self._data_file_size:
             raise pychro.NoSpace
         mm = self._chronicle._get_data_memory_map(self._filenum, self._tid)
         mm[self._pos:self._pos+8] = struct.pack('d', val)
@@ -52,7 +57,7 @@ class Appender:
 
     def write_boolean(self, val):
         self._start()
-        if self._pos + 1 >= pychro.DATA_FILE_SIZE:
+        if self._pos + 1 >= self._data_file_size:
             raise pychro.NoSpace
         mm = self._chronicle._get_data_memory_map(self._filenum, self._tid)
         mm[self._pos] = 1 if val else 0
@@ -60,7 +65,7 @@ class Appender:
 
     def write_short(self, val):
         self._start()
-        if self._pos + 2 >= pychro.DATA_FILE_SIZE:
+        if self._pos + 2 >= self._data_file_size:
             raise pychro.NoSpace
         mm = self._chronicle._get_data_memory_map(self._filenum, self._tid)
         mm[self._pos:self._pos+2] = struct.pack('h', val)
@@ -68,7 +73,7 @@ class Appender:
 
     def write_long(self, val):
         self._start()
-        if self._pos + 8 >= pychro.DATA_FILE_SIZE:
+        if self._pos + 8 >= self._data_file_size:
             raise pychro.NoSpace
         mm = self._chronicle._get_data_memory_map(self._filenum, self._tid)
         mm[self._pos:self._pos+8] = struct.pack('q', val)
@@ -76,7 +81,7 @@ class Appender:
 
     def write_int(self, val):
         self._start()
-        if self._pos + 4 >= pychro.DATA_FILE_SIZE:
+        if self._pos + 4 >= self._data_file_size:
             raise pychro.NoSpace
         mm = self._chronicle._get_data_memory_map(self._filenum, self._tid)
         mm[self._pos:self._pos+4] = struct.pack('i', val)
@@ -87,12 +92,50 @@ class Appender:
         encoded = val.encode()
         l = len(encoded)
         self.write_stopbit(l)
-        if self._pos + l >= pychro.DATA_FILE_SIZE:
+        if self._pos + l >= self._data_file_size:
             raise pychro.NoSpace
         mm = self._chronicle._get_data_memory_map(self._filenum, self._tid)
         mm[self._pos:self._pos+l] = encoded
         self._pos += l
 
+    # Writes data as is, e.g. a message copied from another chronicle
+    def write_raw_bytes(self, data):
+        self._start()
+        l = len(data)
+        if self._pos + l >= self._data_file_size:
+            raise pychro.NoSpace
+        mm = self._chronicle._get_data_memory_map(self._filenum, self._tid)
+        mm[self._pos:self._pos+l] = data
+        self._pos += l
+
+    # Writes the stopbit length then the bytes of data, any bytes-like object, in one copy
+    def write_bytes(self, data):
+        view = self._byte_view(memoryview(data))
+        self.write_stopbit(len(view))
+        self.write_raw_bytes(view)
+
+    # Writes the stopbit number of elements then the elements of values, an array.array, NumPy array or
+    # other buffer, or else a sequence of typecode values, in one copy. Read with read_array(typecode).
+    def write_array(self, values, typecode=None):
+        try:
+            view = memoryview(values)
+        except TypeError:
+            if typecode is None:
+                raise pychro.InvalidArgumentError('typecode is required for a sequence')
+            view = memoryview(array.array(typecode, values))
+        self.write_stopbit(view.nbytes//view.itemsize)
+        self.write_raw_bytes(self._byte_view(view))
+
+    @staticmethod
+    def _byte_view(view):
+        if view.c_contiguous and view.format in ('B', 'b', 'c') and view.ndim == 1:
+            return view
+        try:
+            return view.cast('B')
+        except (TypeError, ValueError):
+            # not contiguous, or not a native format
+            return memoryview(view.tobytes())
+
     def write_stopbit(self, val):
         self._start()
         mm = self._chronicle._get_data_memory_map(self._filenum, self._tid)
@@ -104,93 +147,174 @@ class Appender:
         self._pos += 1
 
     def _start(self):
-        if self._start_date is None:
-            self._start_date = self._utcnow().date()
-            if self._start_date != self._chronicle._date:
-                self._chronicle._day_rollover(self._start_date)
+        if self._start_cycle is None:
+            self._start_cycle = self._chronicle._config.cycle_of(self._utcnow())
+            if self._start_cycle != self._chronicle._cycle_num:
+                self._chronicle._cycle_rollover(self._start_cycle)
                 self._pos = self._pos - self._start_pos + 4
                 self._start_pos = 4
                 self._filenum = 0
 
     def finish(self):
-        now_date = self._utcnow().date()
-        if now_date != self._chronicle._date:
+        now_cycle = self._chronicle._config.cycle_of(self._utcnow())
+        if now_cycle != self._chronicle._cycle_num:
             # need to rewrite pos-start_pos bytes
             bytes = self._chronicle._get_data_memory_map(self._filenum, self._tid)[self._start_pos:self._pos]
-            if not self._chronicle._day_rollover(now_date):
+            if not self._chronicle._cycle_rollover(now_cycle):
                 raise pychro.PartialWriteLostOnRollover()
             self._pos = self._pos - self._start_pos + 4
             self._start_pos = 4
             self._filenum = 0
             self._chronicle._get_data_memory_map(self._filenum, self._tid)[self._start_pos:self._pos] = bytes
 
+        # As Java Vanilla Chronicle, each message is preceded by the complement of its length and
+        # the next starts at the following 4 byte boundary after its own length. Earlier pychro
+        # appenders wrote each message straight after the last with no length; their data files are
+        # never appended to, as a writer starts new data files of its own.
+        self._chronicle._get_data_memory_map(self._filenum, self._tid)[self._start_pos-4:self._start_pos] = \
+            struct.pack('i', ~(self._pos - self._start_pos))
         self._chronicle._set_index(self._tid, self._filenum, self._start_pos)
+        self._chronicle._committed(self._filenum, self._tid, self._start_pos-4, self._pos)
 
-        if self._pos + self._max_msg_size > pychro.DATA_FILE_SIZE:
+        self._pos = ((self._pos + 3) & ~3) + 4
+        if self._pos + self._max_msg_size > self._data_file_size:
             self._pos = 4
             self._filenum += 1
         self._chronicle._set_appender_pos(self._tid, self._filenum, self._pos)
         self._start_pos = self._pos
-        self._start_date = None
+        self._start_cycle = None
+        return self._chronicle.get_index()
 
 
 class VanillaChronicleWriter(VanillaChronicleReader):
+    # durability is a policy from pychro.durability deciding when the messages committed are synced to
+    # disk, or None to leave it to the kernel. sync() may also be called at any time, with or without one.
+    # Each writer needs a policy of its own.
+    #
+
     def __init__(self, base_dir, polling_interval=None,
                  max_mapped_memory=pychro.DEFAULT_MAX_MAPPED_MEMORY_PER_READER,
-                 thread_id_bits=None, utcnow=datetime.datetime.utcnow):
+                 thread_id_bits=None, utcnow=datetime.datetime.utcnow, mapping_options=None, durability=None,
+                 config=None):
         try:
             os.makedirs(base_dir)
         except FileExistsError:
             pass
+        self._durability = durability
+        self._sync_lock = threading.RLock()
+        self._dirty = dict()
+        self._dirty_index = set()
+        self._pending = 0
+        self._oldest_pending = None
+        self.syncs = 0
         super().__init__(base_dir=base_dir, polling_interval=polling_interval,
                          max_mapped_memory=max_mapped_memory, thread_id_bits=thread_id_bits,
-                         utcnow=utcnow)
+                         utcnow=utcnow, mapping_options=mapping_options, config=config)
         self._positions = dict()
-        self._update_date_and_index_base(self._utcnow().date())
-        todays_dir = os.path.join(self._base_dir, '%4d%02d%02d' % (self._date.year, self._date.month, self._date.day))
-        if self._cycle_dir != todays_dir:
-            self._cycle_dir = todays_dir
-            try:
-                os.makedirs(todays_dir)
-            except FileExistsError:
-                pass
+        # the reader may have opened an earlier, possibly archived, cycle
+        self._close_cycle()
+        self._update_date_and_index_base(self._utcnow())
+        todays_dir = os.path.join(self._base_dir, self._config.cycle_name(self._cycle_num))
+        self._cycle_dir = todays_dir
+        try:
+            os.makedirs(todays_dir)
+        except FileExistsError:
+            pass
         self._open_next_index()
         self._open_next_index()
-        while True:
-            try:
-                filenum, pos, tid = self._next_position()
-                self._positions[tid] = (filenum+1, 4)
-            except pychro.NoData:
-                break
+        # Appenders continue in a new data file after the latest of their thread, found by name
+        # rather than by reading every index entry written today.
+        for f in os.listdir(todays_dir):
+            m = re.match('^data-([0-9]+)-([0-9]+)$', f)
+            if m:
+                tid, filenum = int(m.group(1)), int(m.group(2))
+                if filenum + 1 > self._positions.get(tid, (0, 4))[0]:
+                    self._positions[tid] = (filenum+1, 4)
+        self.set_end_index_today()
+        if self._durability is not None:
+            self._durability.start(self)
+
+    def _committed(self, filenum, tid, start, end):
+        index_filenum = (self._index*8) >> self._config.filenum_from_index_shift
+        with self._sync_lock:
+            prev = self._dirty.get((filenum, tid))
+            self._dirty[(filenum, tid)] = (min(start, prev[0]), max(end, prev[1])) if prev else (start, end)
+            self._dirty_index.add(index_filenum)
+            if not self._pending:
+                self._oldest_pending = time.time()
+            self._pending += 1
+            if self._durability is not None:
+                self._durability.committed(self, self._pending, self._oldest_pending)
+
+    # Forces the messages committed since the last sync to disk, with msync of the ranges of the data
+    # files written and fsync of the index files.
+    def sync(self):
+        with self._sync_lock:
+            for (filenum, tid), (start, end) in self._dirty.items():
+                mm = self._data_mms.get((filenum, tid))
+                if mm is not None:
+                    start -= start % mmap.ALLOCATIONGRANULARITY
+                    mm.flush(start, end - start)
+                elif (filenum, tid) in self._data_fhs:
+                    os.fsync(self._data_fhs[(filenum, tid)].fileno())
+            for index_filenum in self._dirty_index:
+                os.fsync(self._index_fh[index_filenum].fileno())
+            if self._dirty:
+                self.syncs += 1
+            self._dirty = dict()
+            self._dirty_index = set()
+            self._pending = 0
+
+    # A policy's thread may be flushing the mappings, so they are only closed under the sync lock, and
+    # without a policy the messages of a cycle are left to the kernel as it closes.
+    def _get_data_memory_map(self, filenum, thread):
+        mm = self._data_mms.get((filenum, thread))
+        if mm is not None:
+            return mm
+        with self._sync_lock:
+            return super()._get_data_memory_map(filenum, thread)
+
+    def _close_cycle(self):
+        with self._sync_lock:
+            if self._dirty and self._durability is not None:
+                self.sync()
+            self._dirty = dict()
+            self._dirty_index = set()
+            self._pending = 0
+            super()._close_cycle()
+
+    def close(self):
+        if self._durability is not None:
+            self._durability.stop()
+        super().close()
 
     def _set_appender_pos(self, tid, filenum, pos):
         self._positions[tid] = (filenum, pos)
 
     #Returns whether rollover succeeded or not
-    def _day_rollover(self, new_date):
-        todays_dir = os.path.join(self._base_dir, '%4d%02d%02d'
-                                  % (new_date.year, new_date.month, new_date.day))
+    def _cycle_rollover(self, new_cycle):
+        todays_dir = os.path.join(self._base_dir, self._config.cycle_name(new_cycle))
         try:
             os.makedirs(todays_dir)
             ret = True
         except FileExistsError:
             # todo: wait here for rollover initiated by another to complete
             ret = False
-        self.close()
+        self._close_cycle()
         self._positions = dict()
         self._cycle_dir = todays_dir
         self._open_next_index()
         self._open_next_index()
-        self._update_date_and_index_base(new_date)
+        self._update_date_and_index_base(self._config.cycle_date(new_cycle))
         return ret
 
     def _set_index(self, tid, data_filenum, offset):
-        assert self._date == self._utcnow().date()
+        assert self._cycle_num == self._config.cycle_of(self._utcnow())
 
-        index_val = (tid << (64-self._thread_id_bits)) | (data_filenum << pychro.FILENUM_FROM_POS_SHIFT) | offset
+        index_val = (tid << (64-self._thread_id_bits)) | (data_filenum << self._config.filenum_from_pos_shift) | offset
         self.set_end_index_today()
         while True:
-            index_filenum, index_offset = divmod(self._index*8, pychro.INDEX_FILE_SIZE)
+            index_filenum, index_offset = divmod(self._index*8, self._index_file_size)
             # keep an extra one open
             if len(self._index_mm) <= index_filenum+1:
                 self._open_next_index()
@@ -215,10 +339,13 @@ class VanillaChronicleWriter(VanillaChronicleReader):
             fh = open(fn, 'r+b')
         else:
             fh = open(fn, 'w+b')
-            fh.write(b'\000'*pychro.INDEX_FILE_SIZE)
+            fh.write(b'\000'*self._index_file_size)
             fh.flush()
         self._index_fh += [fh]
-        self._index_mm += [pychro.open_write_mmap(fh, pychro.INDEX_FILE_SIZE)]
+        self._index_mm += [pychro.open_write_mmap(fh, self._index_file_size)]
+        self._index_sizes += [self._index_file_size]
+        if self._mapping_options:
+            self._mapping_options.apply(self._index_mm[-1], self._index_file_size)
 
     def _open_data_file(self, filenum, thread):
         fn = os.path.join(self._cycle_dir, 'data-%s-%s' % (thread, filenum))
@@ -226,7 +353,7 @@ class VanillaChronicleWriter(VanillaChronicleReader):
             fh = open(fn, 'r+b')
         else:
             fh = open(fn, 'w+b')
-            fh.write(b'\x00'*pychro.DATA_FILE_SIZE)
+            fh.write(b'\x00'*self._config.data_block_size)
         return fh
 
     def _open_data_memory_map(self, filenum, thread):
@@ -237,9 +364,13 @@ class VanillaChronicleWriter(VanillaChronicleReader):
 
         if pychro.PLATFORM_WINDOWS:
             return mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_WRITE)
+        flags = self._mapping_options.mmap_flags() if self._mapping_options else mmap.MAP_SHARED
         while True:
             try:
-                return mmap.mmap(fh.fileno(), 0, prot=mmap.PROT_READ | mmap.PROT_WRITE)
+                mm = mmap.mmap(fh.fileno(), 0, flags=flags, prot=mmap.PROT_READ | mmap.PROT_WRITE)
+                if self._mapping_options:
+                    self._apply_data_mapping_options(mm, fh, filenum, thread)
+                return mm
             except ValueError:
                 pass
                 # Alternative to this ugliness appears to be os.fsync(), but is much slower.
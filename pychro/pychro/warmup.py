@@ -0,0 +1,162 @@
+#
+#  Copyright 2015 Jon Turner
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import mmap
+import os
+import time
+import pychro
+from ._pychro import *
+from .retention import lock_cycle_shared, release_cycle_lock
+
+MAPPING_ADVICE = {
+    'normal': getattr(mmap, 'MADV_NORMAL', None),
+    'random': getattr(mmap, 'MADV_RANDOM', None),
+    'sequential': getattr(mmap, 'MADV_SEQUENTIAL', None),
+    'willneed': getattr(mmap, 'MADV_WILLNEED', None),
+}
+
+
+class MappingOptions:
+    # How readers and writers map index and data files, to avoid page faults on the first touch of
+    # each page, e.g. just after a data file roll or at the start of a day.
+    #
+    # populate  - pre-fault the whole mapping when it is created (MAP_POPULATE for data files)
+    # advice    - madvise hint for each mapping, one of MAPPING_ADVICE
+    # lock      - mlock the mapped index and data files, subject to RLIMIT_MEMLOCK
+    # prefault_next - when a data file is mapped, ask the OS to read the next data file of the
+    #                 same thread into the page cache
+    #
+    # Requires a libpychroc with the mapping functions, so is not available on Windows.
+    #
+
+    def __init__(self, populate=False, advice=None, lock=False, prefault_next=False):
+        if advice is not None and MAPPING_ADVICE.get(advice) is None:
+            raise pychro.InvalidArgumentError('Unknown or unsupported advice %s' % advice)
+        if not HAVE_MAPPING_CONTROL:
+            raise pychro.ConfigError('Mapping options are not supported on this platform')
+        self.populate = populate
+        self.advice = advice
+        self.lock = lock
+        self.prefault_next = prefault_next
+
+    def __str__(self):
+        return '<MappingOptions populate:%s advice:%s lock:%s prefault_next:%s>' % (
+            self.populate, self.advice, self.lock, self.prefault_next)
+
+    def mmap_flags(self):
+        flags = mmap.MAP_SHARED
+        if self.populate:
+            flags |= getattr(mmap, 'MAP_POPULATE', 0)
+        return flags
+
+    # Applied to the index mappings, which are made by libpychroc
+    def apply(self, mh, size):
+        if self.advice is not None:
+            advise_mmap(mh, size, MAPPING_ADVICE[self.advice])
+        if self.lock:
+            try:
+                lock_mmap(mh, size)
+            except PychroCError:
+                raise pychro.ConfigError('mlock of %s bytes failed, check RLIMIT_MEMLOCK' % size)
+        if self.populate:
+            prefault_mmap(mh, size)
+
+    # Applied to the data mappings, which are python mmaps. These cannot be locked directly, so
+    # a lock is taken on a second mapping of the file, which keeps its pages resident. The second
+    # mapping is returned and must be closed with close_mmap() with the size of the file.
+    def apply_to_mmap(self, mm, fh):
+        if self.advice is not None:
+            mm.madvise(MAPPING_ADVICE[self.advice])
+        if not self.lock:
+            return None
+        pin = open_read_mmap(fh, len(mm))
+        try:
+            self.apply(pin, len(mm))
+        except pychro.ConfigError:
+            close_mmap(pin, len(mm))
+            raise
+        return pin
+
+    @staticmethod
+    def prefetch(path):
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except FileNotFoundError:
+            return False
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        finally:
+            os.close(fd)
+        return True
+
+
+class WarmUpReport:
+    # Page cache residency of the files of the cycles warmed up, as
+    # [(path, pages, resident pages before, resident pages after)]
+
+    def __init__(self):
+        self.files = []
+        self.skipped = []
+        self.elapsed = 0.0
+
+    def __str__(self):
+        return '<WarmUpReport files:%s pages:%s resident:%.1f%%->%.1f%% elapsed:%.3fs>' % (
+            len(self.files), self.pages(), 100*self.residency_before(), 100*self.residency(), self.elapsed)
+
+    def pages(self):
+        return sum(f[1] for f in self.files)
+
+    def resident_pages(self):
+        return sum(f[3] for f in self.files)
+
+    def residency_before(self):
+        return sum(f[2] for f in self.files)/self.pages() if self.files else 1.0
+
+    def residency(self):
+        return self.resident_pages()/self.pages() if self.files else 1.0
+
+
+# Reads every page of the index and data files of cycle_dir into the page cache, adding them to report.
+# A cycle removed meanwhile is added to report.skipped.
+def warm_up_cycle(cycle_dir, report):
+    if not HAVE_MAPPING_CONTROL:
+        raise pychro.ConfigError('warm_up is not supported on this platform')
+    start = time.time()
+    cycle_lock = lock_cycle_shared(cycle_dir)
+    if cycle_lock is None and not os.path.isdir(cycle_dir):
+        report.skipped += [cycle_dir]
+        return report
+    try:
+        for fn in sorted(os.listdir(cycle_dir)):
+            if not fn.startswith(('index-', 'data-')):
+                continue
+            path = os.path.join(cycle_dir, fn)
+            with open(path, 'rb') as fh:
+                size = os.fstat(fh.fileno()).st_size
+                if not size:
+                    continue
+                mh = open_read_mmap(fh, size)
+                try:
+                    before = resident_mmap(mh, size)
+                    advise_mmap(mh, size, MAPPING_ADVICE['willneed'])
+                    pages = prefault_mmap(mh, size)
+                    report.files += [(path, pages, before, resident_mmap(mh, size))]
+                finally:
+                    close_mmap(mh, size)
+    finally:
+        release_cycle_lock(cycle_lock)
+    report.elapsed += time.time() - start
+    return report
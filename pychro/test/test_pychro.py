@@ -16,6 +16,7 @@
 # limitations under the License.
 #
 
+import array
 import unittest
 import zipfile
 import datetime
@@ -799,5 +800,2266 @@ class TestPychroReader(unittest.TestCase):
         self.assertEqual(msg_nums[1], num_msgs_today)
         self.assertEqual(msg_nums[0], num_msgs_total)
 
+class TestExporter(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = TempDir()
+        self.outdir = TempDir()
+        self.write_chron = pychro.VanillaChronicleWriter(self.tempdir.path)
+        self.n = 1000
+        appender = self.write_chron.get_appender()
+        for i in range(self.n):
+            appender.write_int(i)
+            appender.write_double(i/2)
+            appender.write_string('SYM%s' % (i % 7))
+            appender.finish()
+        self.schema = [('i', 'int'), ('d', 'double'), ('sym', 'string', 8)]
+        self.start = self.write_chron.to_full_index(self.write_chron.get_date(), 0)
+
+    def tearDown(self):
+        self.write_chron.close()
+
+    def read_npy(self, path):
+        with open(path, 'rb') as fh:
+            data = fh.read()
+        header_len = struct.unpack('<H', data[8:10])[0]
+        return eval(data[10:10+header_len].decode('latin1')), data[10+header_len:]
+
+    def test_csv(self):
+        path = os.path.join(self.outdir.path, 'out.csv')
+        stats = pychro.Exporter(self.tempdir.path, self.schema, chunk_size=64).to_csv(path)
+        print('Export %s' % stats)
+        self.assertEqual(self.n, stats.messages)
+        with open(path) as fh:
+            lines = fh.read().splitlines()
+        self.assertEqual('index,i,d,sym', lines[0])
+        self.assertEqual('%s,10,5.0,SYM3' % (self.start+10), lines[11])
+        self.assertEqual(self.n+1, len(lines))
+
+    def test_range(self):
+        path = os.path.join(self.outdir.path, 'out.csv')
+        stats = pychro.Exporter(self.tempdir.path, self.schema, start_index=self.start+100,
+                                end_index=self.start+200, include_index=False).to_csv(path, header=False)
+        self.assertEqual(100, stats.messages)
+        with open(path) as fh:
+            lines = fh.read().splitlines()
+        self.assertEqual('100,50.0,SYM2', lines[0])
+        self.assertEqual('199,99.5,SYM3', lines[-1])
+
+    def test_npy(self):
+        stats = pychro.Exporter(self.tempdir.path, self.schema, chunk_size=100).to_npy(self.outdir.path)
+        self.assertEqual(10, stats.chunks)
+        header, data = self.read_npy(os.path.join(self.outdir.path, 'i.npy'))
+        self.assertEqual(('<i4', (self.n,)), (header['descr'], header['shape']))
+        self.assertEqual(list(range(self.n)), list(struct.unpack('<%di' % self.n, data)))
+        header, data = self.read_npy(os.path.join(self.outdir.path, 'sym.npy'))
+        self.assertEqual('<U8', header['descr'])
+        self.assertEqual('SYM1', data[32:64].decode('utf-32-le').rstrip('\x00'))
+
+    def test_npz(self):
+        path = os.path.join(self.outdir.path, 'out.npz')
+        stats = pychro.Exporter(self.tempdir.path, self.schema[:2]).to_npz(path)
+        self.assertEqual(self.n, stats.messages)
+        with zipfile.ZipFile(path) as zf:
+            self.assertEqual(['index.npy', 'i.npy', 'd.npy'], zf.namelist())
+
+    def test_decode_error(self):
+        # the reader is closed when decoding fails
+        closed = []
+
+        class Reader(pychro.VanillaChronicleReader):
+            def close(self):
+                closed.append(self)
+                super().close()
+
+        def decoder(reader):
+            raise pychro.CorruptData
+
+        exporter = pychro.Exporter(self.tempdir.path, self.schema)
+        exporter._decoders[0] = decoder
+        pychro.exporter.VanillaChronicleReader = Reader
+        try:
+            self.assertRaises(pychro.CorruptData, exporter.to_csv, os.path.join(self.outdir.path, 'out.csv'))
+        finally:
+            pychro.exporter.VanillaChronicleReader = Reader.__bases__[0]
+        self.assertEqual(1, len(closed))
+
+    def test_bad_schema(self):
+        self.assertRaises(pychro.InvalidArgumentError, pychro.Exporter, self.tempdir.path, [('x', 'float')])
+        self.assertRaises(pychro.InvalidArgumentError, pychro.Exporter(self.tempdir.path, [('s', 'string')]).to_npy,
+                          self.outdir.path)
+
+
+class TestArchive(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = TempDir()
+        for day in (1, 2):
+            write_chron = pychro.VanillaChronicleWriter(self.tempdir.path,
+                                                        utcnow=lambda: datetime.datetime(2015, 1, day, 12))
+            appender = write_chron.get_appender()
+            for i in range(1000):
+                appender.write_int(day*10000+i)
+                appender.write_string('msg%s' % i)
+                appender.finish()
+            write_chron.close()
+        self.cycle_dir = os.path.join(self.tempdir.path, '20150101')
+
+    def test_read_archived(self):
+        path = pychro.archive_cycle(self.cycle_dir, block_size=4096)
+        self.assertFalse(os.path.exists(self.cycle_dir))
+        self.assertLess(os.path.getsize(path), 1024*1024)
+        read_chron = pychro.VanillaChronicleReader(self.tempdir.path)
+        for day in (1, 2):
+            for i in range(1000):
+                reader = read_chron.next_reader()
+                self.assertEqual(day*10000+i, reader.read_int())
+                self.assertEqual('msg%s' % i, reader.read_string())
+        self.assertRaises(pychro.NoData, read_chron.next_reader)
+        read_chron.close()
+
+    def test_set_index(self):
+        pychro.archive_cycle(self.cycle_dir, codec='lzma')
+        read_chron = pychro.VanillaChronicleReader(self.tempdir.path, date=datetime.date(2015, 1, 2))
+        read_chron.set_index(read_chron.to_full_index(datetime.date(2015, 1, 1), 567))
+        self.assertEqual(10567, read_chron.next_reader().read_int())
+        self.assertEqual(read_chron.to_full_index(datetime.date(2015, 1, 1), 1000), read_chron.get_end_index_today())
+        read_chron.set_index(read_chron.to_full_index(datetime.date(2015, 1, 2), 3))
+        self.assertEqual(20003, read_chron.next_reader().read_int())
+        read_chron.close()
+
+    def test_compacted(self):
+        # index files cut short by compaction, with the last entry mid page and at the end of one
+        for day, count in ((3, 1500), (4, mmap.PAGESIZE//8)):
+            write_chron = pychro.VanillaChronicleWriter(self.tempdir.path,
+                                                        utcnow=lambda: datetime.datetime(2015, 1, day, 12))
+            appender = write_chron.get_appender()
+            for i in range(count):
+                appender.write_int(day*10000+i)
+                appender.finish()
+            write_chron.close()
+            cycle_dir = os.path.join(self.tempdir.path, '2015010%s' % day)
+            pychro.compact_cycle(cycle_dir)
+            pychro.archive_cycle(cycle_dir)
+            read_chron = pychro.VanillaChronicleReader(self.tempdir.path, date=datetime.date(2015, 1, day))
+            self.assertEqual(read_chron.to_full_index(datetime.date(2015, 1, day), count),
+                             read_chron.get_end_index_today())
+            for i in range(count):
+                self.assertEqual(day*10000+i, read_chron.next_reader().read_int())
+            self.assertRaises(pychro.NoData, read_chron.next_reader)
+            read_chron.close()
+
+    def test_open_cycle(self):
+        self.assertRaises(pychro.InvalidArgumentError, pychro.archive_cycle, self.cycle_dir,
+                          utcnow=lambda: datetime.datetime(2015, 1, 1, 13))
+        self.assertRaises(pychro.InvalidArgumentError, pychro.archive_cycle, self.cycle_dir, codec='bz2')
+
+
+class TestCompact(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = TempDir()
+        for day in (1, 2):
+            write_chron = pychro.VanillaChronicleWriter(self.tempdir.path,
+                                                        utcnow=lambda: datetime.datetime(2015, 1, day, 12))
+            appender = write_chron.get_appender()
+            for i in range(1000):
+                appender.write_int(day*10000+i)
+                appender.write_int(0)
+                appender.finish()
+            write_chron.close()
+        self.cycle_dir = os.path.join(self.tempdir.path, '20150101')
+
+    def test_compact(self):
+        size = sum(os.path.getsize(os.path.join(self.cycle_dir, f)) for f in os.listdir(self.cycle_dir))
+        reclaimed = pychro.compact_cycle(self.cycle_dir)
+        new_size = sum(os.path.getsize(os.path.join(self.cycle_dir, f)) for f in os.listdir(self.cycle_dir))
+        self.assertEqual(size - new_size, reclaimed)
+        self.assertLess(new_size, 1024*1024)
+        self.assertEqual(-(-1000*8//mmap.PAGESIZE)*mmap.PAGESIZE,
+                         os.path.getsize(os.path.join(self.cycle_dir, 'index-0')))
+        self.assertEqual(mmap.PAGESIZE, os.path.getsize(os.path.join(self.cycle_dir, 'index-1')))
+        # cut at the end of the last message, although it ends in zero bytes
+        data_file, = [f for f in os.listdir(self.cycle_dir) if f.startswith('data-')]
+        self.assertEqual(-(-(4 + 12*1000 - 4)//mmap.PAGESIZE)*mmap.PAGESIZE,
+                         os.path.getsize(os.path.join(self.cycle_dir, data_file)))
+
+        read_chron = pychro.VanillaChronicleReader(self.tempdir.path)
+        self.assertEqual(read_chron.to_full_index(datetime.date(2015, 1, 1), 1000), read_chron.get_end_index_today())
+        for day in (1, 2):
+            for i in range(1000):
+                reader = read_chron.next_reader()
+                self.assertEqual(day*10000+i, reader.read_int())
+                self.assertEqual(0, reader.read_int())
+        self.assertRaises(pychro.NoData, read_chron.next_reader)
+        read_chron.close()
+        self.assertEqual(0, pychro.compact_cycle(self.cycle_dir))
+
+    def test_unframed(self):
+        cycle_dir = write_unframed_cycle(self.tempdir.path, datetime.date(2014, 12, 31),
+                                         [(1, struct.pack('ii', i, 0)) for i in range(1000)])
+        pychro.compact_cycle(cycle_dir)
+        # without lengths, the zeros the last message may end in are kept
+        self.assertEqual(-(-(4 + 8*1000 - 4 + pychro.DEFAULT_COMPACT_TAIL_MARGIN)//mmap.PAGESIZE)*mmap.PAGESIZE,
+                         os.path.getsize(os.path.join(cycle_dir, 'data-1-0')))
+        read_chron = pychro.VanillaChronicleReader(self.tempdir.path)
+        for i in range(1000):
+            reader = read_chron.next_reader()
+            self.assertEqual((i, 0), (reader.read_int(), reader.read_int()))
+        read_chron.close()
+
+    def test_growing_index(self):
+        src_dir = os.path.join(self.tempdir.path, '20150102')
+        dst_dir = os.path.join(self.tempdir.path, '20150103')
+        os.makedirs(dst_dir)
+        open(os.path.join(dst_dir, 'index-0'), 'wb').close()
+        read_chron = pychro.VanillaChronicleReader(self.tempdir.path, date=datetime.date(2015, 1, 3))
+        self.assertRaises(pychro.NoData, read_chron.next_reader)
+        for f in sorted(os.listdir(src_dir)):
+            shutil.copy(os.path.join(src_dir, f), dst_dir)
+        self.assertEqual(20000, read_chron.next_reader().read_int())
+        read_chron.close()
+
+    def test_page_boundary(self):
+        # the index cut at the end of the page its last entry fills, read as a directory then archived
+        count = mmap.PAGESIZE//8
+        write_chron = pychro.VanillaChronicleWriter(self.tempdir.path, utcnow=lambda: datetime.datetime(2015, 1, 3, 12))
+        appender = write_chron.get_appender()
+        for i in range(count):
+            appender.write_int(i)
+            appender.finish()
+        write_chron.close()
+        cycle_dir = os.path.join(self.tempdir.path, '20150103')
+        pychro.compact_cycle(cycle_dir)
+        self.assertEqual(mmap.PAGESIZE, os.path.getsize(os.path.join(cycle_dir, 'index-0')))
+        for archive in (False, True):
+            if archive:
+                pychro.archive_cycle(cycle_dir)
+            read_chron = pychro.VanillaChronicleReader(self.tempdir.path, date=datetime.date(2015, 1, 3))
+            self.assertEqual(read_chron.to_full_index(datetime.date(2015, 1, 3), count),
+                             read_chron.get_end_index_today())
+            self.assertEqual(list(range(count)), [read_chron.next_reader().read_int() for _ in range(count)])
+            self.assertRaises(pychro.NoData, read_chron.next_reader)
+            read_chron.close()
+
+    def test_open_cycle(self):
+        self.assertRaises(pychro.InvalidArgumentError, pychro.compact_cycle, self.cycle_dir,
+                          utcnow=lambda: datetime.datetime(2015, 1, 1, 13))
+
+
+class TestRandomAccess(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = TempDir()
+        self.days = 4
+        for day in range(1, self.days+1):
+            write_chron = pychro.VanillaChronicleWriter(self.tempdir.path,
+                                                        utcnow=lambda: datetime.datetime(2015, 1, day, 12))
+            appender = write_chron.get_appender()
+            for i in range(100):
+                appender.write_int(day*1000+i)
+                appender.finish()
+            write_chron.close()
+        self.read_chron = pychro.VanillaChronicleReader(self.tempdir.path, max_random_access_cycles=2)
+
+    def tearDown(self):
+        self.read_chron.close()
+
+    def full_index(self, day, i):
+        return pychro.VanillaChronicleReader.to_full_index(datetime.date(2015, 1, day), i)
+
+    def test_read_at(self):
+        self.assertEqual(1000, self.read_chron.next_reader().read_int())
+        index = self.read_chron.get_index()
+        for day, i in [(3, 5), (1, 99), (4, 0), (2, 50), (3, 7)]:
+            self.assertEqual(day*1000+i, self.read_chron.read_at(self.full_index(day, i)).read_int())
+        self.assertEqual(2, len(self.read_chron._random_access))
+        self.assertEqual(index, self.read_chron.get_index())
+        self.assertEqual(1001, self.read_chron.next_reader().read_int())
+        self.assertRaises(pychro.NoData, self.read_chron.read_at, self.full_index(2, 100))
+        self.assertRaises(pychro.NoChronicleForDate, self.read_chron.read_at, self.full_index(5, 0))
+
+    def test_read_many(self):
+        indexes = [self.full_index(4, 1), self.full_index(2, 2), self.full_index(4, 1), self.full_index(1, 3)]
+        readers = self.read_chron.read_many(indexes)
+        self.assertEqual([4001, 2002, 4001, 1003], [r.read_int() for r in readers])
+        self.assertEqual(self.full_index(1, 0), self.read_chron.get_index())
+
+    def test_archived(self):
+        pychro.archive_cycle(os.path.join(self.tempdir.path, '20150102'))
+        self.assertEqual(2042, self.read_chron.read_at(self.full_index(2, 42)).read_int())
+
+
+class TestTimeIndex(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = TempDir()
+        self.write_chron = pychro.VanillaChronicleWriter(self.tempdir.path)
+        self.n = 3000
+
+    def tearDown(self):
+        self.write_chron.close()
+
+    def write(self, start=0, time_indexer=None):
+        appender = self.write_chron.get_appender()
+        for i in range(start, start+self.n):
+            appender.write_long(1000 + i*10)
+            appender.write_int(i)
+            full_index = appender.finish()
+            if time_indexer:
+                time_indexer.add(full_index, 1000 + i*10)
+
+    def check_seek(self):
+        read_chron = pychro.VanillaChronicleReader(self.tempdir.path)
+        full_index = read_chron.seek_time(1000 + 1234*10 + 5, lambda r: r.read_long())
+        self.assertEqual(read_chron.to_full_index(read_chron.get_date(), 1235), full_index)
+        reader = read_chron.next_reader()
+        reader.read_long()
+        self.assertEqual(1235, reader.read_int())
+        read_chron.seek_time(0, lambda r: r.read_long())
+        self.assertEqual(1000, read_chron.next_reader().read_long())
+        self.assertEqual(None, read_chron.seek_time(10**9, lambda r: r.read_long()))
+        self.assertRaises(pychro.NoData, read_chron.next_reader)
+        read_chron.close()
+
+    def test_double_timestamps(self):
+        appender = self.write_chron.get_appender()
+        timestamps = [i*0.3 for i in range(self.n)]
+        for timestamp in timestamps:
+            appender.write_double(timestamp)
+            appender.finish()
+        indexer = pychro.TimeIndexer(self.tempdir.path, lambda r: r.read_double(), stride=100)
+        self.assertEqual(30, indexer.update())
+        indexer.close()
+        read_chron = pychro.VanillaChronicleReader(self.tempdir.path)
+        for timestamp in (0, 29.95, 30.0, 123.45, 899.6):
+            expected = next(i for i, t in enumerate(timestamps) if t >= timestamp)
+            self.assertEqual(read_chron.to_full_index(read_chron.get_date(), expected),
+                             read_chron.seek_time(timestamp, lambda r: r.read_double()))
+        read_chron.close()
+
+    def test_tailing(self):
+        self.write()
+        indexer = pychro.TimeIndexer(self.tempdir.path, lambda r: r.read_long(), stride=100)
+        self.assertEqual(30, indexer.update())
+        self.assertEqual(0, indexer.update())
+        indexer.close()
+        self.write(self.n)
+        indexer = pychro.TimeIndexer(self.tempdir.path, lambda r: r.read_long(), stride=100)
+        self.assertEqual(30, indexer.update())
+        indexer.close()
+        index = pychro.TimeIndex(pychro.time_index_path(self.tempdir.path, self.write_chron.get_date()))
+        self.assertEqual(60, len(index))
+        self.assertEqual(1000 + 100*10, index[1][0])
+        self.check_seek()
+
+    def test_writing(self):
+        indexer = pychro.TimeIndexer(self.tempdir.path, stride=100)
+        self.write(time_indexer=indexer)
+        indexer.close()
+        self.check_seek()
+
+
+class TestKeyIndex(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = TempDir()
+        for day in (1, 2):
+            write_chron = pychro.VanillaChronicleWriter(self.tempdir.path,
+                                                        utcnow=lambda: datetime.datetime(2015, 1, day, 12))
+            appender = write_chron.get_appender()
+            for i in range(1000):
+                appender.write_string('ORD%s' % (i % 37))
+                appender.write_int(day*10000+i)
+                appender.finish()
+            write_chron.close()
+
+    def test_lookup(self):
+        indexer = pychro.KeyIndexer(self.tempdir.path, 'order', lambda r: r.read_string(), bucket_count=16)
+        self.assertEqual(2000, indexer.update())
+        indexer.close()
+        read_chron = pychro.VanillaChronicleReader(self.tempdir.path)
+        key_index = pychro.KeyIndex(self.tempdir.path, 'order')
+        indexes = key_index.lookup('ORD5')
+        self.assertEqual(sorted(indexes), indexes)
+        expected = [day*10000+i for day in (1, 2) for i in range(1000) if i % 37 == 5]
+        self.assertEqual(expected, [r.read_int() for r in read_chron.read_many(indexes) if r.read_string()])
+        self.assertEqual(len(expected)//2, len(key_index.lookup('ORD5', date=datetime.date(2015, 1, 2))))
+        self.assertEqual([], key_index.lookup('ORD99'))
+        read_chron.close()
+
+    def test_resume(self):
+        indexer = pychro.KeyIndexer(self.tempdir.path, 'order', lambda r: r.read_string())
+        indexer.update()
+        indexer.close()
+        write_chron = pychro.VanillaChronicleWriter(self.tempdir.path, utcnow=lambda: datetime.datetime(2015, 1, 2, 13))
+        appender = write_chron.get_appender()
+        appender.write_string('ORD5')
+        appender.finish()
+        write_chron.close()
+        indexer = pychro.KeyIndexer(self.tempdir.path, 'order', lambda r: r.read_string())
+        self.assertEqual(1, indexer.update())
+        indexer.close()
+        self.assertEqual(2*27 + 1, len(pychro.KeyIndex(self.tempdir.path, 'order').lookup('ORD5')))
+
+    def test_thread(self):
+        indexer = pychro.KeyIndexer(self.tempdir.path, 'order', lambda r: r.read_string(), polling_interval=0.01)
+        indexer.start()
+        while len(pychro.KeyIndex(self.tempdir.path, 'order').lookup('ORD1', date=datetime.date(2015, 1, 2))) < 27:
+            time.sleep(0.01)
+        indexer.stop()
+        indexer.join()
+        indexer.close()
+
+
+class TestMessageFilter(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = TempDir()
+        self.n = NUM_WORDS
+        self.write_chron = pychro.VanillaChronicleWriter(self.tempdir.path)
+        appender = self.write_chron.get_appender()
+        for i in range(self.n):
+            appender.write_int(i % 20)
+            appender.write_long(i)
+            appender.finish()
+        self.read_chron = pychro.VanillaChronicleReader(self.tempdir.path)
+
+    def tearDown(self):
+        self.write_chron.close()
+        self.read_chron.close()
+
+    def test_filter(self):
+        message_filter = pychro.MessageFilter([(0, 'int', {3, 7})])
+        found = []
+        while True:
+            try:
+                reader = self.read_chron.next_matching_reader(message_filter)
+            except pychro.NoData:
+                break
+            self.assertIn(reader.read_int(), (3, 7))
+            found += [reader.read_long()]
+        self.assertEqual([i for i in range(self.n) if i % 20 in (3, 7)], found)
+
+    def test_multiple_fields(self):
+        message_filter = pychro.MessageFilter([(4, 'long', {21, 22, 23, 43}), (0, 'int', {3})])
+        reader = self.read_chron.next_matching_reader(message_filter)
+        self.assertEqual((3, 23), (reader.read_int(), reader.read_long()))
+        reader = self.read_chron.next_matching_reader(message_filter)
+        self.assertEqual((3, 43), (reader.read_int(), reader.read_long()))
+        self.assertRaises(pychro.NoData, self.read_chron.next_matching_reader, message_filter)
+
+    def test_invalid(self):
+        self.assertRaises(pychro.InvalidArgumentError, pychro.MessageFilter, [(0, 'string', {'a'})])
+        self.assertRaises(pychro.InvalidArgumentError, pychro.MessageFilter, [(0, 'long', {1}), (4, 'int', {1})])
+
+    def matching(self, message_filter):
+        self.read_chron.set_start_index_today()
+        found = []
+        while True:
+            try:
+                reader = self.read_chron.next_matching_reader(message_filter)
+                reader.read_int()
+                found += [reader.read_long()]
+            except pychro.NoData:
+                return found
+
+    def test_native(self):
+        conditions = [[(0, 'int', {3, 7})],
+                      [(0, 'int', {3.0, 7.5, float('nan'), float('inf')})],
+                      [(0, 'short', {2, 3}), (4, 'long', {22, 23, 43, 2**70})],
+                      [(0, 'byte', {5}), (4, 'double', {0.0})],
+                      [(1, 'boolean', {False}), (0, 'byte', {1})],
+                      [(4, 'long', {5, 'a'})]]
+        for c in conditions:
+            message_filter = pychro.MessageFilter(c)
+            native = self.matching(message_filter)
+            message_filter.native = None
+            self.assertEqual(native, self.matching(message_filter))
+        self.assertEqual([i for i in range(self.n) if i % 20 == 3],
+                         self.matching(pychro.MessageFilter([(0, 'int', {3.0, 7.5, float('nan')})])))
+        self.assertEqual([5], self.matching(pychro.MessageFilter([(4, 'long', {5, 'a'})])))
+        if pychro.HAVE_NATIVE_FILTER:
+            self.assertIsNotNone(pychro.MessageFilter([(0, 'int', {3, 7})]).native)
+        self.assertIsNone(pychro.MessageFilter([(0, 'int', {3, 'a'})]).native)
+
+    def test_native_pooled(self):
+        message_filter = pychro.MessageFilter([(0, 'int', {11})])
+        pool = pychro.ChroniclePool(self.tempdir.path)
+        cursors = [pool.cursor() for _ in range(2)]
+        for cursor in cursors:
+            found = []
+            while True:
+                try:
+                    reader = cursor.next_matching_reader(message_filter)
+                    reader.read_int()
+                    found += [reader.read_long()]
+                except pychro.NoData:
+                    break
+            self.assertEqual([i for i in range(self.n) if i % 20 == 11], found)
+        [cursor.close() for cursor in cursors]
+
+    def test_perf_filter(self):
+        message_filter = pychro.MessageFilter([(0, 'int', {3, 7})])
+        t = time.time()
+        while True:
+            try:
+                reader = self.read_chron.next_reader()
+            except pychro.NoData:
+                break
+            if reader.peek_int() in (3, 7):
+                pass
+        t = time.time() - t
+        print('Read and filter %.2f msgs/s' % (self.n/t))
+        self.read_chron.set_start_index_today()
+        t = time.time()
+        while True:
+            try:
+                self.read_chron.next_matching_raw_bytes(message_filter)
+            except pychro.NoData:
+                break
+        t = time.time() - t
+        print('Pushdown filter %.2f msgs/s' % (self.n/t))
+        message_filter.native = None
+        self.read_chron.set_start_index_today()
+        t = time.time()
+        while True:
+            try:
+                self.read_chron.next_matching_raw_bytes(message_filter)
+            except pychro.NoData:
+                break
+        t = time.time() - t
+        print('Pushdown filter without native scan %.2f msgs/s' % (self.n/t))
+
+
+class TestCheckpoint(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = TempDir()
+        self.write_chron = pychro.VanillaChronicleWriter(self.tempdir.path)
+        appender = self.write_chron.get_appender()
+        for i in range(100):
+            appender.write_int(i)
+            appender.finish()
+
+    def tearDown(self):
+        self.write_chron.close()
+
+    def test_resume(self):
+        store = pychro.CheckpointStore(self.tempdir.path)
+        checkpoint = store.consumer('consumer-1', flush_every=10)
+        self.assertEqual(0, checkpoint.get())
+        read_chron = pychro.VanillaChronicleReader(self.tempdir.path, full_index=checkpoint.get())
+        for i in range(42):
+            read_chron.next_reader()
+            checkpoint.commit(read_chron.get_index())
+        read_chron.close()
+        store.close()
+
+        store = pychro.CheckpointStore(self.tempdir.path)
+        checkpoint = store.consumer('consumer-1')
+        read_chron = pychro.VanillaChronicleReader(self.tempdir.path, full_index=checkpoint.get())
+        self.assertEqual(42, read_chron.next_reader().read_int())
+        read_chron.close()
+        store.close()
+
+    def test_positions(self):
+        stores = [pychro.CheckpointStore(self.tempdir.path) for _ in range(2)]
+        base = self.write_chron.to_full_index(self.write_chron.get_date(), 0)
+        stores[0].consumer('a').commit(base + 1)
+        stores[1].consumer('b').commit(base + 2)
+        stores[1].consumer('a').commit(base + 3)
+        stores[0].consumer('c', flush_interval=0).commit(base + 4)
+        self.assertEqual({'a': base + 3, 'b': base + 2, 'c': base + 4}, stores[1].positions())
+        [s.close() for s in stores]
+
+    def test_limits(self):
+        store = pychro.CheckpointStore(self.tempdir.path, slots=2)
+        self.assertRaises(pychro.InvalidArgumentError, store.consumer, 'x'*49)
+        store.consumer('a')
+        store.consumer('b')
+        store.consumer('a')
+        self.assertRaises(pychro.NoSpace, store.consumer, 'c')
+        store.close()
+
+
+class TestWriterRestart(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = TempDir()
+
+    def test_end_index(self):
+        n = 3000
+        write_chron = pychro.VanillaChronicleWriter(self.tempdir.path)
+        appender = write_chron.get_appender()
+        for i in range(n):
+            appender.write_int(i)
+            appender.finish()
+        write_chron.close()
+        read_chron = pychro.VanillaChronicleReader(self.tempdir.path)
+        base = read_chron.to_full_index(read_chron.get_date(), 0)
+        for start in (0, 1, 1234, n-1, n):
+            read_chron.set_index(base + start)
+            read_chron._max_index = 0
+            self.assertEqual(base + n, read_chron.get_end_index_today())
+        read_chron.close()
+
+    def test_positions(self):
+        write_chron = pychro.VanillaChronicleWriter(self.tempdir.path)
+        appender = write_chron.get_appender()
+        appender.write_int(1)
+        appender.finish()
+        tid = write_chron._get_tid()
+        write_chron.close()
+        write_chron = pychro.VanillaChronicleWriter(self.tempdir.path)
+        self.assertEqual((1, 4), write_chron._positions[tid])
+        self.assertEqual(write_chron.to_full_index(write_chron.get_date(), 1), write_chron.get_index())
+        appender = write_chron.get_appender()
+        appender.write_int(2)
+        appender.finish()
+        write_chron.close()
+        write_chron = pychro.VanillaChronicleWriter(self.tempdir.path)
+        self.assertEqual((2, 4), write_chron._positions[tid])
+        write_chron.close()
+
+    def test_perf_restart(self):
+        n = NUM_WORDS
+        write_chron = pychro.VanillaChronicleWriter(self.tempdir.path)
+        appender = write_chron.get_appender()
+        for i in range(n):
+            appender.write_int(i)
+            appender.finish()
+        write_chron.close()
+        t = time.time()
+        write_chron = pychro.VanillaChronicleWriter(self.tempdir.path)
+        t = time.time() - t
+        print('Writer restart after %s messages took %.4fs' % (n, t))
+        appender = write_chron.get_appender()
+        appender.write_int(n)
+        self.assertEqual(write_chron.to_full_index(write_chron.get_date(), n), appender.finish())
+        write_chron.close()
+
+
+class TestReuseReader(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = TempDir()
+        self.n = NUM_WORDS
+        self.write_chron = pychro.VanillaChronicleWriter(self.tempdir.path)
+        appender = self.write_chron.get_appender()
+        for i in range(self.n):
+            appender.write_int(i)
+            appender.finish()
+        self.read_chron = pychro.VanillaChronicleReader(self.tempdir.path)
+
+    def tearDown(self):
+        self.write_chron.close()
+        self.read_chron.close()
+
+    def test_next_into(self):
+        reader = pychro.RawByteReader(0, None)
+        for i in range(self.n):
+            self.assertIs(reader, self.read_chron.next_into(reader))
+            self.assertEqual(i, reader.read_int())
+        self.assertRaises(pychro.NoData, self.read_chron.next_into, reader)
+
+    def test_iter_readers(self):
+        readers = set()
+        values = []
+        for reader in self.read_chron.iter_readers():
+            readers.add(id(reader))
+            values += [reader.read_int()]
+        self.assertEqual(list(range(self.n)), values)
+        self.assertEqual(1, len(readers))
+        self.read_chron.set_start_index_today()
+        self.assertEqual(list(range(self.n)), [r.read_int() for r in list(self.read_chron.iter_readers(reuse=False))])
+
+    def test_perf_reuse(self):
+        t = time.time()
+        for i in range(self.n):
+            self.read_chron.next_reader().read_int()
+        t = time.time() - t
+        print('Read new reader %.2f ints/s' % (self.n/t))
+        self.read_chron.set_start_index_today()
+        reader = pychro.RawByteReader(0, None)
+        t = time.time()
+        for i in range(self.n):
+            self.read_chron.next_into(reader).read_int()
+        t = time.time() - t
+        print('Read reused reader %.2f ints/s' % (self.n/t))
+
+
+class TestStringCache(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = TempDir()
+        self.n = NUM_WORDS
+        self.symbols = ['VOD.L', 'BARC.L', 'HSBA.L', 'XLON', 'BATE', 'ሴ'*3]
+        self.write_chron = pychro.VanillaChronicleWriter(self.tempdir.path)
+        appender = self.write_chron.get_appender()
+        for i in range(self.n):
+            appender.write_string(self.symbols[i % len(self.symbols)])
+            appender.write_string('unique%s' % i)
+            appender.finish()
+
+    def tearDown(self):
+        self.write_chron.close()
+
+    def test_cache(self):
+        cache = pychro.StringCache(max_size=len(self.symbols) + 2, max_length=6)
+        read_chron = pychro.VanillaChronicleReader(self.tempdir.path, string_cache=cache)
+        symbols = []
+        for i in range(self.n):
+            reader = read_chron.next_reader()
+            self.assertEqual(self.symbols[i % len(self.symbols)], reader.peek_string())
+            symbols += [reader.read_string()]
+            self.assertEqual('unique%s' % i, reader.read_string())
+        self.assertEqual([self.symbols[i % len(self.symbols)] for i in range(self.n)], symbols)
+        self.assertIs(symbols[0], symbols[len(self.symbols)])
+        cached = [s for s in self.symbols if len(s.encode()) <= 6]
+        self.assertEqual(2*len([s for s in symbols if s in cached]) - len(cached), cache.hits)
+        self.assertGreater(cache.hit_rate(), 0.4)
+        read_chron.close()
+
+    def test_perf_cache(self):
+        for cache in (None, pychro.StringCache()):
+            read_chron = pychro.VanillaChronicleReader(self.tempdir.path, string_cache=cache)
+            reader = pychro.RawByteReader(0, None, cache)
+            t = time.time()
+            for i in range(self.n):
+                read_chron.next_into(reader).read_string()
+            t = time.time() - t
+            print('Read strings with %s %.2f strings/s' % (cache, self.n/t))
+            read_chron.close()
+
+
+class TestMappingOptions(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = TempDir()
+
+    def test_options(self):
+        options = pychro.MappingOptions(populate=True, advice='sequential', lock=True, prefault_next=True)
+        write_chron = pychro.VanillaChronicleWriter(self.tempdir.path, mapping_options=options)
+        appender = write_chron.get_appender()
+        for i in range(1000):
+            appender.write_int(i)
+            appender.finish()
+        self.assertEqual(1, len(write_chron._data_pins))
+
+        read_chron = pychro.VanillaChronicleReader(self.tempdir.path, mapping_options=options)
+        self.assertEqual(list(range(1000)), [read_chron.next_reader().read_int() for _ in range(1000)])
+        self.assertEqual(1, len(read_chron._data_pins))
+        read_chron.close()
+        write_chron.close()
+        self.assertEqual(0, len(read_chron._data_pins))
+        self.assertEqual(0, len(write_chron._data_pins))
+
+    def test_invalid(self):
+        with self.assertRaises(pychro.InvalidArgumentError):
+            pychro.MappingOptions(advice='soon')
+
+    def test_warm_up(self):
+        write_chron = pychro.VanillaChronicleWriter(self.tempdir.path)
+        appender = write_chron.get_appender()
+        for i in range(100):
+            appender.write_int(i)
+            appender.finish()
+        read_chron = pychro.VanillaChronicleReader(self.tempdir.path)
+        report = read_chron.warm_up(start_date=write_chron.get_date(), end_date=write_chron.get_date())
+        self.assertEqual(['data-%s-0' % appender._tid, 'index-0', 'index-1'],
+                         [os.path.basename(f[0]) for f in report.files])
+        self.assertEqual((pychro.DATA_FILE_SIZE + 2*pychro.INDEX_FILE_SIZE)//mmap.PAGESIZE, report.pages())
+        self.assertEqual(1.0, report.residency())
+        self.assertEqual([], read_chron.warm_up(end_date=write_chron.get_date() - datetime.timedelta(days=1)).files)
+        read_chron.close()
+        write_chron.close()
+
+
+class TestReplication(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = TempDir()
+        self.source_dir = os.path.join(self.tempdir.path, 'source')
+        self.dest_dir = os.path.join(self.tempdir.path, 'dest')
+        self.write_chron = pychro.VanillaChronicleWriter(self.source_dir)
+        self.write(0, 1000)
+
+    def tearDown(self):
+        self.write_chron.close()
+
+    def write(self, start, end):
+        appender = self.write_chron.get_appender()
+        for i in range(start, end):
+            appender.write_int(i)
+            appender.write_string('x'*(i % 7))
+            appender.finish()
+
+    def messages(self, base_dir):
+        read_chron = pychro.VanillaChronicleReader(base_dir)
+        messages = []
+        while True:
+            try:
+                messages += [read_chron.next_message_bytes()]
+            except pychro.NoData:
+                break
+        read_chron.close()
+        return messages
+
+    def replicate(self, transports):
+        sink = pychro.ReplicationSink(self.dest_dir, transports[1])
+        sink.start()
+        replicator = pychro.Replicator(self.source_dir, transports[0], batch_size=100, window=2)
+        sent = replicator.update()
+        replicator.sync()
+        self.assertEqual(0, replicator.stats.lag())
+        replicator.close()
+        sink.join()
+        return sent
+
+    def test_message_bytes(self):
+        read_chron = pychro.VanillaChronicleReader(self.source_dir)
+        for i in range(10):
+            data = read_chron.next_message_bytes()
+            self.assertEqual(5 + i % 7, len(data))
+            self.assertEqual(i, struct.unpack('i', data[:4])[0])
+        read_chron.close()
+
+    def test_in_process(self):
+        self.assertEqual(1000, self.replicate(pychro.InProcessTransport.pair()))
+        self.assertEqual(self.messages(self.source_dir), self.messages(self.dest_dir))
+        self.write(1000, 1500)
+        self.assertEqual(500, self.replicate(pychro.InProcessTransport.pair()))
+        self.assertEqual(self.messages(self.source_dir), self.messages(self.dest_dir))
+
+    def test_positions(self):
+        # the source position is not a consumer of the destination
+        self.replicate(pychro.InProcessTransport.pair())
+        self.assertFalse(os.path.exists(os.path.join(self.dest_dir, pychro.CHECKPOINT_FILE)))
+        store = pychro.CheckpointStore(self.dest_dir, filename=pychro.REPLICATION_CHECKPOINT_FILE)
+        source = pychro.VanillaChronicleReader(self.source_dir)
+        for _ in range(1000):
+            source.next_message_bytes()
+        self.assertEqual({'replication': source.get_index()}, store.positions())
+        store.close()
+        source.close()
+        monitor = pychro.LagMonitor(self.dest_dir)
+        self.assertEqual({}, monitor.update())
+        monitor.close()
+        self.assertIsNone(pychro.RetentionManager(self.dest_dir, keep_cycles=0)._first_unconsumed_cycle())
+
+    def test_sockets(self):
+        for address in (os.path.join(self.tempdir.path, 'replication.sock'), ('127.0.0.1', 0)):
+            if isinstance(address, tuple):
+                self.write(1000, 1100)
+            listener = pychro.SocketListener(address)
+            transport = pychro.SocketTransport.connect(listener.address)
+            self.replicate((transport, listener.accept(timeout=10)))
+            listener.close()
+            self.assertEqual(self.messages(self.source_dir), self.messages(self.dest_dir))
+        self.assertEqual(1100, len(self.messages(self.dest_dir)))
+
+    def test_perf_replication(self):
+        self.write(1000, 1000 + NUM_WORDS)
+        listener = pychro.SocketListener(('127.0.0.1', 0))
+        replicator = pychro.Replicator(self.source_dir, pychro.SocketTransport.connect(listener.address))
+        sink = pychro.ReplicationSink(self.dest_dir, listener.accept(timeout=10))
+        sink.start()
+        replicator.update()
+        replicator.sync()
+        print(replicator.stats)
+        replicator.close()
+        sink.join()
+        listener.close()
+
+
+class TestChroniclePool(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = TempDir()
+        self.dates = [datetime.datetime(2015, 3, 1, 12), datetime.datetime(2015, 3, 2, 12)]
+        self.now = self.dates[0]
+        self.write_chron = pychro.VanillaChronicleWriter(self.tempdir.path, utcnow=lambda: self.now)
+        for now in self.dates:
+            self.now = now
+            appender = self.write_chron.get_appender()
+            for i in range(100):
+                appender.write_int(i)
+                appender.finish()
+        self.pool = pychro.ChroniclePool(self.tempdir.path, utcnow=lambda: self.now)
+
+    def tearDown(self):
+        self.write_chron.close()
+
+    def test_cursors(self):
+        cursors = [self.pool.cursor() for _ in range(50)]
+        cycle_dir = os.path.join(self.tempdir.path, '20150301')
+        self.assertEqual({cycle_dir: 50}, self.pool.open_cycles())
+        for cursor in cursors:
+            self.assertEqual(list(range(100)), [cursor.next_reader().read_int() for _ in range(100)])
+        self.assertTrue(all(c._index_mm is cursors[0]._index_mm for c in cursors))
+        self.assertTrue(all(c._data_mms is cursors[0]._data_mms for c in cursors))
+        self.assertEqual(1, len(cursors[0]._data_mms))
+
+        # half move on to the next cycle
+        for cursor in cursors[:25]:
+            self.assertEqual(0, cursor.next_reader().read_int())
+        self.assertEqual({cycle_dir: 25, os.path.join(self.tempdir.path, '20150302'): 25}, self.pool.open_cycles())
+        [cursor.close() for cursor in cursors]
+        self.assertEqual({}, self.pool.open_cycles())
+
+    def test_random_access(self):
+        cursor = self.pool.cursor()
+        full_index = cursor.to_full_index(self.dates[1].date(), 42)
+        self.assertEqual(42, cursor.read_at(full_index).read_int())
+        self.assertEqual(2, len(self.pool.open_cycles()))
+        cursor.close()
+        self.assertEqual({}, self.pool.open_cycles())
+
+    def test_threads(self):
+        results = [[] for _ in range(8)]
+
+        def read(result):
+            cursor = self.pool.cursor(full_index=self.write_chron.to_full_index(self.dates[1].date(), 0))
+            while True:
+                try:
+                    result += [cursor.next_reader().read_int()]
+                except pychro.NoData:
+                    break
+            cursor.close()
+        threads = [threading.Thread(target=read, args=(result,)) for result in results]
+        [t.start() for t in threads]
+        [t.join() for t in threads]
+        self.assertEqual([list(range(100))]*8, results)
+
+    def test_threads_index_files(self):
+        # cursors in threads opening the same index files, switching threads as often as possible
+        base_dir = os.path.join(self.tempdir.path, 'small')
+        config = pychro.VanillaChronicleConfig(index_block_size=4096)
+        write_chron = pychro.VanillaChronicleWriter(base_dir, config=config)
+        appender = write_chron.get_appender()
+        n = 20*512
+        for i in range(n):
+            appender.write_int(i)
+            appender.finish()
+        write_chron.close()
+        pool = pychro.ChroniclePool(base_dir, config=config)
+        results = [[] for _ in range(16)]
+        barrier = threading.Barrier(len(results))
+
+        def read(result):
+            cursor = pool.cursor()
+            barrier.wait()
+            while True:
+                try:
+                    result += [cursor.next_reader().read_int()]
+                except pychro.NoData:
+                    break
+            cursor.close()
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            threads = [threading.Thread(target=read, args=(result,)) for result in results]
+            [t.start() for t in threads]
+            [t.join() for t in threads]
+        finally:
+            sys.setswitchinterval(interval)
+        self.assertEqual([list(range(n))]*16, results)
+
+    def test_perf_cursors(self):
+        n = 100
+        t = time.time()
+        readers = [pychro.VanillaChronicleReader(self.tempdir.path) for _ in range(n)]
+        [reader.next_reader() for reader in readers]
+        print('%s readers %.6fs' % (n, time.time() - t))
+        [reader.close() for reader in readers]
+        t = time.time()
+        cursors = [self.pool.cursor() for _ in range(n)]
+        [cursor.next_reader() for cursor in cursors]
+        print('%s cursors %.6fs' % (n, time.time() - t))
+        [cursor.close() for cursor in cursors]
+
+
+class TestDurability(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = TempDir()
+
+    def write(self, durability, n=100):
+        write_chron = pychro.VanillaChronicleWriter(self.tempdir.path, durability=durability)
+        appender = write_chron.get_appender()
+        latencies = []
+        for i in range(n):
+            t = time.time()
+            appender.write_int(i)
+            appender.finish()
+            latencies += [time.time() - t]
+        return write_chron, latencies
+
+    def wait_for_syncs(self, write_chron, syncs, timeout=10):
+        deadline = time.time() + timeout
+        while write_chron.syncs < syncs and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(syncs, write_chron.syncs)
+
+    def read(self):
+        read_chron = pychro.VanillaChronicleReader(self.tempdir.path)
+        ints = []
+        while True:
+            try:
+                ints += [read_chron.next_reader().read_int()]
+            except pychro.NoData:
+                break
+        read_chron.close()
+        return ints
+
+    def test_policies(self):
+        write_chron, _ = self.write(pychro.SyncPerMessage())
+        self.assertEqual(100, write_chron.syncs)
+        write_chron.close()
+
+        write_chron, _ = self.write(pychro.GroupCommit(messages=30))
+        self.assertEqual(3, write_chron.syncs)
+        write_chron.close()
+        self.assertEqual(4, write_chron.syncs)
+
+        write_chron, _ = self.write(pychro.GroupCommit(interval=0))
+        self.assertEqual(100, write_chron.syncs)
+        write_chron.close()
+
+        # the last group is synced once its interval has passed, without a later message
+        for durability in (pychro.GroupCommit(messages=1000, interval=0.2), pychro.PeriodicSync(interval=0.2)):
+            write_chron, _ = self.write(durability)
+            self.assertEqual(0, write_chron.syncs)
+            self.wait_for_syncs(write_chron, 1)
+            time.sleep(0.3)
+            self.assertEqual(1, write_chron.syncs)
+            appender = write_chron.get_appender()
+            appender.write_int(100)
+            appender.finish()
+            self.wait_for_syncs(write_chron, 2)
+            write_chron.close()
+            self.assertFalse(durability._timer.is_alive())
+        self.assertEqual(list(range(100))*3 + (list(range(100)) + [100])*2, self.read())
+
+        with self.assertRaises(pychro.InvalidArgumentError):
+            pychro.GroupCommit()
+
+        # a policy's thread serves one writer at a time
+        durability = pychro.PeriodicSync()
+        write_chron, _ = self.write(durability)
+        self.assertRaises(pychro.InvalidArgumentError, pychro.VanillaChronicleWriter, self.tempdir.path,
+                          durability=durability)
+        write_chron.close()
+        pychro.VanillaChronicleWriter(self.tempdir.path, durability=durability).close()
+
+    def test_sync(self):
+        # without a policy, messages are synced when asked
+        write_chron, _ = self.write(None)
+        self.assertEqual(0, write_chron.syncs)
+        write_chron.sync()
+        self.assertEqual(1, write_chron.syncs)
+        self.assertEqual({}, write_chron._dirty)
+        write_chron.sync()
+        self.assertEqual(1, write_chron.syncs)
+        write_chron.close()
+        self.assertEqual(1, write_chron.syncs)
+        self.assertEqual(list(range(100)), self.read())
+
+    def test_sync_evicted(self):
+        # a mapping evicted under max_mapped_memory is synced through its file
+        config = pychro.VanillaChronicleConfig(data_block_size=128*1024)
+        write_chron = pychro.VanillaChronicleWriter(self.tempdir.path, max_mapped_memory=128*1024, config=config)
+        appender = write_chron.get_appender()
+        for i in range(6):
+            appender.write_bytes(b'x'*(40*1024))
+            appender.finish()
+        self.assertEqual(1, len(write_chron._data_mms))
+        self.assertEqual(3, len(write_chron._dirty))
+        write_chron.sync()
+        self.assertEqual(1, write_chron.syncs)
+        write_chron.close()
+
+    def test_perf_durability(self):
+        n = min(NUM_WORDS, 10000)
+        for durability in (None, pychro.PeriodicSync(), pychro.GroupCommit(messages=100, interval=0.001),
+                           pychro.SyncPerMessage()):
+            write_chron, latencies = self.write(durability, n)
+            write_chron.close()
+            latencies.sort()
+            print('%s %.0f msgs/s p50 %.1fus p99 %.1fus max %.1fus' % (
+                type(durability).__name__, n/sum(latencies), latencies[n//2]*1e6, latencies[n*99//100]*1e6,
+                latencies[-1]*1e6))
+
+
+class TestConfig(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = TempDir()
+
+    def test_small_files(self):
+        config = pychro.VanillaChronicleConfig(data_block_size=128*1024, index_block_size=4096,
+                                               entries_per_cycle=1 << 20)
+        write_chron = pychro.VanillaChronicleWriter(self.tempdir.path, config=config)
+        appender = write_chron.get_appender()
+        for i in range(2000):
+            appender.write_int(i)
+            appender.write_string('x'*100)
+            full_index = appender.finish()
+        self.assertEqual(1999, full_index & (config.entries_per_cycle - 1))
+        files = os.listdir(os.path.join(self.tempdir.path, os.listdir(self.tempdir.path)[0]))
+        self.assertEqual(5, len([f for f in files if f.startswith('index-')]))
+        data_files = [f for f in files if f.startswith('data-')]
+        self.assertEqual(4, len(data_files))
+        self.assertTrue(all(os.path.getsize(os.path.join(write_chron._cycle_dir, f)) == 128*1024 for f in data_files))
+
+        read_chron = pychro.VanillaChronicleReader(self.tempdir.path, config=config)
+        self.assertEqual(list(range(2000)), [read_chron.next_reader().read_int() for _ in range(2000)])
+        self.assertEqual(write_chron.get_index(), read_chron.get_end_index_today() - 1)
+        self.assertEqual(1000, read_chron.read_at(full_index - 999).read_int())
+        read_chron.close()
+        write_chron.close()
+
+    def test_full_index(self):
+        date = datetime.date(2015, 3, 1)
+        for config in (None, pychro.VanillaChronicleConfig(entries_per_cycle=1 << 32)):
+            for index in (0, 1, 1 << 24, (1 << 30) + 7):
+                full_index = pychro.VanillaChronicleReader.to_full_index(date, index, config)
+                self.assertEqual((date, index), pychro.VanillaChronicleReader.from_full_index(full_index, config))
+
+    def test_invalid(self):
+        with self.assertRaises(pychro.ConfigError):
+            pychro.VanillaChronicleConfig(data_block_size=3*1024*1024)
+        with self.assertRaises(pychro.ConfigError):
+            pychro.VanillaChronicleConfig(index_block_size=1024)
+
+    def test_perf_file_sizes(self):
+        n = NUM_WORDS*4
+        for size in (1, 8, 64):
+            config = pychro.VanillaChronicleConfig(data_block_size=size*1024*1024, index_block_size=size*256*1024)
+            base_dir = os.path.join(self.tempdir.path, str(size))
+            write_chron = pychro.VanillaChronicleWriter(base_dir, config=config)
+            appender = write_chron.get_appender()
+            t = time.time()
+            for i in range(n):
+                appender.write_int(i)
+                appender.write_string('x'*100)
+                appender.finish()
+            t = time.time() - t
+            mapped = sum(len(mm) for mm in write_chron._data_mms.values()) + sum(write_chron._index_sizes)
+            disk = sum(os.stat(os.path.join(write_chron._cycle_dir, f)).st_blocks*512
+                       for f in os.listdir(write_chron._cycle_dir))
+            print('%sMB data files: %s rolls, %.1fMB mapped, %.1fMB on disk, %.0f msgs/s' % (
+                size, len(write_chron._data_mms) - 1, mapped/1024/1024, disk/1024/1024, n/t))
+            write_chron.close()
+
+
+class TestCycleLength(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = TempDir()
+
+    def write(self, config, times, n=10):
+        self.now = times[0]
+        write_chron = pychro.VanillaChronicleWriter(self.tempdir.path, utcnow=lambda: self.now, config=config)
+        appender = write_chron.get_appender()
+        for now in times:
+            self.now = now
+            for i in range(n):
+                appender.write_int(now.hour*100 + now.minute)
+                appender.finish()
+        return write_chron
+
+    def test_hourly(self):
+        config = pychro.VanillaChronicleConfig(cycle_length=3600)
+        times = [datetime.datetime(2015, 3, 1, h, 30) for h in (12, 13, 14)]
+        write_chron = self.write(config, times)
+        self.assertEqual(['2015030112', '2015030113', '2015030114'], sorted(os.listdir(self.tempdir.path)))
+
+        read_chron = pychro.VanillaChronicleReader(self.tempdir.path, config=config, utcnow=lambda: self.now)
+        self.assertEqual([1230]*10 + [1330]*10 + [1430]*10, [read_chron.next_reader().read_int() for _ in range(30)])
+        self.assertEqual(datetime.datetime(2015, 3, 1, 14), read_chron.get_date())
+        full_index = read_chron.to_full_index(datetime.datetime(2015, 3, 1, 13, 59), 3, config)
+        self.assertEqual((datetime.datetime(2015, 3, 1, 13), 3), read_chron.from_full_index(full_index, config))
+        self.assertEqual(1330, read_chron.read_at(full_index).read_int())
+
+        read_chron.close()
+        read_chron = pychro.VanillaChronicleReader(self.tempdir.path, config=config, utcnow=lambda: self.now,
+                                                   date=datetime.datetime(2015, 3, 1, 13, 15))
+        self.assertEqual(1330, read_chron.next_reader().read_int())
+        read_chron.close()
+        write_chron.close()
+
+        cycle_dir = os.path.join(self.tempdir.path, '2015030113')
+        with self.assertRaises(pychro.InvalidArgumentError):
+            pychro.archive_cycle(os.path.join(self.tempdir.path, '2015030114'), utcnow=lambda: self.now, config=config)
+        pychro.archive_cycle(cycle_dir, utcnow=lambda: self.now, config=config)
+        read_chron = pychro.VanillaChronicleReader(self.tempdir.path, config=config, utcnow=lambda: self.now)
+        self.assertEqual(30, len([read_chron.next_reader() for _ in range(30)]))
+        read_chron.close()
+
+    def test_minutely_java_format(self):
+        config = pychro.VanillaChronicleConfig(cycle_length=60, cycle_format='yyyy-MM-dd-HHmm',
+                                               entries_per_cycle=1 << 32)
+        times = [datetime.datetime(2015, 3, 1, 23, 59, 30), datetime.datetime(2015, 3, 2, 0, 0, 1)]
+        write_chron = self.write(config, times)
+        self.assertEqual(['2015-03-01-2359', '2015-03-02-0000'], sorted(os.listdir(self.tempdir.path)))
+        indexer = pychro.TimeIndexer(self.tempdir.path, lambda r: r.read_int(), stride=5, config=config)
+        self.assertEqual(4, indexer.update())
+        indexer.close()
+        self.assertEqual(2, len(pychro.time_index_paths(self.tempdir.path, config)))
+        write_chron.close()
+
+    def test_invalid(self):
+        with self.assertRaises(pychro.ConfigError):
+            pychro.VanillaChronicleConfig(cycle_length=7)
+        with self.assertRaises(pychro.ConfigError):
+            pychro.VanillaChronicleConfig(cycle_length=3600, cycle_format='%Y%m%d')
+        with self.assertRaises(pychro.ConfigError):
+            pychro.VanillaChronicleConfig(cycle_length=600)
+        with self.assertRaises(pychro.ConfigError):
+            pychro.VanillaChronicleConfig(cycle_length=60)
+
+
+class TestRetention(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = TempDir()
+        for day in (1, 2, 3, 4):
+            write_chron = pychro.VanillaChronicleWriter(self.tempdir.path,
+                                                        utcnow=lambda: datetime.datetime(2015, 1, day, 12))
+            appender = write_chron.get_appender()
+            for i in range(1000):
+                appender.write_int(day*10000+i)
+                appender.finish()
+            write_chron.close()
+        self.utcnow = lambda: datetime.datetime(2015, 1, 5, 12)
+
+    def cycle_path(self, day):
+        return os.path.join(self.tempdir.path, '2015010%s' % day)
+
+    def read_all(self):
+        read_chron = pychro.VanillaChronicleReader(self.tempdir.path)
+        values = []
+        while True:
+            try:
+                values += [read_chron.next_reader().read_int()]
+            except pychro.NoData:
+                break
+        read_chron.close()
+        return values
+
+    def test_delete(self):
+        open(pychro.time_index_path(self.tempdir.path, datetime.date(2015, 1, 1)), 'wb').close()
+        size = sum(os.path.getsize(os.path.join(self.cycle_path(day), f))
+                   for day in (1, 2) for f in os.listdir(self.cycle_path(day)))
+        manager = pychro.RetentionManager(self.tempdir.path, max_age=datetime.timedelta(days=2), utcnow=self.utcnow)
+        report = manager.update()
+        self.assertEqual([self.cycle_path(1), self.cycle_path(2)], report.deleted)
+        self.assertEqual(size, report.reclaimed)
+        self.assertEqual(['20150103', '20150104'], sorted(os.listdir(self.tempdir.path)))
+        self.assertEqual([30000+i for i in range(1000)] + [40000+i for i in range(1000)], self.read_all())
+        self.assertEqual(0, manager.update().reclaimed)
+        self.assertEqual(size, manager.reclaimed)
+
+    def test_keep_cycles(self):
+        manager = pychro.RetentionManager(self.tempdir.path, keep_cycles=3, utcnow=self.utcnow)
+        self.assertEqual([self.cycle_path(1)], manager.update().deleted)
+        # the current cycle is never removed
+        manager = pychro.RetentionManager(self.tempdir.path, keep_cycles=1,
+                                          utcnow=lambda: datetime.datetime(2015, 1, 3, 12))
+        self.assertEqual([self.cycle_path(2)], manager.update().deleted)
+        self.assertTrue(os.path.isdir(self.cycle_path(3)))
+
+    def test_reader_in_use(self):
+        read_chron = pychro.VanillaChronicleReader(self.tempdir.path)
+        self.assertEqual(10000, read_chron.next_reader().read_int())
+        manager = pychro.RetentionManager(self.tempdir.path, keep_cycles=2, utcnow=self.utcnow)
+        report = manager.update()
+        self.assertEqual([self.cycle_path(1)], report.in_use)
+        self.assertEqual([self.cycle_path(2)], report.deleted)
+        self.assertEqual(10001, read_chron.next_reader().read_int())
+        read_chron.close()
+        self.assertEqual([self.cycle_path(1)], manager.update().deleted)
+
+    def test_pool_in_use(self):
+        pool = pychro.ChroniclePool(self.tempdir.path)
+        cursor = pool.cursor()
+        self.assertEqual(10000, cursor.next_reader().read_int())
+        manager = pychro.RetentionManager(self.tempdir.path, keep_cycles=3, utcnow=self.utcnow)
+        self.assertEqual([self.cycle_path(1)], manager.update().in_use)
+        cursor.close()
+        self.assertEqual([self.cycle_path(1)], manager.update().deleted)
+
+    def test_checkpoints(self):
+        store = pychro.CheckpointStore(self.tempdir.path)
+        store.consumer('slow').commit(pychro.VanillaChronicleReader.to_full_index(datetime.date(2015, 1, 2), 5))
+        store.consumer('fast').commit(pychro.VanillaChronicleReader.to_full_index(datetime.date(2015, 1, 4), 5))
+        store.close()
+        manager = pychro.RetentionManager(self.tempdir.path, keep_cycles=1, utcnow=self.utcnow)
+        report = manager.update()
+        self.assertEqual([self.cycle_path(1)], report.deleted)
+        self.assertEqual([self.cycle_path(2), self.cycle_path(3)], report.unconsumed)
+        manager = pychro.RetentionManager(self.tempdir.path, keep_cycles=1, respect_checkpoints=False,
+                                          utcnow=self.utcnow)
+        self.assertEqual([self.cycle_path(2), self.cycle_path(3)], manager.update().deleted)
+
+    def test_archive(self):
+        manager = pychro.RetentionManager(self.tempdir.path, keep_cycles=2, action='archive', utcnow=self.utcnow)
+        report = manager.update()
+        self.assertEqual([self.cycle_path(1), self.cycle_path(2)], report.archived)
+        self.assertGreater(report.reclaimed, 0)
+        self.assertTrue(os.path.isfile(self.cycle_path(1) + pychro.ARCHIVE_SUFFIX))
+        self.assertEqual([day*10000+i for day in (1, 2, 3, 4) for i in range(1000)], self.read_all())
+        self.assertEqual(0, manager.update().reclaimed)
+        # deleting removes the archives too
+        manager = pychro.RetentionManager(self.tempdir.path, keep_cycles=3, utcnow=self.utcnow)
+        self.assertEqual([self.cycle_path(1) + pychro.ARCHIVE_SUFFIX], manager.update().deleted)
+
+    @unittest.skipIf(pychro.PLATFORM_WINDOWS, 'flock')
+    def test_archive_in_use(self):
+        archive_path = pychro.archive_cycle(self.cycle_path(1))
+        read_chron = pychro.VanillaChronicleReader(self.tempdir.path)
+        self.assertEqual(10000, read_chron.next_reader().read_int())
+        manager = pychro.RetentionManager(self.tempdir.path, keep_cycles=3, utcnow=self.utcnow)
+        self.assertEqual([archive_path], manager.update().in_use)
+        self.assertEqual(10001, read_chron.next_reader().read_int())
+        read_chron.close()
+        self.assertEqual([archive_path], manager.update().deleted)
+
+    @unittest.skipIf(pychro.PLATFORM_WINDOWS, 'flock')
+    def test_warm_up_in_use(self):
+        if not pychro.HAVE_MAPPING_CONTROL:
+            self.skipTest('mapping control')
+        manager = pychro.RetentionManager(self.tempdir.path, keep_cycles=3, utcnow=self.utcnow)
+        in_use = []
+
+        # a pass of the manager while the cycle is being read
+        def prefault(mh, size, _prefault=pychro.warmup.prefault_mmap):
+            in_use.extend(manager.update().in_use)
+            return _prefault(mh, size)
+        pychro.warmup.prefault_mmap = prefault
+        try:
+            report = pychro.warm_up_cycle(self.cycle_path(1), pychro.WarmUpReport())
+        finally:
+            pychro.warmup.prefault_mmap = prefault.__defaults__[0]
+        self.assertEqual([self.cycle_path(1)], sorted(set(in_use)))
+        self.assertEqual(3, len(report.files))
+        self.assertEqual([self.cycle_path(1)], manager.update().deleted)
+        self.assertEqual([self.cycle_path(1)], pychro.warm_up_cycle(self.cycle_path(1), pychro.WarmUpReport()).skipped)
+
+    def test_compact(self):
+        manager = pychro.RetentionManager(self.tempdir.path, keep_cycles=2, action='compact', utcnow=self.utcnow)
+        report = manager.update()
+        self.assertEqual([self.cycle_path(1), self.cycle_path(2)], report.compacted)
+        self.assertGreater(report.reclaimed, 0)
+        self.assertEqual([day*10000+i for day in (1, 2, 3, 4) for i in range(1000)], self.read_all())
+        self.assertEqual([], manager.update().compacted)
+
+    def test_compact_thread_id_bits(self):
+        # the data files of writers with other than the default bits are cut at their last message
+        tempdir = TempDir()
+        write_chron = pychro.VanillaChronicleWriter(tempdir.path, thread_id_bits=16,
+                                                    utcnow=lambda: datetime.datetime(2015, 1, 1, 12))
+        appender = write_chron.get_appender()
+        for i in range(1000):
+            appender.write_int(i)
+            appender.finish()
+        write_chron.close()
+        manager = pychro.RetentionManager(tempdir.path, keep_cycles=0, action='compact', thread_id_bits=16,
+                                          utcnow=self.utcnow)
+        self.assertEqual([os.path.join(tempdir.path, '20150101')], manager.update().compacted)
+        data_file, = [f for f in os.listdir(os.path.join(tempdir.path, '20150101')) if f.startswith('data-')]
+        self.assertEqual(-(-(4 + 8*1000 - 4)//mmap.PAGESIZE)*mmap.PAGESIZE,
+                         os.path.getsize(os.path.join(tempdir.path, '20150101', data_file)))
+
+    def test_thread(self):
+        manager = pychro.RetentionManager(self.tempdir.path, keep_cycles=1, interval=0.01, utcnow=self.utcnow)
+        manager.start()
+        for _ in range(500):
+            if not os.path.isdir(self.cycle_path(3)):
+                break
+            time.sleep(0.01)
+        manager.stop()
+        manager.join()
+        self.assertEqual(['20150104'], os.listdir(self.tempdir.path))
+        self.assertGreater(manager.reclaimed, 0)
+
+    def test_invalid(self):
+        self.assertRaises(pychro.InvalidArgumentError, pychro.RetentionManager, self.tempdir.path)
+        self.assertRaises(pychro.InvalidArgumentError, pychro.RetentionManager, self.tempdir.path, keep_cycles=1,
+                          action='shred')
+
+
+def group_crash(path, utcnow):
+    group = pychro.ConsumerGroup(path, 'group', claim_size=10, utcnow=utcnow)
+    worker = group.worker()
+    for _ in range(3):
+        worker.next_reader()
+    os._exit(0)
+
+
+def group_crash_claiming(path, utcnow):
+    # exits between recording a claim and making it
+    group = pychro.ConsumerGroup(path, 'group', claim_size=10, utcnow=utcnow)
+    worker = group.worker()
+    group._lock(worker._token)
+    start = pychro.VanillaChronicleReader.to_full_index(datetime.date(2015, 1, 1), 0)
+    group._write(24, start)
+    group._write(worker._slot + 24, start)
+    os._exit(0)
+
+
+def group_work(path, name, counts):
+    group = pychro.ConsumerGroup(path, name, utcnow=lambda: datetime.datetime(2015, 1, 3))
+    worker = group.worker()
+    count = 0
+    while True:
+        try:
+            reader = worker.next_reader()
+        except pychro.NoData:
+            break
+        # decoding and handling the message
+        value = reader.read_int()
+        for i in range(200):
+            value = (value*31 + i) & 0xffffffff
+        count += 1
+    worker.close()
+    group.close()
+    counts.put(count)
+
+
+class TestConsumerGroup(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = TempDir()
+        self.num_msgs = 1000
+        for day in (1, 2):
+            self.write(day, self.num_msgs)
+        self.utcnow = lambda: datetime.datetime(2015, 1, 3)
+        self.group = pychro.ConsumerGroup(self.tempdir.path, 'group', claim_size=10, utcnow=self.utcnow)
+
+    def tearDown(self):
+        self.group.close()
+
+    def write(self, day, num_msgs):
+        write_chron = pychro.VanillaChronicleWriter(self.tempdir.path,
+                                                    utcnow=lambda: datetime.datetime(2015, 1, day, 12))
+        appender = write_chron.get_appender()
+        for i in range(num_msgs):
+            appender.write_int(day*10000+i)
+            appender.finish()
+        write_chron.close()
+
+    def all_msgs(self):
+        return [day*10000+i for day in (1, 2) for i in range(self.num_msgs)]
+
+    def drain(self, workers):
+        values = []
+        idle = False
+        while not idle:
+            idle = True
+            for worker in workers:
+                try:
+                    values += [worker.next_reader().read_int()]
+                    idle = False
+                except pychro.NoData:
+                    pass
+        return values
+
+    def test_workers(self):
+        workers = [self.group.worker() for _ in range(3)]
+        values = self.drain(workers)
+        self.assertEqual(self.all_msgs(), sorted(values))
+        self.assertEqual(list(range(10000, 10010)), [v for v in values if 10000 <= v < 10010])
+        self.assertEqual(list(range(10010, 10020)), values[1::3][:10])
+        self.assertEqual([], self.group.claims())
+        [w.close() for w in workers]
+
+    def test_tailing(self):
+        worker = self.group.worker()
+        self.assertEqual(self.all_msgs(), self.drain([worker]))
+        group = pychro.ConsumerGroup(self.tempdir.path, 'group', utcnow=lambda: datetime.datetime(2015, 1, 3, 12))
+        other = group.worker()
+        self.assertRaises(pychro.NoData, other.next_reader)
+        self.write(3, 5)
+        self.assertEqual([30000+i for i in range(5)], self.drain([other, worker]))
+        # the claim of the 5 messages is held until the rest are written
+        self.assertEqual(1, len(group.claims()))
+        other.close()
+        worker.close()
+        group.close()
+
+    def test_groups(self):
+        other = pychro.ConsumerGroup(self.tempdir.path, 'other', utcnow=self.utcnow)
+        self.assertEqual(self.all_msgs(), self.drain([self.group.worker()]))
+        self.assertEqual(self.all_msgs(), self.drain([other.worker()]))
+        other.close()
+
+    @unittest.skipIf(pychro.PLATFORM_WINDOWS, 'fork')
+    def test_crashed_worker(self):
+        process = multiprocessing.get_context('fork').Process(target=group_crash,
+                                                              args=(self.tempdir.path, self.utcnow))
+        process.start()
+        process.join()
+        self.assertEqual(1, len(self.group.claims()))
+        worker = self.group.worker()
+        values = self.drain([worker])
+        self.assertEqual(1, worker.recovered)
+        # the message in hand is delivered again
+        self.assertEqual([10002, 10003], values[:2])
+        self.assertEqual(self.all_msgs()[2:], sorted(values))
+        worker.close()
+
+    @unittest.skipIf(pychro.PLATFORM_WINDOWS, 'fork')
+    def test_crashed_claiming(self):
+        process = multiprocessing.get_context('fork').Process(target=group_crash_claiming,
+                                                              args=(self.tempdir.path, self.utcnow))
+        process.start()
+        process.join()
+        group = pychro.ConsumerGroup(self.tempdir.path, 'group', claim_timeout=0.2, utcnow=self.utcnow)
+        self.assertEqual(1, len(group.claims()))
+        workers = [group.worker() for _ in range(2)]
+        # claiming before looking for dead workers
+        for worker in workers:
+            worker._last_recover = time.time()
+        values = self.drain(workers)
+        time.sleep(0.1)
+        values += self.drain(workers)
+        # the claim was never made, so is not taken over
+        self.assertEqual(0, sum(worker.recovered for worker in workers))
+        self.assertEqual(self.all_msgs(), sorted(values))
+        self.assertEqual([], group.claims())
+        [w.close() for w in workers]
+        group.close()
+
+    def test_timed_out_worker(self):
+        group = pychro.ConsumerGroup(self.tempdir.path, 'group', claim_timeout=0.05, utcnow=self.utcnow)
+        stalled, worker = group.worker(), group.worker()
+        self.assertEqual(10000, stalled.next_reader().read_int())
+        time.sleep(0.1)
+        self.assertEqual(10000, worker.next_reader().read_int())
+        self.assertEqual(1, worker.recovered)
+        values = self.drain([stalled, worker])
+        self.assertEqual(self.all_msgs()[1:], sorted(values))
+        stalled.close()
+        worker.close()
+        group.close()
+
+    def test_closed_worker(self):
+        worker = self.group.worker()
+        self.assertEqual([10000, 10001], [worker.next_reader().read_int() for _ in range(2)])
+        worker.close()
+        other = self.group.worker()
+        self.assertEqual(self.all_msgs()[2:], self.drain([other]))
+        other.close()
+
+    def test_no_slots(self):
+        group = pychro.ConsumerGroup(self.tempdir.path, 'small', slots=1)
+        worker = group.worker()
+        self.assertRaises(pychro.NoSpace, group.worker)
+        worker.close()
+        group.worker().close()
+        group.close()
+
+    @unittest.skipIf(pychro.PLATFORM_WINDOWS, 'fork')
+    def test_perf_workers(self):
+        self.num_msgs = max(NUM_WORDS, 10000)//2
+        shutil.rmtree(self.tempdir.path)
+        os.makedirs(self.tempdir.path)
+        for day in (1, 2):
+            self.write(day, self.num_msgs)
+        context = multiprocessing.get_context('fork')
+        rate_1 = None
+        for num_workers in (1, 2, 4):
+            counts = context.Queue()
+            processes = [context.Process(target=group_work, args=(self.tempdir.path, 'perf%s' % num_workers, counts))
+                         for _ in range(num_workers)]
+            start = time.time()
+            [p.start() for p in processes]
+            total = sum(counts.get() for _ in processes)
+            [p.join() for p in processes]
+            elapsed = time.time() - start
+            self.assertEqual(2*self.num_msgs, total)
+            rate_1 = rate_1 or total/elapsed
+            print('%s workers %.0f msgs/s x%.2f' % (num_workers, total/elapsed, total/elapsed/rate_1))
+
+
+def decode_int(reader):
+    value = reader.read_int()
+    if value < 0:
+        raise ValueError('negative %s' % value)
+    return value
+
+
+def decode_heavy(reader):
+    value = reader.read_int()
+    for i in range(2000):
+        value = (value*31 + i) & 0xffffffff
+    return value
+
+
+class TestDecodePipeline(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = TempDir()
+        for day in (1, 2):
+            self.write(day, range(day*10000, day*10000+1000))
+
+    def write(self, day, values):
+        write_chron = pychro.VanillaChronicleWriter(self.tempdir.path,
+                                                    utcnow=lambda: datetime.datetime(2015, 1, day, 12))
+        appender = write_chron.get_appender()
+        for value in values:
+            appender.write_int(value)
+            appender.finish()
+        write_chron.close()
+
+    def check(self, processes):
+        pipeline = pychro.DecodePipeline(self.tempdir.path, decode_int, workers=3, processes=processes,
+                                         batch_size=7, window=4)
+        results = [pipeline.next_result(timeout=10) for _ in range(2000)]
+        self.assertEqual([day*10000+i for day in (1, 2) for i in range(1000)], [r for _, r in results])
+        self.assertEqual(pychro.VanillaChronicleReader.to_full_index(datetime.date(2015, 1, 2), 999), results[-1][0])
+        self.assertRaises(pychro.NoData, pipeline.next_result, 0.05)
+        # tailing
+        self.write(2, [5, 6])
+        self.assertEqual([5, 6], [pipeline.next_result(timeout=10)[1] for _ in range(2)])
+        pipeline.close()
+
+    def test_threads(self):
+        self.check(False)
+
+    def test_cycles_in_flight(self):
+        # the cycles of batches not yet handed back are held, but the walker's own
+        pipeline = pychro.DecodePipeline(self.tempdir.path, decode_int, workers=1, processes=False,
+                                         batch_size=100, window=30)
+        deadline = time.time() + 10
+        while pipeline._walker.is_alive() and pipeline._tasks.qsize() + pipeline._results.qsize() < 20 and \
+                time.time() < deadline:
+            time.sleep(0.01)
+        dates = [datetime.date(2015, 1, day) for day in (1, 2)]
+        self.assertEqual(dates, [date for date, _, _ in pipeline._cycle_locks])
+        for _ in range(1000):
+            pipeline.next_result(timeout=10)
+        self.assertEqual(dates[1:], [date for date, _, _ in pipeline._cycle_locks])
+        pipeline.close()
+        self.assertEqual([], pipeline._cycle_locks)
+
+    @unittest.skipIf(pychro.PLATFORM_WINDOWS, 'fork')
+    def test_processes(self):
+        self.check(True)
+
+    def test_full_index(self):
+        full_index = pychro.VanillaChronicleReader.to_full_index(datetime.date(2015, 1, 2), 998)
+        pipeline = pychro.DecodePipeline(self.tempdir.path, decode_int, processes=False, full_index=full_index)
+        self.assertEqual([(full_index, 20998), (full_index+1, 20999)], [pipeline.next_result(10) for _ in range(2)])
+        pipeline.close()
+
+    def test_decoder_error(self):
+        self.write(2, [-1, 7])
+        pipeline = pychro.DecodePipeline(self.tempdir.path, decode_int, processes=False, batch_size=1000)
+        self.assertEqual(1000, len([pipeline.next_result(10) for _ in range(1000)]))
+        self.assertEqual(1000, len([pipeline.next_result(10) for _ in range(1000)]))
+        self.assertRaises(ValueError, pipeline.next_result, 10)
+        pipeline.close()
+
+    def test_window(self):
+        pipeline = pychro.DecodePipeline(self.tempdir.path, decode_int, processes=False, batch_size=10, window=3)
+        time.sleep(0.1)
+        # the walker waits for the consumer
+        self.assertEqual(0, pipeline.batches)
+        self.assertEqual(3, pipeline._results.qsize())
+        pipeline.next_result(10)
+        time.sleep(0.1)
+        self.assertEqual(3, pipeline._results.qsize() + len(pipeline._reorder))
+        pipeline.close()
+
+    @unittest.skipIf(pychro.PLATFORM_WINDOWS, 'fork')
+    def test_perf_pipeline(self):
+        n = 2000
+        read_chron = pychro.VanillaChronicleReader(self.tempdir.path)
+        start = time.time()
+        expected = [decode_heavy(read_chron.next_reader()) for _ in range(n)]
+        print('serial %.0f msgs/s' % (n/(time.time() - start)))
+        read_chron.close()
+        for workers in (1, 2, 4):
+            pipeline = pychro.DecodePipeline(self.tempdir.path, decode_heavy, workers=workers)
+            start = time.time()
+            results = [pipeline.next_result(timeout=60)[1] for _ in range(n)]
+            print('%s workers %.0f msgs/s' % (workers, n/(time.time() - start)))
+            pipeline.close()
+            self.assertEqual(expected, results)
+
+
+class TestLag(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = TempDir()
+        for day in (1, 2):
+            write_chron = pychro.VanillaChronicleWriter(self.tempdir.path,
+                                                        utcnow=lambda: datetime.datetime(2015, 1, day, 12))
+            appender = write_chron.get_appender()
+            for i in range(1000):
+                appender.write_int(i)
+                appender.write_string('x'*(i % 10))
+                appender.finish()
+            write_chron.close()
+        # int, stop bit length and string
+        self.msg_bytes = [4 + 1 + i % 10 for i in range(1000)]
+
+    def full_index(self, day, index):
+        return pychro.VanillaChronicleReader.to_full_index(datetime.date(2015, 1, day), index)
+
+    def test_reader_lag(self):
+        read_chron = pychro.VanillaChronicleReader(self.tempdir.path)
+        self.assertEqual(pychro.Lag(2000, 2*sum(self.msg_bytes)), read_chron.get_lag())
+        for _ in range(1500):
+            read_chron.next_reader()
+        self.assertEqual(pychro.Lag(500, sum(self.msg_bytes[500:])), read_chron.get_lag())
+        read_chron.set_end()
+        self.assertEqual(pychro.Lag(0, 0), read_chron.get_lag())
+        read_chron.close()
+        self.assertEqual(pychro.Lag(), pychro.VanillaChronicleReader(tempfile.mkdtemp()).get_lag())
+
+    def test_estimated(self):
+        read_chron = pychro.VanillaChronicleReader(self.tempdir.path, max_random_access_cycles=0)
+        lag = read_chron.get_lag(max_scan=10)
+        self.assertEqual(2000, lag.messages)
+        self.assertFalse(lag.exact)
+        self.assertEqual(2*sum(self.msg_bytes[:10])*100, lag.bytes)
+        read_chron.close()
+
+    def test_monitor(self):
+        monitor = pychro.LagMonitor(self.tempdir.path)
+        self.assertEqual(dict(), monitor.update())
+        store = pychro.CheckpointStore(self.tempdir.path)
+        store.consumer('a').commit(self.full_index(1, 900))
+        store.consumer('b').commit(self.full_index(2, 1000))
+        samples = []
+        monitor = pychro.LagMonitor(self.tempdir.path, callback=samples.append)
+        self.assertEqual({'a': pychro.Lag(1100, sum(self.msg_bytes[900:]) + sum(self.msg_bytes)),
+                          'b': pychro.Lag(0, 0)}, monitor.update())
+        self.assertEqual([monitor.samples], samples)
+        self.assertIn('pychro_consumer_lag_messages{consumer="a"} 1100', monitor.metrics())
+        monitor.close()
+        store.close()
+
+    def test_monitor_corrupt(self):
+        # a consumer whose lag cannot be measured does not stop the others being sampled
+        read_chron = pychro.VanillaChronicleReader(self.tempdir.path)
+        filenum, pos, thread = read_chron._decode_index_value(read_chron._get_index_value(950))
+        read_chron.close()
+        with open(os.path.join(self.tempdir.path, '20150101', 'data-%s-%s' % (thread, filenum)), 'r+b') as fh:
+            fh.seek(pos - 4)
+            fh.write(struct.pack('i', 0))
+        store = pychro.CheckpointStore(self.tempdir.path)
+        store.consumer('a').commit(self.full_index(1, 900))
+        store.consumer('b').commit(self.full_index(2, 990))
+        monitor = pychro.LagMonitor(self.tempdir.path, interval=0.01)
+        monitor.start()
+        time.sleep(0.05)
+        self.assertTrue(monitor.is_alive())
+        self.assertEqual({'a': None, 'b': pychro.Lag(10, sum(self.msg_bytes[990:]))}, monitor.samples)
+        self.assertIn('pychro_consumer_lag_messages{consumer="a"} NaN', monitor.metrics())
+        store.consumer('a').commit(self.full_index(2, 0))
+        time.sleep(0.05)
+        self.assertEqual(pychro.Lag(1000, sum(self.msg_bytes)), monitor.samples['a'])
+        monitor.stop()
+        monitor.join()
+        monitor.close()
+        store.close()
+
+    def test_monitor_removed(self):
+        # a position in a cycle removed by retention is not measured from the next cycle
+        store = pychro.CheckpointStore(self.tempdir.path)
+        store.consumer('a').commit(self.full_index(1, 900))
+        store.consumer('b').commit(self.full_index(2, 990))
+        shutil.rmtree(os.path.join(self.tempdir.path, '20150101'))
+        monitor = pychro.LagMonitor(self.tempdir.path)
+        self.assertEqual({'a': None, 'b': pychro.Lag(10, sum(self.msg_bytes[990:]))}, monitor.update())
+        monitor.close()
+        store.close()
+
+    def test_monitor_thread(self):
+        store = pychro.CheckpointStore(self.tempdir.path)
+        consumer = store.consumer('a')
+        consumer.commit(self.full_index(2, 0))
+        monitor = pychro.LagMonitor(self.tempdir.path, interval=0.01)
+        monitor.start()
+        time.sleep(0.05)
+        self.assertEqual(1000, monitor.samples['a'].messages)
+        consumer.commit(self.full_index(2, 990))
+        time.sleep(0.05)
+        monitor.stop()
+        monitor.join()
+        self.assertEqual(10, monitor.samples['a'].messages)
+        monitor.close()
+        store.close()
+
+    def test_perf_lag(self):
+        read_chron = pychro.VanillaChronicleReader(self.tempdir.path)
+        n = 1000
+        start = time.time()
+        for _ in range(n):
+            read_chron.get_lag(max_scan=64)
+        print('get_lag %.1fus' % ((time.time() - start)/n*1e6))
+        read_chron.close()
+
+
+class TestReplay(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = TempDir()
+        write_chron = pychro.VanillaChronicleWriter(self.tempdir.path, utcnow=lambda: datetime.datetime(2015, 1, 1, 12))
+        appender = write_chron.get_appender()
+        # a timestamp in ms every 10ms
+        for i in range(50):
+            appender.write_long(1420113600000 + i*10)
+            appender.write_int(i)
+            appender.finish()
+        write_chron.close()
+
+    def test_max_speed(self):
+        values = []
+        replayer = pychro.Replayer(self.tempdir.path, lambda reader: values.append(reader.read_long()))
+        stats = replayer.replay()
+        self.assertEqual([1420113600000 + i*10 for i in range(50)], values)
+        self.assertEqual(50, stats.messages)
+        self.assertEqual(0, stats.paced)
+        self.assertGreater(stats.rate(), 0)
+
+    def test_range(self):
+        values = []
+
+        def handler(reader):
+            reader.advance(8)
+            values.append(reader.read_int())
+        full_index = pychro.VanillaChronicleReader.to_full_index(datetime.date(2015, 1, 1), 10)
+        replayer = pychro.Replayer(self.tempdir.path, handler, full_index=full_index, end_index=full_index+5)
+        self.assertEqual(5, replayer.replay().messages)
+        self.assertEqual([10, 11, 12, 13, 14], values)
+
+    def test_paced(self):
+        times = []
+
+        def handler(reader):
+            reader.read_long()
+            times.append((time.perf_counter(), reader.read_int()))
+        replayer = pychro.Replayer(self.tempdir.path, handler, timestamp=lambda reader: reader.read_long(), speed=5,
+                                   ticks_per_second=1000)
+        stats = replayer.replay()
+        self.assertEqual(list(range(50)), [i for _, i in times])
+        self.assertEqual(50, stats.paced)
+        # 490ms of messages at 5x
+        self.assertAlmostEqual(0.098, times[-1][0] - times[0][0], delta=0.02)
+        self.assertLess(stats.mean_error(), 0.005)
+
+    def test_thread(self):
+        values = []
+        replayer = pychro.Replayer(self.tempdir.path, lambda reader: values.append(reader.read_long()),
+                                   timestamp=lambda reader: reader.read_long(), speed=0.1, ticks_per_second=1000)
+        replayer.start()
+        time.sleep(0.15)
+        replayer.stop()
+        replayer.join()
+        self.assertLess(len(values), 50)
+        self.assertEqual(len(values), replayer.stats.messages)
+
+    def test_invalid(self):
+        self.assertRaises(pychro.InvalidArgumentError, pychro.Replayer, self.tempdir.path, print, speed=2)
+        self.assertRaises(pychro.InvalidArgumentError, pychro.Replayer, self.tempdir.path, print,
+                          timestamp=lambda reader: 0, speed=0)
+
+    def test_perf_replay(self):
+        tempdir = TempDir()
+        write_chron = pychro.VanillaChronicleWriter(tempdir.path)
+        appender = write_chron.get_appender()
+        n = max(NUM_WORDS, 10000)
+        for i in range(n):
+            appender.write_long(i*100)
+            appender.finish()
+        write_chron.close()
+        stats = pychro.Replayer(tempdir.path, lambda reader: None).replay()
+        print('max speed %s' % stats)
+        # 100us apart at 10x
+        stats = pychro.Replayer(tempdir.path, lambda reader: None, timestamp=lambda reader: reader.read_long(),
+                                speed=10, ticks_per_second=1000000).replay()
+        print('paced %s' % stats)
+
+
+class TestBulkFields(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = TempDir()
+        self.write_chron = pychro.VanillaChronicleWriter(self.tempdir.path)
+        self.appender = self.write_chron.get_appender()
+
+    def tearDown(self):
+        self.write_chron.close()
+
+    def reader(self):
+        read_chron = pychro.VanillaChronicleReader(self.tempdir.path)
+        self.addCleanup(read_chron.close)
+        return read_chron
+
+    def test_bytes(self):
+        self.appender.write_bytes(b'abc')
+        self.appender.write_bytes(bytearray(200))
+        self.appender.write_bytes(memoryview(array.array('i', [1, 2])))
+        self.appender.write_int(7)
+        self.appender.finish()
+        reader = self.reader().next_reader()
+        view = reader.read_bytes()
+        self.assertIsInstance(view, memoryview)
+        self.assertEqual(b'abc', view)
+        self.assertEqual(bytes(200), reader.read_bytes())
+        self.assertEqual(struct.pack('ii', 1, 2), reader.read_bytes())
+        self.assertEqual(7, reader.read_int())
+
+    def test_array(self):
+        self.appender.write_array(array.array('d', [1.5, 2.5, 3.5]))
+        self.appender.write_array([1, -2, 3], 'q')
+        self.appender.write_array(memoryview(array.array('i', range(10)))[::3])
+        self.appender.write_array([], 'd')
+        self.appender.finish()
+        reader = self.reader().next_reader()
+        self.assertEqual([1.5, 2.5, 3.5], reader.read_array('d').tolist())
+        self.assertEqual([1, -2, 3], reader.read_array('q').tolist())
+        self.assertEqual([0, 3, 6, 9], reader.read_array('i').tolist())
+        self.assertEqual([], reader.read_array('d').tolist())
+        self.assertRaises(pychro.InvalidArgumentError, self.appender.write_array, [1, 2])
+
+    def test_zero_copy(self):
+        self.appender.write_bytes(b'\x00'*8)
+        self.appender.finish()
+        read_chron = self.reader()
+        view = read_chron.next_reader().read_array('q')
+        self.assertEqual(0, view[0])
+        # the view is of the mapping, so sees writes to it
+        mm = self.write_chron._get_data_memory_map(0, self.appender._tid)
+        offset = bytes(mm).index(b'\x08') + 1
+        mm[offset:offset+8] = struct.pack('q', 42)
+        self.assertEqual(42, view[0])
+        # the mapping is closed once the view is released
+        read_chron.close()
+        self.assertEqual(42, view[0])
+        view.release()
+
+    def test_archived(self):
+        self.write_chron.close()
+        write_chron = pychro.VanillaChronicleWriter(self.tempdir.path,
+                                                    utcnow=lambda: datetime.datetime(2015, 1, 1, 12))
+        appender = write_chron.get_appender()
+        appender.write_array([1.0, 2.0], 'd')
+        appender.finish()
+        write_chron.close()
+        pychro.archive_cycle(os.path.join(self.tempdir.path, '20150101'))
+        read_chron = pychro.VanillaChronicleReader(self.tempdir.path, date=datetime.date(2015, 1, 1))
+        self.assertEqual([1.0, 2.0], read_chron.next_reader().read_array('d').tolist())
+        read_chron.close()
+
+    @unittest.skipIf(pychro.vanilla_reader.numpy is None, 'NumPy is not installed')
+    def test_ndarray(self):
+        import numpy
+        self.appender.write_array(numpy.arange(6, dtype='float64').reshape(2, 3))
+        self.appender.write_array(numpy.arange(10, dtype='int32')[::2])
+        self.appender.finish()
+        reader = self.reader().next_reader()
+        self.assertEqual(list(range(6)), reader.read_ndarray('float64').tolist())
+        self.assertEqual([0, 2, 4, 6, 8], reader.read_ndarray('int32').tolist())
+
+    @unittest.skipIf(pychro.vanilla_reader.numpy is not None, 'NumPy is installed')
+    def test_no_numpy(self):
+        self.appender.write_array([1.0], 'd')
+        self.appender.finish()
+        self.assertRaises(pychro.ConfigError, self.reader().next_reader().read_ndarray, 'float64')
+
+    def test_perf_bulk(self):
+        n = 1000
+        levels = array.array('d', range(100))
+        start = time.time()
+        for _ in range(n):
+            for level in levels:
+                self.appender.write_double(level)
+            self.appender.finish()
+        per_element = (time.time() - start)/n
+        start = time.time()
+        for _ in range(n):
+            self.appender.write_array(levels)
+            self.appender.finish()
+        bulk = (time.time() - start)/n
+        print('100 doubles per message: write_double %.1fus write_array %.1fus' % (per_element*1e6, bulk*1e6))
+        read_chron = self.reader()
+        start = time.time()
+        for _ in range(n):
+            reader = read_chron.next_reader()
+            [reader.read_double() for _ in range(100)]
+        per_element = (time.time() - start)/n
+        start = time.time()
+        for _ in range(n):
+            read_chron.next_reader().read_array('d')
+        bulk = (time.time() - start)/n
+        print('100 doubles per message: read_double %.1fus read_array %.1fus' % (per_element*1e6, bulk*1e6))
+
+
+class TestCheck(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = TempDir()
+        for day in (1, 2):
+            write_chron = pychro.VanillaChronicleWriter(self.tempdir.path,
+                                                        utcnow=lambda: datetime.datetime(2015, 1, day, 12))
+            appender = write_chron.get_appender()
+            for i in range(1000):
+                appender.write_int(i)
+                appender.finish()
+            write_chron.close()
+        self.tid = appender._tid
+
+    def path(self, day, name):
+        return os.path.join(self.tempdir.path, '2015010%s' % day, name)
+
+    def full_index(self, day, index):
+        return pychro.VanillaChronicleReader.to_full_index(datetime.date(2015, 1, day), index)
+
+    def index_value(self, day, index):
+        with open(self.path(day, 'index-0'), 'rb') as fh:
+            fh.seek(index*8)
+            return struct.unpack('q', fh.read(8))[0]
+
+    def write_index_value(self, day, index, val):
+        with open(self.path(day, 'index-0'), 'r+b') as fh:
+            fh.seek(index*8)
+            fh.write(struct.pack('q', val))
+
+    def test_ok(self):
+        report = pychro.check_chronicle(self.tempdir.path, workers=1)
+        self.assertTrue(report.ok())
+        self.assertEqual(2, report.cycles)
+        self.assertEqual(2000, report.messages)
+        self.assertEqual({self.tid: 2000}, report.threads)
+
+    def test_anomalies(self):
+        pos_mask = (1 << pychro.DEFAULT_CONFIG.filenum_from_pos_shift) - 1
+        os.remove(self.path(1, 'data-%s-0' % self.tid))
+        # an index gap, a message without its length and an offset beyond the file
+        self.write_index_value(2, 10, 0)
+        self.write_index_value(2, 11, 0)
+        val = self.index_value(2, 20)
+        with open(self.path(2, 'data-%s-0' % self.tid), 'r+b') as fh:
+            fh.seek((val & pos_mask) - 4)
+            fh.write(b'\x00'*4)
+        self.write_index_value(2, 30, self.index_value(2, 30) | (pychro.DEFAULT_CONFIG.data_block_size - 4))
+        os.truncate(self.path(2, 'data-%s-0' % self.tid), pychro.DEFAULT_CONFIG.data_block_size//2)
+        report = pychro.check_chronicle(self.tempdir.path, workers=2, chunk_entries=16)
+        self.assertFalse(report.ok())
+        self.assertEqual(1998, report.messages)
+        anomalies = [(full_index, kind) for full_index, kind, _ in report.anomalies]
+        self.assertEqual([(self.full_index(1, i), 'missing data file') for i in range(1000)], anomalies[:1000])
+        self.assertEqual([(self.full_index(2, 10), 'index gap'), (self.full_index(2, 20), 'no length'),
+                          (self.full_index(2, 30), 'offset beyond file')], anomalies[1000:])
+        self.assertEqual('2 unwritten entries', report.anomalies[1000][2])
+
+    def test_lengths(self):
+        # lengths which do not lead to the next message, within a chunk and across chunks
+        pos_mask = (1 << pychro.DEFAULT_CONFIG.filenum_from_pos_shift) - 1
+        with open(self.path(2, 'data-%s-0' % self.tid), 'r+b') as fh:
+            for index in (20, 31):
+                fh.seek((self.index_value(2, index) & pos_mask) - 4)
+                fh.write(struct.pack('i', ~8))
+        for chunk_entries in (16, 1024):
+            report = pychro.check_chronicle(self.tempdir.path, workers=1, chunk_entries=chunk_entries)
+            self.assertEqual([(self.full_index(2, 20), 'length mismatch'), (self.full_index(2, 31), 'length mismatch')],
+                             [(full_index, kind) for full_index, kind, _ in report.anomalies])
+
+    def test_unframed(self):
+        # data files of earlier pychro appenders have no lengths to check, whatever their messages end in
+        write_unframed_cycle(self.tempdir.path, datetime.date(2015, 1, 3),
+                             [(1 + i % 2, struct.pack('ii', -i-1, -7)) for i in range(10)])
+        report = pychro.check_chronicle(self.tempdir.path, workers=1, chunk_entries=4)
+        self.assertTrue(report.ok(), report.anomalies)
+        self.assertEqual(2010, report.messages)
+
+    def test_archived(self):
+        pychro.archive_cycle(os.path.join(self.tempdir.path, '20150101'))
+        report = pychro.check_chronicle(self.tempdir.path, workers=1)
+        self.assertEqual(1, report.cycles)
+        self.assertEqual([os.path.join(self.tempdir.path, '20150101.pca')], report.skipped)
+
+    def test_tool(self):
+        self.assertEqual(0, pychro.check_main([self.tempdir.path, '--workers', '1']))
+        self.write_index_value(1, 5, 0)
+        self.assertEqual(1, pychro.check_main([self.tempdir.path, '--workers', '1']))
+
+    def test_tool_config(self):
+        base_dir = os.path.join(self.tempdir.path, 'small')
+        config = pychro.VanillaChronicleConfig(data_block_size=128*1024, index_block_size=4096, cycle_length=3600,
+                                               cycle_format='%Y%m%d%H')
+        write_chron = pychro.VanillaChronicleWriter(base_dir, config=config)
+        appender = write_chron.get_appender()
+        for i in range(2000):
+            appender.write_int(i)
+            appender.finish()
+        write_chron.close()
+        args = [base_dir, '--workers', '1', '--data-block-size', '131072', '--index-block-size', '4096',
+                '--cycle-length', '3600']
+        self.assertEqual(0, pychro.check_main(args))
+        self.assertEqual(2000, pychro.check_chronicle(base_dir, workers=1, config=config).messages)
+        self.assertRaises(SystemExit, pychro.check_main, args + ['--index-block-size', '1000'])
+
+    def test_perf_check(self):
+        tempdir = TempDir()
+        write_chron = pychro.VanillaChronicleWriter(tempdir.path)
+        appender = write_chron.get_appender()
+        n = max(NUM_WORDS, 100000)
+        for i in range(n):
+            appender.write_int(i)
+            appender.finish()
+        write_chron.close()
+        for workers in (1, 4):
+            report = pychro.check_chronicle(tempdir.path, workers=workers, chunk_entries=n//8)
+            self.assertTrue(report.ok())
+            print('%s workers %s %.0f msgs/s' % (workers, report, n/report.elapsed))
+
+
+class TestMessageExtents(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = TempDir()
+        self.write_chron = pychro.VanillaChronicleWriter(self.tempdir.path)
+        self.appender = self.write_chron.get_appender()
+
+    def tearDown(self):
+        self.write_chron.close()
+
+    def reader(self, **kwargs):
+        read_chron = pychro.VanillaChronicleReader(self.tempdir.path, **kwargs)
+        self.addCleanup(read_chron.close)
+        return read_chron
+
+    def write(self, count):
+        messages = []
+        for i in range(count):
+            self.appender.write_int(i)
+            self.appender.write_string('x'*(i % 13))
+            self.appender.finish()
+            messages += [struct.pack('i', i) + bytes([i % 13]) + b'x'*(i % 13)]
+        return messages
+
+    def test_view(self):
+        messages = self.write(20)
+        read_chron = self.reader()
+        for message in messages:
+            view = read_chron.next_message_view()
+            self.assertIsInstance(view, memoryview)
+            self.assertEqual(message, view)
+            view.release()
+        self.assertRaises(pychro.NoData, read_chron.next_message_view)
+        full_index = pychro.VanillaChronicleReader.to_full_index(read_chron.get_date(), 7)
+        self.assertEqual(messages[7], read_chron.message_view_at(full_index))
+        self.assertRaises(pychro.NoData, read_chron.message_view_at, full_index + 20)
+
+    def test_archived(self):
+        self.write_chron.close()
+        self.write_chron = pychro.VanillaChronicleWriter(self.tempdir.path,
+                                                         utcnow=lambda: datetime.datetime(2015, 1, 1, 12))
+        self.appender = self.write_chron.get_appender()
+        messages = self.write(5)
+        self.write_chron.close()
+        pychro.archive_cycle(os.path.join(self.tempdir.path, '20150101'))
+        read_chron = self.reader()
+        self.assertEqual(messages, [bytes(read_chron.next_message_view()) for _ in messages])
+        self.assertEqual(messages[3], read_chron.message_view_at(pychro.VanillaChronicleReader.to_full_index(
+            datetime.date(2015, 1, 1), 3)))
+
+    def test_unframed(self):
+        # messages of earlier pychro appenders, without lengths, ending in what could be read as one
+        messages = [(1 + i % 2, struct.pack('ii', -i-1, -7)) for i in range(10)]
+        date = datetime.date(2015, 1, 1)
+        write_unframed_cycle(self.tempdir.path, date, messages)
+        read_chron = self.reader()
+        for thread, message in messages:
+            self.assertEqual(message, read_chron.next_message_view())
+        self.assertRaises(pychro.NoData, read_chron.next_message_view)
+        full_index = pychro.VanillaChronicleReader.to_full_index(date, 9)
+        self.assertEqual(messages[9][1], read_chron.message_view_at(full_index))
+        read_chron.set_index(full_index)
+        filenum, pos, thread = read_chron._next_position()
+        self.assertRaises(pychro.InvalidArgumentError, read_chron.get_message_bytes, filenum, pos, thread)
+
+        dest_dir = os.path.join(self.tempdir.path, 'dest')
+        transports = pychro.InProcessTransport.pair()
+        sink = pychro.ReplicationSink(dest_dir, transports[1])
+        sink.start()
+        replicator = pychro.Replicator(self.tempdir.path, transports[0])
+        self.assertEqual(10, replicator.update())
+        replicator.sync()
+        replicator.close()
+        sink.join()
+        dest_chron = pychro.VanillaChronicleReader(dest_dir)
+        self.assertEqual([m for _, m in messages], [dest_chron.next_message_bytes() for _ in messages])
+        dest_chron.close()
+
+    def test_perf_view(self):
+        self.write(NUM_WORDS)
+        for name in ['next_message_bytes', 'next_message_view']:
+            read_chron = self.reader()
+            read = getattr(read_chron, name)
+            start = time.perf_counter()
+            for _ in range(NUM_WORDS):
+                read()
+            print('%s: %.0f msgs/s' % (name, NUM_WORDS/(time.perf_counter() - start)))
+
+
+# Writes the cycle of date as pychro appenders did before message lengths were written: each message
+# of a thread straight after the last in its data file, from position 4. messages are [(thread, bytes)].
+def write_unframed_cycle(base_dir, date, messages):
+    config = pychro.DEFAULT_CONFIG
+    cycle_dir = os.path.join(base_dir, config.cycle_name(config.cycle_of(date)))
+    os.makedirs(cycle_dir)
+    offset_bits = 64 - pychro.default_thread_id_bits()
+    data = dict()
+    index = b''
+    for thread, message in messages:
+        unframed = data.setdefault(thread, bytearray(4))
+        index += struct.pack('q', (thread << offset_bits) | len(unframed))
+        unframed += message
+    with open(os.path.join(cycle_dir, 'index-0'), 'wb') as fh:
+        fh.write(index.ljust(64*1024, b'\x00'))
+    for thread, unframed in data.items():
+        with open(os.path.join(cycle_dir, 'data-%s-0' % thread), 'wb') as fh:
+            fh.write(unframed.ljust(256*1024, b'\x00'))
+    return cycle_dir
+
+
+class TestDataFormat(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = TempDir()
+        self.utcnow = lambda: datetime.datetime(2015, 1, 1, 12)
+        self.messages = [(1 + i % 2, struct.pack('ii', -i-1, -7)) for i in range(10)]
+        self.cycle_dir = write_unframed_cycle(self.tempdir.path, self.utcnow(), self.messages)
+
+    def read_all(self):
+        read_chron = pychro.VanillaChronicleReader(self.tempdir.path)
+        ints = []
+        while True:
+            try:
+                reader = read_chron.next_reader()
+            except pychro.NoData:
+                break
+            ints += [(reader.read_int(), reader.read_int())]
+        read_chron.close()
+        return ints
+
+    def test_length_framing(self):
+        write_chron = pychro.VanillaChronicleWriter(self.tempdir.path, utcnow=self.utcnow)
+        appender = write_chron.get_appender()
+        appender.write_int(5)
+        appender.write_byte(1)
+        appender.finish()
+        appender.write_int(6)
+        appender.finish()
+        write_chron.close()
+        data_files = [f for f in os.listdir(self.cycle_dir) if f.startswith('data-')]
+        data_files = sorted(set(data_files) - {'data-1-0', 'data-2-0'})
+        self.assertEqual(1, len(data_files))
+        with open(os.path.join(self.cycle_dir, data_files[0]), 'rb') as fh:
+            # the complement of each length, and the next message at the following 4 byte boundary
+            self.assertEqual(struct.pack('iiBxxxii', ~5, 5, 1, ~4, 6), fh.read(20))
+
+    def test_unframed_data(self):
+        expected = [(-i-1, -7) for i in range(10)]
+        self.assertEqual(expected, self.read_all())
+        before = {f: open(os.path.join(self.cycle_dir, f), 'rb').read() for f in os.listdir(self.cycle_dir)
+                  if f.startswith('data-')}
+        # a writer continues in data files of its own beside the unframed ones
+        write_chron = pychro.VanillaChronicleWriter(self.tempdir.path, utcnow=self.utcnow)
+        appender = write_chron.get_appender()
+        for i in range(3):
+            appender.write_int(i)
+            appender.write_int(i)
+            appender.finish()
+        write_chron.close()
+        for f, data in before.items():
+            self.assertEqual(data, open(os.path.join(self.cycle_dir, f), 'rb').read())
+        self.assertEqual(expected + [(i, i) for i in range(3)], self.read_all())
+
+
 if __name__ == '__main__':
     unittest.main()